@@ -195,7 +195,7 @@ class Block(nn.Module):
 
 class Flowavenet(nn.Module):
     def __init__(self, in_channel, cin_channel, n_block, n_flow, n_layer, affine=True, pretrained=False,
-                 block_per_split=8):
+                 block_per_split=8, upsample_scales=(16, 16)):
         super().__init__()
         self.block_per_split = block_per_split
 
@@ -210,8 +210,9 @@ class Flowavenet(nn.Module):
                 in_channel *= 2
 
         self.upsample_conv = nn.ModuleList()
-        for s in [16, 16]:
-            convt = nn.ConvTranspose2d(1, 1, (3, 2 * s), padding=(1, s // 2), stride=(1, s))
+        # the product of upsample_scales is the hop size of the mels (odd scales get an odd kernel to upsample exactly)
+        for s in upsample_scales:
+            convt = nn.ConvTranspose2d(1, 1, (3, 2 * s - s % 2), padding=(1, s // 2), stride=(1, s))
             convt = nn.utils.weight_norm(convt)
             nn.init.kaiming_normal_(convt.weight)
             self.upsample_conv.append(convt)
@@ -5,9 +5,10 @@ import os
 import librosa
 from multiprocessing import cpu_count
 import argparse
+from Utils import ArtifactEncoding, MetadataIndex
 
 
-def build_from_path(in_dir, out_dir, num_workers=1):
+def build_from_path(in_dir, out_dir, num_workers=1, audio_encoding='float32', spectrogram_encoding='float32'):
     executor = ProcessPoolExecutor(max_workers=num_workers)
     futures = []
     index = 1
@@ -17,12 +18,12 @@ def build_from_path(in_dir, out_dir, num_workers=1):
             wav_path = os.path.join(in_dir, 'wavs', '%s.wav' % parts[0])
             text = parts[2]
             futures.append(executor.submit(
-                partial(_process_utterance, out_dir, index, wav_path, text)))
+                partial(_process_utterance, out_dir, index, wav_path, text, audio_encoding, spectrogram_encoding)))
             index += 1
     return [future.result() for future in futures]
 
 
-def _process_utterance(out_dir, index, wav_path, text):
+def _process_utterance(out_dir, index, wav_path, text, audio_encoding='float32', spectrogram_encoding='float32'):
     # Load the audio to a numpy array:
     wav, sr = librosa.load(wav_path, sr=22050)
 
@@ -64,18 +65,21 @@ def _process_utterance(out_dir, index, wav_path, text):
     # Write the spectrograms to disk:
     audio_filename = 'ljspeech-audio-%05d.npy' % index
     mel_filename = 'ljspeech-mel-%05d.npy' % index
-    np.save(os.path.join(out_dir, audio_filename),
-            out.astype(out_dtype), allow_pickle=False)
-    np.save(os.path.join(out_dir, mel_filename),
-            mel_spectrogram.astype(np.float32), allow_pickle=False)
-
-    # Return a tuple describing this training example:
+    audio, audio_spec = ArtifactEncoding.encode(out.astype(out_dtype), audio_encoding)
+    mel, mel_spec = ArtifactEncoding.encode(mel_spectrogram.astype(np.float32), spectrogram_encoding)
+    np.save(os.path.join(out_dir, audio_filename), audio, allow_pickle=False)
+    np.save(os.path.join(out_dir, mel_filename), mel, allow_pickle=False)
+
+    # Return a tuple describing this training example (and the encodings of its artifacts if not float32):
+    encoding_column = ArtifactEncoding.format_column([('audio', audio_spec), ('mel', mel_spec)])
+    if encoding_column is not None:
+        return audio_filename, mel_filename, timesteps, text, encoding_column
     return audio_filename, mel_filename, timesteps, text
 
 
-def preprocess(in_dir, out_dir, num_workers):
+def preprocess(in_dir, out_dir, num_workers, audio_encoding='float32', spectrogram_encoding='float32'):
     os.makedirs(out_dir, exist_ok=True)
-    metadata = build_from_path(in_dir, out_dir, num_workers)
+    metadata = build_from_path(in_dir, out_dir, num_workers, audio_encoding, spectrogram_encoding)
     write_metadata(metadata, out_dir)
 
 
@@ -83,6 +87,7 @@ def write_metadata(metadata, out_dir):
     with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
         for m in metadata:
             f.write('|'.join([str(x) for x in m]) + '\n')
+    MetadataIndex.write(os.path.join(out_dir, 'train.txt'), MetadataIndex.FLOWAVENET_LAYOUT)
     frames = sum([m[2] for m in metadata])
     sr = 22050
     hours = frames / sr / 3600
@@ -96,7 +101,11 @@ if __name__ == "__main__":
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--in_dir', '-i', type=str, default='./', help='In Directory')
     parser.add_argument('--out_dir', '-o', type=str, default='./', help='Out Directory')
+    parser.add_argument('--audio_encoding', default='float32', choices=ArtifactEncoding.AUDIO_ENCODINGS,
+                        help='On disk audio encoding')
+    parser.add_argument('--spectrogram_encoding', default='float32', choices=ArtifactEncoding.SPECTROGRAM_ENCODINGS,
+                        help='On disk mel spectrogram encoding')
     args = parser.parse_args()
 
     num_workers = cpu_count()
-    preprocess(args.in_dir, args.out_dir, num_workers)
+    preprocess(args.in_dir, args.out_dir, num_workers, args.audio_encoding, args.spectrogram_encoding)
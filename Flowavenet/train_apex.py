@@ -2,7 +2,8 @@ import torch
 from torch import optim
 import torch.nn as nn
 from torch.utils.data import DataLoader
-from Utils.data import LJspeechDataset, collate_fn, collate_fn_synthesize
+from functools import partial
+from Utils.data import LJspeechDataset, collate_fn, collate_fn_synthesize, frame_multiple
 from Flowavenet.modules.model import Flowavenet
 from torch.distributions.normal import Normal
 import numpy as np
@@ -55,6 +56,11 @@ parser.add_argument('--n_flow', type=int, default=6, help='Number of layers')
 parser.add_argument('--n_block', type=int, default=8, help='Number of layers')
 parser.add_argument('--cin_channels', type=int, default=80, help='Cin Channels')
 parser.add_argument('--block_per_split', type=int, default=4, help='Block per split')
+parser.add_argument('--metadata', type=str, default='train.txt',
+                    help='Metadata file of data_path (flowavenet.txt for the artifacts of the Tacotron preprocessing)')
+parser.add_argument('--upsample_scales', type=str, default='16,16',
+                    help='Upsampling factors of the mels, their product is the hop size (e.g. 11,25 for hop 275)')
+parser.add_argument('--sample_rate', type=int, default=22050, help='Sample rate of the audio')
 parser.add_argument('--num_workers', type=int, default=2, help='Number of workers')
 args = parser.parse_args()
 
@@ -84,16 +90,20 @@ use_cuda = torch.cuda.is_available()
 device = torch.device("cuda" if use_cuda else "cpu")
 
 # LOAD DATASETS
-train_dataset = LJspeechDataset(args.data_path, True, 0.1)
-test_dataset = LJspeechDataset(args.data_path, False, 0.1)
+upsample_scales = [int(s) for s in args.upsample_scales.split(',')]
+train_collate_fn = partial(collate_fn, hop_length=int(np.prod(upsample_scales)),
+                           frame_multiple=frame_multiple(int(np.prod(upsample_scales)), args.n_block))
+synth_collate_fn = partial(collate_fn_synthesize, hop_length=int(np.prod(upsample_scales)))
+train_dataset = LJspeechDataset(args.data_path, True, 0.1, args.metadata)
+test_dataset = LJspeechDataset(args.data_path, False, 0.1, args.metadata)
 
 train_sampler = torch.utils.data.distributed.DistributedSampler(train_dataset)
 
-train_loader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler, drop_last=True, collate_fn=collate_fn,
+train_loader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=train_sampler, drop_last=True, collate_fn=train_collate_fn,
                           num_workers=args.num_workers, pin_memory=True)
-test_loader = DataLoader(test_dataset, batch_size=args.batch_size, collate_fn=collate_fn,
+test_loader = DataLoader(test_dataset, batch_size=args.batch_size, collate_fn=train_collate_fn,
                          num_workers=args.num_workers, pin_memory=True)
-synth_loader = DataLoader(test_dataset, batch_size=1, collate_fn=collate_fn_synthesize,
+synth_loader = DataLoader(test_dataset, batch_size=1, collate_fn=synth_collate_fn,
                           num_workers=args.num_workers, pin_memory=True)
 
 
@@ -106,7 +116,8 @@ def build_model():
                        n_layer=args.n_layer,
                        affine=True,
                        pretrained=pretrained,
-                       block_per_split=args.block_per_split)
+                       block_per_split=args.block_per_split,
+                       upsample_scales=upsample_scales)
     return model
 
 
@@ -207,7 +218,7 @@ def synthesize(model):
             wav = y_gen.to(torch.device("cpu")).data.numpy()
             wav_name = '{}/{}/generate_{}_{}.wav'.format(args.sample_path, args.model_name, global_step, batch_idx)
             print('{} seconds'.format(time.time() - start_time))
-            librosa.output.write_wav(wav_name, wav, sr=22050)
+            librosa.output.write_wav(wav_name, wav, sr=args.sample_rate)
             print('{} Saved!'.format(wav_name))
             del x, c, z, q_0, y_gen, wav
 
@@ -1,10 +1,16 @@
 import os
 import argparse
+import numpy as np
 import tensorflow as tf
 from tqdm import tqdm
 from Utils.Infolog import log
 from Utils.Tacotron_synthesizer import Synthesizer
+from Utils.TextProcessing.TextBatcher import TextBatcher
+from Utils.TextProcessing.Segmenter import segment_text, balanced_batches
+from Utils.AudioProcessing.AudioPreprocess import mels_to_audio_series, save_wav
+from Utils.AudioProcessing.stitching import stitch, pause_seconds
 from Utils.Hyperparams import hparams
+from Utils import ArtifactEncoding
 
 def run_synthesis(args, checkpoint_path, output_dir, hparams):
     '''
@@ -27,6 +33,8 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
         os.makedirs(synth_dir, exist_ok=True)
 
     metadata_filename = os.path.join(args.input_dir, 'train.txt')
+    # text workers are started before the session
+    text_batcher = TextBatcher(hparams)
     synth = Synthesizer()
     synth.load(checkpoint_path, hparams, GTA=GTA)
 
@@ -45,14 +53,21 @@ def run_synthesis(args, checkpoint_path, output_dir, hparams):
     wav_dir = os.path.join(args.input_dir, 'audio')
 
     #### batch synthesizing. Need  more effort
-    with open(os.path.join(synth_dir, 'map.txt'), 'w') as file:
-        for i, meta in enumerate(tqdm(metadata)):
-            texts = [m[5] for m in meta]
+    # the texts of the next batches are converted to symbol ids while the current one is synthesized
+    batches = text_batcher.batches([m[5] for meta in metadata for m in meta], 512)
+    with text_batcher, open(os.path.join(synth_dir, 'map.txt'), 'w') as file:
+        for i, (meta, (texts, seqs)) in enumerate(tqdm(zip(metadata, batches), total=len(metadata))):
             mel_filenames = [os.path.join(mel_dir, m[1]) for m in meta]
             wav_filenames = [os.path.join(wav_dir, m[0]) for m in meta]
             basenames = [os.path.basename(m).replace('.npy', '').replace('mel-', '') for m in mel_filenames]
-            mel_output_filenames, speaker_ids = synth.synthesize(texts, basenames, synth_dir, None, mel_filenames)
-            for elems in zip(wav_filenames, mel_filenames, mel_output_filenames, speaker_ids, texts):
+            encodings = [ArtifactEncoding.parse(m) for m in meta]
+            mel_output_filenames, speaker_ids = synth.synthesize(texts, basenames, synth_dir, None, mel_filenames,
+                                                                 [e.get('mel') for e in encodings], seqs=seqs)
+            for elems, e in zip(zip(wav_filenames, mel_filenames, mel_output_filenames, speaker_ids, texts), encodings):
+                # keep the encodings of the preprocessed audio and mels, GTA mels are float32
+                encoding_column = ArtifactEncoding.format_column([(kind, e.get(kind)) for kind in ('audio', 'mel')])
+                if encoding_column is not None:
+                    elems += (encoding_column, )
                 file.write('|'.join([str(x) for x in elems]) + '\n')
 
     # with open(os.path.join(synth_dir, 'map.txt'), 'w') as file:
@@ -73,20 +88,65 @@ def run_inference(checkpoint_path, output_dir, hparams, sentences):
     os.makedirs(os.path.join(log_dir, 'wavs'), exist_ok=True)
     os.makedirs(os.path.join(log_dir, 'plots'), exist_ok=True)
     log('running inference..')
+    # text workers are started before the session
+    text_batcher = TextBatcher(hparams)
     synth = Synthesizer()
     synth.load(checkpoint_path, hparams, GTA=False)
-    sentences = [sentences[i: i + hparams.tacotron_synthesis_batch_size] for i in
-                 range(0, len(sentences), hparams.tacotron_synthesis_batch_size)]
+    batch_size = hparams.tacotron_synthesis_batch_size
+    # the sentences of the next batches are converted to symbol ids while the current one is synthesized
+    batches = text_batcher.batches(sentences, batch_size)
     ### save synthesized info to map.txt and folder
-    with open(os.path.join(inference_dir, 'map.txt'), 'w') as file:
-        for i, text in enumerate(tqdm(sentences)):
+    with text_batcher, open(os.path.join(inference_dir, 'map.txt'), 'w') as file:
+        for i, (text, seqs) in enumerate(tqdm(batches, total=(len(sentences) + batch_size - 1) // batch_size)):
             basenames = ['batch_{}_sentence_{}'.format(i, j) for j in range(len(text))]
-            mel_filename = synth.synthesize(text, basenames, inference_dir, log_dir, None)
+            mel_filename = synth.synthesize(text, basenames, inference_dir, log_dir, None, seqs=seqs)
             file.write('{}|{}\n'.format(text, mel_filename))
     log('synthesized mel spectrograms of \"{}\" at {}'.format(sentences,inference_dir))
 
     return inference_dir
 
+def run_long_form_inference(checkpoint_path, output_dir, hparams, texts):
+    '''
+    inference of long texts (paragraphs, documents): every text is cut in segments (Segmenter.segment_text), the
+    segments of all texts are synthesized in batches of similar lengths, and the audio of the segments of each text is
+    stitched back with pauses and crossfades (stitching.stitch)
+    :return: inference dir, holding map.txt (text|wav|segment mels) and wavs/long-form-<i>.wav
+    '''
+    inference_dir = os.path.join(output_dir, 'inference')
+    os.makedirs(os.path.join(inference_dir, 'wavs'), exist_ok=True)
+    log('running long-form inference..')
+    text_batcher = TextBatcher(hparams)
+    synth = Synthesizer()
+    synth.load(checkpoint_path, hparams, GTA=False)
+
+    texts = [text for text in texts if text.strip()]
+    segments = [segment_text(text, hparams.long_form_min_chars, hparams.long_form_max_chars) for text in texts]
+    ### (text index, segment index, segment) of all texts, synthesized together
+    items = [(i, j, segment) for i, text_segments in enumerate(segments) for j, (segment, _) in enumerate(text_segments)]
+    with text_batcher:
+        seqs = text_batcher.sequences([segment for _, _, segment in items])
+    log('{} texts cut in {} segments'.format(len(texts), len(items)))
+
+    mel_paths = {}
+    for batch in tqdm(balanced_batches([len(seq) for seq in seqs], hparams.long_form_batch_size)):
+        basenames = ['text_{}_segment_{}'.format(items[k][0], items[k][1]) for k in batch]
+        paths, _ = synth.synthesize([items[k][2] for k in batch], basenames, inference_dir, None, None,
+                                    seqs=[seqs[k] for k in batch])
+        mel_paths.update(zip([items[k][:2] for k in batch], paths))
+
+    with open(os.path.join(inference_dir, 'map.txt'), 'w') as file:
+        for i, (text, text_segments) in enumerate(zip(texts, segments)):
+            paths = [mel_paths[(i, j)] for j in range(len(text_segments))]
+            wavs = mels_to_audio_series([np.load(path).T for path in paths], hparams)
+            wav = stitch(wavs, [pause_seconds(boundary, hparams) for _, boundary in text_segments],
+                         hparams.sample_rate, hparams.long_form_crossfade)
+            wav_path = os.path.join(inference_dir, 'wavs', 'long-form-{}.wav'.format(i))
+            save_wav(wav, wav_path, sr=hparams.sample_rate)
+            file.write('{}|{}|{}\n'.format(text, wav_path, ','.join(paths)))
+    log('synthesized long-form audio at {}'.format(os.path.join(inference_dir, 'wavs')))
+
+    return inference_dir
+
 def tacotron_synthesize(args, hparams, checkpoint):
     output_dir = args.output_dir
     try:
@@ -107,6 +167,8 @@ def tacotron_inference(args, hparams, checkpoint, sentences):
         log('loaded model at {}'.format(checkpoint_path))
     except AttributeError:
         raise RuntimeError('Failed to load checkpoint at {}'.format(checkpoint))
+    if args.long_form:
+        return run_long_form_inference(checkpoint_path, output_dir, hparams, sentences)
     return run_inference(checkpoint_path, output_dir, hparams, sentences)
 
 def get_arguments():
@@ -123,6 +185,9 @@ def get_arguments():
     parser.add_argument('--GTA', default='True',
                         help='Ground truth aligned synthesis, defaults to True, only considered in synthesis mode')
     parser.add_argument('--speaker_id', default=None, help='speaker ids list, comma separated')
+    parser.add_argument('--long_form', action='store_true',
+                        help='inference mode: cut the sentences (paragraphs) in segments synthesized in batches, and '
+                             'stitch their audio back (one wav per line)')
     args = parser.parse_args()
     return args
 
@@ -151,7 +216,7 @@ if __name__ == '__main__':
         sentences=get_sentences(modified_hparams) ### get sentences from sentences.txt file (or in hparams)
         inference_dir = tacotron_inference(args,modified_hparams,args.checkpoint,sentences)
         ### join audio files into one file
-        if hparams.join_output_audio:
+        if hparams.join_output_audio and not args.long_form:
             inference_dir=inference_dir.replace('map.txt','').strip()
             from natsort import natsorted
             import glob
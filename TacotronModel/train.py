@@ -166,6 +166,7 @@ def initiallize_model_variables(feeder, hparams, global_step):
 		                 input_lengths=feeder.input_lengths,
 		                 mel_targets=feeder.mel_targets,
 		                 stop_token_targets=feeder.token_targets,
+		                 linear_targets=feeder.linear_targets,
 		                 targets_lengths=feeder.targets_lengths,
 		                 global_step=global_step,
 		                 is_training=True,
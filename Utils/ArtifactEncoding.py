@@ -0,0 +1,119 @@
+import argparse
+import os
+import numpy as np
+
+'''
+Compact on-disk encodings of the preprocessed artifacts.
+
+    - audio: float32 (default) or int16 PCM
+    - mel / linear spectrograms: float32 (default), float16, or uint8 / uint16 quantized over the value range of
+      the utterance
+
+Encoded artifacts are stored as their encoded array (.npy file or packed shard). The metadata row of the utterance
+(train.txt, map.txt) then ends with an encoding column, e.g.
+    enc:audio=int16;mel=uint8@-4.1:3.98
+Rows without encoding column hold float32 artifacts, so datasets mixing both stay readable.
+Loaders call decode() on what they read, which returns float32 arrays.
+
+Run this module on a float32 dataset to measure the reconstruction error of every encoding:
+    python -m Utils.ArtifactEncoding --data_dir Tacotron_input
+'''
+
+ENCODING_PREFIX = 'enc:'
+AUDIO_ENCODINGS = ('float32', 'int16')
+SPECTROGRAM_ENCODINGS = ('float32', 'float16', 'uint8', 'uint16')
+_LEVELS = {'uint8': 255, 'uint16': 65535}
+
+
+def encode(array, encoding):
+    '''Return the encoded [array] and its encoding spec (None for float32)'''
+    if encoding == 'float32':
+        return array, None
+    if encoding == 'int16':
+        return np.round(np.clip(array, -1., 1.) * 32767).astype(np.int16), 'int16'
+    if encoding == 'float16':
+        return array.astype(np.float16), 'float16'
+    if encoding in _LEVELS:
+        levels = _LEVELS[encoding]
+        low, high = float(array.min()), float(array.max())
+        scale = (high - low) / levels if high > low else 1.
+        quantized = np.round((array - low) / scale).astype(np.uint8 if encoding == 'uint8' else np.uint16)
+        return quantized, '{}@{!r}:{!r}'.format(encoding, low, scale)
+    raise ValueError('Unknown artifact encoding: {}'.format(encoding))
+
+
+def decode(array, spec):
+    '''Decode an artifact read from disk, [spec] being its encoding spec (None for float32 artifacts)'''
+    if spec is None:
+        return array
+    if spec == 'int16':
+        return array.astype(np.float32) / 32767
+    if spec == 'float16':
+        return array.astype(np.float32)
+    encoding, _, scaling = spec.partition('@')
+    if encoding in _LEVELS:
+        low, scale = (float(x) for x in scaling.split(':'))
+        return (array.astype(np.float32) * np.float32(scale) + np.float32(low)).astype(np.float32)
+    raise ValueError('Unknown artifact encoding: {}'.format(spec))
+
+
+def format_column(specs):
+    '''Metadata column of the {kind: spec} encodings of an utterance, None if all its artifacts are float32'''
+    specs = [(kind, spec) for kind, spec in specs if spec is not None]
+    if not specs:
+        return None
+    return ENCODING_PREFIX + ';'.join('{}={}'.format(kind, spec) for kind, spec in specs)
+
+
+def parse(meta):
+    '''{kind: spec} encodings of a split metadata row (empty for float32 artifacts)'''
+    if len(meta) == 0 or not meta[-1].startswith(ENCODING_PREFIX):
+        return {}
+    return dict(item.split('=', 1) for item in meta[-1][len(ENCODING_PREFIX):].split(';'))
+
+
+def measure(data_dir, max_utterances=200):
+    '''Print the reconstruction error and size of every encoding over the float32 artifacts of [data_dir]'''
+    from Utils import DatasetShards
+    with open(os.path.join(data_dir, 'train.txt'), encoding='utf-8') as f:
+        metadata = [line.strip().split('|') for line in f][:max_utterances]
+    columns = [('audio', 'audio', 0, AUDIO_ENCODINGS), ('mel', 'mels', 1, SPECTROGRAM_ENCODINGS),
+               ('linear', 'linear', 2, SPECTROGRAM_ENCODINGS)]
+    for kind, folder, column, encodings in columns:
+        arrays = []
+        for meta in metadata:
+            path = os.path.join(data_dir, folder, meta[column])
+            if parse(meta).get(kind) is None and (os.path.exists(path) or meta[column].endswith('.npy')):
+                try:
+                    array = DatasetShards.load(path, kind)
+                except (IOError, KeyError):
+                    continue
+                if array.dtype == np.float32:
+                    arrays.append(np.asarray(array))
+        if not arrays:
+            continue
+        print('{} ({} utterances)'.format(kind, len(arrays)))
+        for encoding in encodings:
+            squared_error, squared_signal, max_error, nbytes = 0., 0., 0., 0
+            for array in arrays:
+                encoded, spec = encode(array, encoding)
+                error = decode(encoded, spec) - array
+                squared_error += float(np.sum(error.astype(np.float64) ** 2))
+                squared_signal += float(np.sum(array.astype(np.float64) ** 2))
+                max_error = max(max_error, float(np.abs(error).max()))
+                nbytes += encoded.nbytes
+            snr = 10 * np.log10(squared_signal / squared_error) if squared_error > 0 else float('inf')
+            print('    {:8s} size {:6.1f} MB (compression {:.1f}x)  max error {:.3g}  SNR {:.1f} dB'.format(
+                encoding, nbytes / 2 ** 20, sum(a.nbytes for a in arrays) / nbytes, max_error, snr))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', default='Tacotron_input', help='preprocessed dataset folder (holding train.txt)')
+    parser.add_argument('--max_utterances', type=int, default=200)
+    args = parser.parse_args()
+    measure(args.data_dir, args.max_utterances)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 import argparse
-from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from functools import partial
 from multiprocessing import cpu_count
 import librosa
@@ -7,9 +7,17 @@ import librosa.filters
 import numpy as np
 from scipy.io import wavfile
 from tqdm import tqdm
-from Utils.Utils import mulaw_quantize, mulaw, is_mulaw, is_mulaw_quantize
+from Utils.Utils import mulaw_quantize, mulaw, is_mulaw, is_mulaw_quantize, inv_mulaw_quantize, inv_mulaw
 from Utils.Hyperparams import hparams
+from Utils.AudioProcessing.manifest import Manifest
+from Utils.AudioProcessing import silence
+from Utils.AudioProcessing import operators
+from Utils.AudioProcessing import streaming
+from Utils.AudioProcessing import profiler
+from Utils.DatasetShards import ShardWriter, SHARDS_DIR
+from Utils import ArtifactEncoding, MetadataIndex, PhonemeIndex
 import os
+import time
 from scipy import signal
 
 
@@ -33,7 +41,13 @@ def load_wav(path, sr):
 		sr: audio file's sample rate (22050 Hz in case of ljspeech1.1
 	output:
 		numpy array presenation of audio'''
-	return librosa.load(path, sr=sr)[0]
+	with profiler.stage('decode'):
+		wav, file_sr = librosa.load(path, sr=None)
+	if file_sr != sr:
+		# same resampling as librosa.load(path, sr=sr), timed separately
+		with profiler.stage('resample'):
+			wav = librosa.resample(wav, orig_sr=file_sr, target_sr=sr)
+	return wav
 
 
 def preemphasis(wav, k, preemphasize=True):
@@ -54,145 +68,318 @@ def save_wavenet_wav(wav, path, sr, inv_preemphasize, k):
 	wavfile.write(path, sr, wav.astype(np.int16))
 
 
+class FeatureExtractor:
+	'''Computes mel and linear spectrograms of an utterance from a single STFT.
+
+	The mel filterbank, the analysis window and the lws processor only depend on hparams,
+	they come from the operator cache (operators.py) and are reused for every utterance.
+	'''
+
+	def __init__(self, hparams):
+		self._hparams = hparams
+		self.n_fft = hparams.n_fft
+		self.hop_size = get_hop_size(hparams)
+		self.win_size = hparams.win_size if hparams.win_size is not None else hparams.n_fft
+		self.mel_basis = operators.mel_basis(hparams)
+		self.window = operators.window(hparams)
+		self.min_level = np.exp(hparams.min_level_db / 20 * np.log(10))
+		self._lws = operators.lws_processor(hparams) if hparams.use_lws else None
+
+	def stft(self, wav):
+		'''complex STFT matrix [num_freq, frames] of a time serie'''
+		if self._lws is not None:
+			return self._lws.stft(wav).T
+		return librosa.stft(y=wav, n_fft=self.n_fft, hop_length=self.hop_size, win_length=self.win_size,
+							window=self.window)
+
+	def magnitude(self, wav):
+		return np.abs(self.stft(wav))
+
+	def stream_magnitude(self, blocks):
+		'''
+		Yield the magnitude spectrogram [num_freq, frames] of a signal given as a sequence of [blocks], block by block.
+		The frames are the ones of magnitude() over the whole signal, memory is bounded by the block size.
+		'''
+		if self._lws is not None:
+			raise ValueError('Streaming feature extraction requires use_lws=False')
+		stft = streaming.StreamingSTFT(self.n_fft, self.hop_size, self.win_size, self.window)
+		for block in blocks:
+			frames = stft.process(block)
+			if frames.shape[1] > 0:
+				yield np.abs(frames)
+		yield np.abs(stft.flush())
+
+	def magnitude_to_mel(self, magnitude):
+		return self._to_db(np.dot(self.mel_basis, magnitude))
+
+	def magnitude_to_linear(self, magnitude):
+		return self._to_db(magnitude)
+
+	def extract(self, wav):
+		'''Run one STFT over [wav] and derive every feature from it
+
+		Returns:
+			- A tuple: (mel_spectrogram, linear_spectrogram, magnitude), all shaped [channels, frames]
+		'''
+		magnitude = self.magnitude(wav)
+		return self.magnitude_to_mel(magnitude), self.magnitude_to_linear(magnitude), magnitude
+
+	def _to_db(self, spectrogram):
+		S = 20 * np.log10(np.maximum(self.min_level, spectrogram)) - self._hparams.ref_level_db
+		# check for normalizing condition
+		if self._hparams.signal_normalization:
+			return _normalize(S, self._hparams)
+		return S
+
+
+def _extractor_key(hparams):
+	return (hparams.sample_rate, hparams.n_fft, get_hop_size(hparams), hparams.win_size, hparams.num_mels,
+			hparams.fmin, hparams.fmax, hparams.use_lws, hparams.min_level_db, hparams.ref_level_db,
+			hparams.signal_normalization, hparams.allow_clipping_in_normalization, hparams.symmetric_mels,
+			hparams.max_abs_value)
+
+
+def get_feature_extractor(hparams):
+	'''Return the FeatureExtractor of the current process for [hparams]'''
+	return operators.cached('feature_extractor', _extractor_key(hparams), lambda: FeatureExtractor(hparams))
+
+
+def streams_utterance(wav_path, hparams, packed=False):
+	'''
+	Whether the utterance of [wav_path] is processed block by block from its file (_process_long_utterance):
+	recordings longer than hparams.stream_stft_min_seconds (from the file header), when the artifacts are .npy files
+	(not packed) and every step works sample by sample or frame by frame (no lws, no mu-law quantization, no per
+	utterance quantized spectrograms, no separate FloWaveNet audio)
+	'''
+	if hparams.stream_stft_min_seconds is None or packed or hparams.use_lws or is_mulaw_quantize(hparams.input_type) \
+			or hparams.spectrogram_encoding not in ('float32', 'float16') or writes_raw_audio(hparams):
+		return False
+	try:
+		n_samples = streaming.num_samples(wav_path, hparams.sample_rate)
+	except RuntimeError:  # not readable by soundfile (or missing), left to load_wav
+		return False
+	return n_samples > hparams.stream_stft_min_seconds * hparams.sample_rate
+
+
+def _open_artifact(directory, filename, dtype, shape):
+	'''.npy file of [shape] written in place (its blocks are assigned as they are computed)'''
+	return np.lib.format.open_memmap(os.path.join(directory, filename), mode='w+', dtype=dtype, shape=shape)
+
+
+def _encoded_type(encoding):
+	'''dtype and spec of the artifacts of an elementwise [encoding] (float32, float16, int16)'''
+	encoded, spec = ArtifactEncoding.encode(np.zeros(1, dtype=np.float32), encoding)
+	return encoded.dtype, spec
+
+
+def _peak(wav_path, sr, start, end):
+	'''Largest absolute value of the samples [start, end) of the sound file [wav_path] at [sr] Hz'''
+	peak, position = 0., 0
+	for block in streaming.read_blocks(wav_path, sr):
+		kept = block[max(0, start - position): max(0, end - position)]
+		if len(kept):
+			peak = max(peak, float(np.abs(kept).max()))
+		position += len(block)
+	return peak
+
+
+def _process_long_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id,
+							block_frames=512):
+	'''
+	_process_utterance of a long recording (see streams_utterance), never holding its waveform nor its spectrograms
+	in memory: a first pass over the file finds the silence bounds (and the peak for rescaling), a second one feeds
+	the kept samples to the streaming STFT [block_frames] frames at a time, the audio, mel and linear blocks being
+	written into their .npy files as they are computed. Same outputs as _process_utterance up to the resampling (soxr
+	stream instead of librosa.resample) when the file has another sample rate.
+	'''
+	extractor = get_feature_extractor(hparams)
+	hop_size = get_hop_size(hparams)
+	block_size = block_frames * hop_size
+
+	# pass 1: silence bounds, then the peak of the kept samples for rescaling
+	with profiler.stage('trim'):
+		db, n_samples = streaming.frame_db_blocks(streaming.read_blocks(wav_path, hparams.sample_rate),
+												  hparams.trim_fft_size, hparams.trim_hop_size)
+		start, end = silence.bounds_from_db(db, n_samples, hparams) if hparams.trim_silence else (0, n_samples)
+		scale = hparams.rescaling_max / _peak(wav_path, hparams.sample_rate, start, end) if hparams.rescale else 1.
+	trimmed_samples = n_samples - (end - start)
+	length = end - start
+	mel_frames = 1 + length // hop_size  # frames of the centered STFT
+	if mel_frames > hparams.max_mel_frames and hparams.clip_mels_length:
+		return None, None, trimmed_samples
+
+	# audio: as np.pad(out, pad_lr(...))[:time_steps] in _process_utterance
+	fft_size = hparams.n_fft if hparams.win_size is None else hparams.win_size
+	left = fft_size - hop_size
+	time_steps = mel_frames * hop_size
+	audio_filename = 'speech-audio-{:05d}-{}.npy'.format(index, folder_id)
+	mel_filename = 'speech-mel-{:05d}-{}.npy'.format(index, folder_id)
+	audio_dtype, audio_spec = _encoded_type(hparams.audio_encoding)
+	spectrogram_dtype, spectrogram_spec = _encoded_type(hparams.spectrogram_encoding)
+	audio = _open_artifact(wav_dir, audio_filename, audio_dtype, (time_steps, ))
+	mel = _open_artifact(mel_dir, mel_filename, spectrogram_dtype, (mel_frames, hparams.num_mels))
+	linear = None
+	linear_filename = NO_LINEAR
+	if hparams.predict_linear:
+		linear_filename = 'speech-linear-{:05d}-{}.npy'.format(index, folder_id)
+		linear = _open_artifact(linear_dir, linear_filename, spectrogram_dtype, (mel_frames, hparams.num_freq))
+
+	# pass 2: kept samples -> audio and spectrogram blocks
+	def kept_blocks():
+		position, written = 0, left
+		for block in streaming.read_blocks(wav_path, hparams.sample_rate, block_size):
+			kept = block[max(0, start - position): max(0, end - position)] * scale
+			position += len(block)
+			if len(kept) == 0:
+				continue
+			out = mulaw(kept, hparams.quantize_channels) if is_mulaw(hparams.input_type) else kept
+			out = out[:max(0, time_steps - written)]
+			audio[written: written + len(out)] = ArtifactEncoding.encode(out.astype(np.float32), hparams.audio_encoding)[0]
+			written += len(out)
+			yield kept
+
+	frame = 0
+	with profiler.stage('stft'):
+		for magnitude in extractor.stream_magnitude(kept_blocks()):
+			n = magnitude.shape[1]
+			mel[frame: frame + n] = ArtifactEncoding.encode(
+				extractor.magnitude_to_mel(magnitude).astype(np.float32).T, hparams.spectrogram_encoding)[0]
+			if linear is not None:
+				linear[frame: frame + n] = ArtifactEncoding.encode(
+					extractor.magnitude_to_linear(magnitude).astype(np.float32).T, hparams.spectrogram_encoding)[0]
+			frame += n
+	assert frame == mel_frames
+	with profiler.stage('save'):
+		for artifact in (audio, mel, linear):
+			if artifact is not None:
+				artifact.flush()
+		del audio, mel, linear
+
+	row = (audio_filename, mel_filename, linear_filename, time_steps, mel_frames, text)
+	encodings = [('audio', audio_spec), ('mel', spectrogram_spec)]
+	if hparams.predict_linear:
+		encodings.append(('linear', spectrogram_spec))
+	encoding_column = ArtifactEncoding.format_column(encodings)
+	if encoding_column is not None:
+		row += (encoding_column, )
+	return row, None, trimmed_samples
+
+
+def exceeds_max_frames(wav_path, hparams):
+	'''
+	Whether the utterance of [wav_path] is sure to have more than hparams.max_mel_frames mel frames once preprocessed,
+	checked from the file header and, when silence is trimmed, from a block-wise pass over the file.
+	Used to skip long recordings without loading them (only short ones are loaded to decide exactly).
+	'''
+	if not hparams.clip_mels_length or is_mulaw_quantize(hparams.input_type):
+		# mu-law quantized utterances are trimmed again before the feature extraction
+		return False
+	hop_size = get_hop_size(hparams)
+	try:
+		n_samples = streaming.num_samples(wav_path, hparams.sample_rate)
+	except RuntimeError:  # not readable by soundfile (or missing), left to load_wav
+		return False
+	if 1 + n_samples // hop_size <= hparams.max_mel_frames + 1:
+		return False
+	if hparams.trim_silence:
+		db, n_samples = streaming.frame_db_blocks(streaming.read_blocks(wav_path, hparams.sample_rate),
+												  hparams.trim_fft_size, hparams.trim_hop_size)
+		start, end = silence.bounds_from_db(db, n_samples, hparams)
+		n_samples = end - start
+	# one frame of margin for the differences with the bounds found on the loaded wav
+	return 1 + n_samples // hop_size > hparams.max_mel_frames + 1
+
+
 def audio_series_to_mel(hparams, audio_series):
-	## explicitly load mel spectrogram parameters from hparams (for easy understanding)
-	n_fft = hparams.n_fft  # int
-	use_lws = hparams.use_lws  # boolean
-	ref_level_db = hparams.ref_level_db  # int
-	wav = audio_series
-	win_size = hparams.win_size
-	# check using Local Weighted Sum condition
-	if use_lws:
-		import lws
-		weighted_sum = lws.lws(n_fft, get_hop_size(hparams), fftsize=win_size, mode="speech")
-		D = weighted_sum.stft(wav).T
-	else:
-		D = librosa.stft(y=wav, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=win_size)
-	# require max voice frequency is less than a half of sample rate
-	assert hparams.fmax <= hparams.sample_rate // 2
-	#### transforming audio time series to mel
-	_mel_basis = librosa.filters.mel(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels, fmin=hparams.fmin, fmax=hparams.fmax)
-	linear_mel = np.dot(_mel_basis, np.abs(D))  ###
-	min_level = np.exp(hparams.min_level_db / 20 * np.log(10))
-	dp = 20 * np.log10(np.maximum(min_level, linear_mel))
-	S = dp - ref_level_db
-	# check for normalizing condition
-	if hparams.signal_normalization:
-		mel = _normalize(S, hparams)
-	else:
-		mel = S
-	return mel
+	return get_feature_extractor(hparams).extract(audio_series)[0]
 
 
 def audio_series_to_linear(hparams, audio_series):
-	## explicitly load mel spectrogram parameters from hparams (for easy understanding)
-	n_fft = hparams.n_fft  # int
-	win_size = hparams.win_size  # int
-	use_lws = hparams.use_lws  # boolean
-	ref_level_db = hparams.ref_level_db  # int
-	wav = audio_series
-	# check using Local Weighted Sum condition
-	if use_lws:
-		import lws
-		weighted_sum = lws.lws(n_fft, get_hop_size(hparams), fftsize=win_size, mode="speech")
-		D = weighted_sum.stft(wav).T
-	else:
-		D = librosa.stft(y=wav, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=win_size)
-	# require max voice frequency is less than a half of sample rate
-	assert hparams.fmax <= hparams.sample_rate // 2
-	#### transforming audio time series to mel
-	_mel_basis = librosa.filters.mel(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels,
-									 fmin=hparams.fmin, fmax=hparams.fmax)
-	linear = np.abs(D)  ###
-	min_level = np.exp(hparams.min_level_db / 20 * np.log(10))
-	dp = 20 * np.log10(np.maximum(min_level, linear))
-	S = dp - ref_level_db
-	# check for normalizing condition
-	if hparams.signal_normalization:
-		linear = _normalize(S, hparams)
-	else:
-		linear = S
-	return linear
+	extractor = get_feature_extractor(hparams)
+	return extractor.magnitude_to_linear(extractor.magnitude(audio_series))
 
 
 def linear_to_audio_serie(linear, hparams):
-	## explicitly load mel spectrogram parameters from hparams (for easy understanding)
-	n_fft = hparams.n_fft  # int
-	win_size = hparams.win_size  # int
-	use_lws = hparams.use_lws  # boolean
-	if hparams.signal_normalization:
-		S = _denormalize(linear, hparams)
-	else:
-		S = linear
-
-	dp = S + hparams.ref_level_db
-	amp = np.power(10.0, dp * 0.05)
-	D = amp
-	if use_lws:
-		import lws
-		weighted_sum = lws.lws(n_fft, get_hop_size(hparams), fftsize=win_size, mode="speech")
-		D = weighted_sum.run_lws(D.astype(np.float64).T ** hparams.power)
-		audio_series = weighted_sum.istft(D).astype(np.float32)
-		return audio_series
-	else:
-		D = D ** hparams.power
-		angles = np.exp(2j * np.pi * np.random.rand(*D.shape))
-		S_complex = np.abs(D).astype(np.complex)
-
-		print(S_complex * angles)
-		reverse_y = librosa.istft(S_complex * angles, hop_length=get_hop_size(hparams), win_length=win_size)
-		for i in range(hparams.griffin_lim_iters):
-			reverse_y = librosa.stft(y=reverse_y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams),
-									 win_length=win_size)
-			angles = np.exp(1j * np.angle(reverse_y))
-			reverse_y = librosa.istft(S_complex * angles, hop_length=get_hop_size(hparams), win_length=win_size)
-		return inv_preemphasis(reverse_y, hparams.preemphasis, hparams.preemphasize)
+	return linears_to_audio_series([linear], hparams)[0]
 
 
 def mel_to_audio_serie(mel, hparams):
-	## explicitly load mel spectrogram parameters from hparams (for easy understanding)
-	n_fft = hparams.n_fft  # int
-	win_size = hparams.win_size  # int
-	use_lws = hparams.use_lws  # boolean
+	return mels_to_audio_series([mel], hparams)[0]
+
+
+def linears_to_audio_series(linears, hparams, return_stats=False):
+	'''
+	Convert a list of linear spectrograms [num_freq, frames] to time series, Griffin-Lim runs on all of them at once.
+	The latency / quality trade-off is set by hparams.griffin_lim_iters, griffin_lim_momentum and griffin_lim_tolerance.
+	With return_stats, returns (wavs, iterations, errors) instead of wavs (see griffin_lim.GriffinLim.run)
+	'''
+	return _magnitudes_to_audio_series([_spectrogram_to_amp(linear, hparams) for linear in linears], hparams,
+									   return_stats)
+
+
+def mels_to_audio_series(mels, hparams, return_stats=False):
+	'''Convert a list of mel spectrograms [num_mels, frames] to time series (see linears_to_audio_series)'''
+	return _magnitudes_to_audio_series([_mel_to_linear(_spectrogram_to_amp(mel, hparams), hparams) for mel in mels],
+									   hparams, return_stats)
+
+
+def _spectrogram_to_amp(spectrogram, hparams):
 	if hparams.signal_normalization:
-		S = _denormalize(mel, hparams)
+		S = _denormalize(spectrogram, hparams)
 	else:
-		S = mel
-	dp = S + hparams.ref_level_db
-	amp = np.power(10.0, dp * 0.05)
-	_mel_basis = librosa.filters.mel(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels, fmin=hparams.fmin, fmax=hparams.fmax)
-	_inv_mel_basis = np.linalg.pinv(_mel_basis)
-	D = np.maximum(1e-10, np.dot(_inv_mel_basis, amp))
-
-	if use_lws:
-		import lws
-		weighted_sum = lws.lws(n_fft, get_hop_size(hparams), fftsize=win_size, mode="speech")
-		D = weighted_sum.run_lws(D.astype(np.float64).T ** hparams.power)
-		audio_series = weighted_sum.istft(D).astype(np.float32)
+		S = spectrogram
+	return np.power(10.0, (S + hparams.ref_level_db) * 0.05)
+
+
+def _magnitudes_to_audio_series(magnitudes, hparams, return_stats=False):
+	if hparams.use_lws:
+		weighted_sum = _lws_processor(hparams)
+		audio_series = []
+		for D in magnitudes:
+			D = weighted_sum.run_lws(D.astype(np.float64).T ** hparams.power)
+			audio_series.append(weighted_sum.istft(D).astype(np.float32))
+		if return_stats:
+			return audio_series, [None] * len(audio_series), [None] * len(audio_series)
 		return audio_series
-	else:
-		D = D ** hparams.power
-		angles = np.exp(2j * np.pi * np.random.rand(*D.shape))
-		S_complex = np.abs(D).astype(np.complex)
+	wavs, iterations, errors = _griffin_lim_batch([D ** hparams.power for D in magnitudes], hparams)
+	wavs = [inv_preemphasis(wav, hparams.preemphasis, hparams.preemphasize) for wav in wavs]
+	if return_stats:
+		return wavs, iterations, errors
+	return wavs
 
-		reverse_y = librosa.istft(S_complex * angles, hop_length=get_hop_size(hparams), win_length=win_size)
 
-		for i in range(hparams.griffin_lim_iters):
-			reverse_y = librosa.stft(y=reverse_y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams),
-									 win_length=win_size)
+# train.txt linear column of utterances preprocessed without linear spectrogram (hparams.predict_linear is False)
+NO_LINEAR = '<no_linear>'
 
-			angles = np.exp(1j * np.angle(reverse_y))
-			reverse_y = librosa.istft(S_complex * angles, hop_length=get_hop_size(hparams), win_length=win_size)
-		return inv_preemphasis(reverse_y, hparams.preemphasis, hparams.preemphasize)
+
+def linear_from_audio(audio, mel_frames, hparams):
+	'''
+	Compute the linear spectrogram target [mel_frames, num_freq] of an utterance from its audio artifact,
+	for datasets preprocessed without linear spectrograms
+	'''
+	if is_mulaw_quantize(hparams.input_type):
+		wav = inv_mulaw_quantize(audio, hparams.quantize_channels)
+	elif is_mulaw(hparams.input_type):
+		wav = inv_mulaw(audio, hparams.quantize_channels)
+	else:
+		wav = audio
+	# remove the left padding added by _process_utterance to align the audio with the mel frames,
+	# the end of the utterance cut by _process_utterance is zero padded
+	fft_size = hparams.n_fft if hparams.win_size is None else hparams.win_size
+	l, _ = pad_lr(wav, fft_size, get_hop_size(hparams))
+	wav = np.asarray(wav[l:], dtype=np.float32)
+	wav = np.pad(wav, (0, max(0, mel_frames * get_hop_size(hparams) - len(wav))), mode='constant')
+	linear = audio_series_to_linear(hparams, wav).astype(np.float32).T
+	return linear[:mel_frames]
 
 
-def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id):
+def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id, packed=False):
 	# print('mel_dir {}, linear_dir {}, wav_dir {}, index {}, wav_path {}, folder_id {}'.format(mel_dir, linear_dir, wav_dir, index, wav_path, folder_id))
 	"""
 	Preprocesses a single utterance wav/text pair
 	convert audio data to:
 			- audio time serie data form (numpy array)
-			- mel + linear spectrogram matrix (numpy matrix)
+			- mel + linear spectrogram matrix (numpy matrix), linear only when hparams.predict_linear
 	this writes the mel scale spectogram to disk and return a tuple to write
 	to the train.txt file
 
@@ -204,56 +391,77 @@ def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hpar
 		- wav_path: path to the audio file containing the speech input
 		- text: text spoken in the input audio file
 		- hparams: hyper parameters
+		- packed: Optional, return the artifacts instead of writing them to .npy files (they are packed into
+			shards by the caller)
 
 	Returns:
-		- A tuple: (audio_filename, mel_filename, linear_filename, time_steps, mel_frames, linear_frames, text)
+		- A tuple (row, artifacts, trimmed_samples):
+			- row: (audio_filename, mel_filename, linear_filename or NO_LINEAR, time_steps, mel_frames, text), None when the
+				utterance is skipped. An encoding column is appended when some artifacts are not float32
+				(hparams.audio_encoding, hparams.spectrogram_encoding)
+			- artifacts: when packed, a list of (kind, filename, array) to pack, None otherwise
+			- trimmed_samples: number of samples of leading and trailing silence removed
 	"""
 
 	try:
+		# Recordings too long for max_mel_frames are skipped without loading them
+		with profiler.stage('length_check'):
+			too_long = exceeds_max_frames(wav_path, hparams)
+		if too_long:
+			return None, None, 0
+		# long takes are processed block by block from the file, never loaded whole
+		if streams_utterance(wav_path, hparams, packed):
+			return _process_long_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id)
 		# Load the audio as numpy array
 		wav = load_wav(wav_path, sr=hparams.sample_rate)
 	except FileNotFoundError:  # catch missing wav exception
 		print('file {} present in csv metadata is not present in wav folder. skipping!'.format(
 			wav_path))
-		return None
-	# rescale wav
-	if hparams.rescale:
-		wav = wav / np.abs(wav).max() * hparams.rescaling_max
-	# check for Mu-law quantize
-	if is_mulaw_quantize(hparams.input_type):
-		# [0, quantize_channels)
-		out = mulaw_quantize(wav, hparams.quantize_channels)
-		# Trim silences
-		start, end = start_and_end_indices(out, hparams.silence_threshold)
-		wav = wav[start: end]
-		out = out[start: end]
-		constant_values = mulaw_quantize(0, hparams.quantize_channels)
-		out_dtype = np.int16
-	# check for mu_larw
-	elif is_mulaw(hparams.input_type):
-		# [-1, 1]
-		out = mulaw(wav, hparams.quantize_channels)
-		constant_values = mulaw(0., hparams.quantize_channels)
-		out_dtype = np.float32
+		return None, None, 0
+	# remove leading and trailing silence, it only costs training and synthesis steps
+	trimmed_samples = 0
+	with profiler.stage('trim'):
+		if hparams.trim_silence:
+			wav, trimmed_samples = silence.trim(wav, hparams)
+		# rescale wav
+		if hparams.rescale:
+			wav = wav / np.abs(wav).max() * hparams.rescaling_max
+	with profiler.stage('quantize'):
+		# check for Mu-law quantize
+		if is_mulaw_quantize(hparams.input_type):
+			# [0, quantize_channels)
+			out = mulaw_quantize(wav, hparams.quantize_channels)
+			# Trim silences
+			start, end = start_and_end_indices(out, hparams.silence_threshold)
+			trimmed_samples += len(wav) - (end - start)
+			wav = wav[start: end]
+			out = out[start: end]
+			constant_values = mulaw_quantize(0, hparams.quantize_channels)
+			out_dtype = np.int16
+		# check for mu_larw
+		elif is_mulaw(hparams.input_type):
+			# [-1, 1]
+			out = mulaw(wav, hparams.quantize_channels)
+			constant_values = mulaw(0., hparams.quantize_channels)
+			out_dtype = np.float32
 
-	else:
-		# [-1, 1]
-		out = wav
-		constant_values = 0.
-		out_dtype = np.float32
+		else:
+			# [-1, 1]
+			out = wav
+			constant_values = 0.
+			out_dtype = np.float32
 
-	# Compute the mel scale spectrogram from the wav
-	mel_spectrogram = audio_series_to_mel(hparams, wav).astype(np.float32)
+	# Compute the mel and linear scale spectrograms from a single STFT of the wav
+	extractor = get_feature_extractor(hparams)
+	with profiler.stage('stft'):
+		magnitude = extractor.magnitude(wav)
 
-	mel_frames = mel_spectrogram.shape[1]
+	mel_frames = magnitude.shape[1]
 	if mel_frames > hparams.max_mel_frames and hparams.clip_mels_length:
-		return None
+		return None, None, trimmed_samples
 
-	# Compute the linear scale spectrogram from the wav
-	linear_spectrogram = audio_series_to_linear(hparams, wav).astype(np.float32)
-	linear_frames = linear_spectrogram.shape[1]
-	# sanity check
-	assert linear_frames == mel_frames
+	with profiler.stage('mel'):
+		mel_spectrogram = extractor.magnitude_to_mel(magnitude).astype(np.float32)
 	# Ensure time resolution adjustement between audio and mel-spectrogram
 	fft_size = hparams.n_fft if hparams.win_size is None else hparams.win_size
 	l, r = pad_lr(wav, fft_size, get_hop_size(hparams))
@@ -270,15 +478,119 @@ def _process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hpar
 	# Write the spectrogram and audio to disk
 	audio_filename = 'speech-audio-{:05d}-{}.npy'.format(index, folder_id)
 	mel_filename = 'speech-mel-{:05d}-{}.npy'.format(index, folder_id)
-	linear_filename = 'speech-linear-{:05d}-{}.npy'.format(index, folder_id)
-	np.save(os.path.join(wav_dir, audio_filename), out.astype(out_dtype), allow_pickle=False)
-	np.save(os.path.join(mel_dir, mel_filename), mel_spectrogram.T, allow_pickle=False)
-	np.save(os.path.join(linear_dir, linear_filename), linear_spectrogram.T, allow_pickle=False)
+	artifacts = [('audio', audio_filename, out.astype(out_dtype)),
+				 ('mel', mel_filename, mel_spectrogram.T)]
+	if hparams.predict_linear:
+		linear_filename = 'speech-linear-{:05d}-{}.npy'.format(index, folder_id)
+		with profiler.stage('linear'):
+			linear_spectrogram = extractor.magnitude_to_linear(magnitude).astype(np.float32)
+		artifacts.append(('linear', linear_filename, linear_spectrogram.T))
+	else:
+		# the model does not use linear targets, they are ~12x the size of the mels
+		linear_filename = NO_LINEAR
+	# Optional compact encodings, decoded by the feeders from the encoding column of the row
+	with profiler.stage('encode'):
+		artifacts, encodings = encode_artifacts(artifacts, hparams)
 	# Return a tuple describing this training example
-	return (audio_filename, mel_filename, linear_filename, time_steps, mel_frames, text)
+	row = (audio_filename, mel_filename, linear_filename, time_steps, mel_frames, text)
+	encoding_column = ArtifactEncoding.format_column(encodings)
+	if encoding_column is not None:
+		row += (encoding_column, )
+	if writes_raw_audio(hparams):
+		# FloWaveNet models float time series, shared with Tacotron only when input_type is raw
+		raw = np.pad(wav, (l, r), mode='constant')[:time_steps].astype(np.float32)
+		artifacts.append(('audio', raw_audio_filename(audio_filename), ArtifactEncoding.encode(raw, hparams.audio_encoding)[0]))
+	if packed:
+		return row, artifacts, trimmed_samples
+	directories = {'audio': wav_dir, 'mel': mel_dir, 'linear': linear_dir}
+	with profiler.stage('save'):
+		for kind, filename, data in artifacts:
+			np.save(os.path.join(directories[kind], filename), data, allow_pickle=False)
+	return row, None, trimmed_samples
+
+
+# metadata of utterances whose features are extracted during training (AudioPreprocess.py --lazy)
+LAZY_METADATA = 'lazy.txt'
+
+
+# models the preprocessing can write metadata for, they all share the audio and mel artifacts of Tacotron
+PREPROCESS_MODELS = ('tacotron', 'wavenet', 'flowavenet')
+
+
+def writes_raw_audio(hparams):
+	'''Whether FloWaveNet needs raw audio artifacts besides the Tacotron ones (mu-law input_type)'''
+	return 'flowavenet' in hparams.preprocess_models and (is_mulaw(hparams.input_type) or
+														  is_mulaw_quantize(hparams.input_type))
+
+
+def raw_audio_filename(audio_filename):
+	return audio_filename.replace('speech-audio-', 'speech-raw-audio-', 1)
+
+
+def _artifact_names(row, hparams):
+	'''(kind, filename) of the artifacts written for a train.txt row'''
+	names = [(kind, name) for kind, name in zip(('audio', 'mel', 'linear'), row[:3]) if name != NO_LINEAR]
+	if writes_raw_audio(hparams):
+		names.append(('audio', raw_audio_filename(row[0])))
+	return names
+
+
+def encode_artifacts(artifacts, hparams):
+	'''Encode the (kind, filename, array) [artifacts] as set by the hparams, return them and their (kind, spec) encodings'''
+	encoded, specs = [], []
+	for kind, filename, data in artifacts:
+		if kind == 'audio':
+			# mu-law quantized audio already is int16
+			encoding = 'float32' if is_mulaw_quantize(hparams.input_type) else hparams.audio_encoding
+		else:
+			encoding = hparams.spectrogram_encoding
+		data, spec = ArtifactEncoding.encode(data, encoding)
+		encoded.append((kind, filename, data))
+		specs.append((kind, spec))
+	return encoded, specs
+
+
+def _utterances(input_dirs):
+	'''Iterate over the (folder_id, wav_name, wav_path, text) of every transcript line of [input_dirs]'''
+	for input_dir in input_dirs:
+		folder_id = os.path.basename(os.path.normpath(input_dir))  ### get speaker folder name (linux and windows)
+		with open(os.path.join(input_dir, 'transcript.txt'),
+				  encoding='utf-8') as f:  ### read input audio's file name and text to f variable
+			for line in f:
+				parts = line.strip().split('|')
+				wav_name = parts[0].strip().split('/')[1]
+				wav_path = os.path.join(input_dir, 'wavs', '{}'.format(wav_name))
+				text = parts[2]
+				yield folder_id, wav_name, wav_path, text
 
 
-def build_from_path(hparams, input_dirs, mel_dir, linear_dir, wav_dir, n_jobs=12, tqdm=lambda x: x):
+def _run_jobs(executor, jobs, max_in_flight):
+	'''
+	Submit [jobs] to [executor] with at most [max_in_flight] of them queued or running at once,
+	and yield (info, future) pairs in completion order.
+
+	Args:
+		- jobs: iterable of (callable, info) pairs, consumed lazily. Jobs without callable (None) need no work,
+			they are yielded right away with a None future
+	'''
+	pending = {}
+	for fn, info in jobs:
+		if fn is None:
+			yield info, None
+			continue
+		pending[executor.submit(fn)] = info
+		while len(pending) >= max_in_flight:
+			done, _ = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				yield pending.pop(future), future
+	while pending:
+		done, _ = wait(pending, return_when=FIRST_COMPLETED)
+		for future in done:
+			yield pending.pop(future), future
+
+
+def build_from_path(hparams, input_dirs, mel_dir, linear_dir, wav_dir, n_jobs=12, tqdm=lambda x: x, manifest=None,
+					shards=None, metadata_file=None, failed_file=None, max_in_flight=None):
 	"""
 	Preprocesses the speech dataset from a gven input path to given output directories
 
@@ -290,32 +602,95 @@ def build_from_path(hparams, input_dirs, mel_dir, linear_dir, wav_dir, n_jobs=12
 		- wav_dir: output directory of the preprocessed speech audio dataset
 		- n_jobs: Optional, number of worker process to parallelize across
 		- tqdm: Optional, provides a nice progress bar
+		- manifest: Optional, a manifest.Manifest of the output folder. Utterances it already holds
+			(same wav content, same feature hparams) are carried forward instead of being processed again
+		- shards: Optional, a DatasetShards.ShardWriter. When given, artifacts are appended to its packed
+			shards instead of being written to one .npy file each
+		- metadata_file: Optional, opened train.txt file. Rows are written to it as soon as they are ready
+		- failed_file: Optional, opened file utterances which raised an error are reported to (wav_path|error).
+			Failed utterances never abort the run, without failed_file they are only printed
+		- max_in_flight: Optional, maximum number of utterances queued or running in the workers (default: 4 * n_jobs).
+			Transcripts are read lazily, so memory use does not grow with the dataset size
 
 	Returns:
-		- A list of tuple describing the train examples. this should be written to train.txt
+		- A list of tuple describing the train examples (in completion order). this should be written to train.txt
 	"""
+	max_in_flight = max_in_flight or 4 * n_jobs
+	packed = shards is not None
+	keys = []
+
+	def jobs():
+		index = 0
+		for folder_id, wav_name, wav_path, text in _utterances(input_dirs):
+			record = None
+			if manifest is not None:
+				key = '{}/{}'.format(folder_id, wav_name)
+				keys.append(key)
+				try:
+					wav_hash, stat = manifest.source_hash(key, wav_path)
+				except FileNotFoundError:
+					pass  # reported by _process_utterance
+				else:
+					done = manifest.lookup(key, wav_hash, text)
+					if done is not None:
+						yield None, (wav_path, None, done[0])
+						continue
+					index = manifest.index_of(key)
+					record = (key, stat.st_size, stat.st_mtime, wav_hash, text, index)
+			yield partial(_process_utterance, mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id,
+						  packed=packed), (wav_path, record, None)
+			index += 1
 
 	# We use ProcessPoolExecutor to parallelize across processes, this is just for
 	# optimization purposes and it can be omited
 	executor = ProcessPoolExecutor(max_workers=n_jobs)
-	futures = []
-	index = 0
-	for input_dir in input_dirs:
-		##############################################################
-		# folder_id = input_dir.split('/')[-1]  ### get speaker folder name (in linux)
-		folder_id = input_dir.split('\\')[-1]  ### get speaker folder name (in windows)
-		##############################################################
-		with open(os.path.join(input_dir, 'transcript.txt'),
-				  encoding='utf-8') as f:  ### read input audio's file name and text to f variable
-			for line in f:
-				parts = line.strip().split('|')
-				wav_name = parts[0].strip().split('/')[1]
-				wav_path = os.path.join(input_dir, 'wavs', '{}'.format(wav_name))
-				text = parts[2]
-				futures.append(executor.submit(
-					partial(_process_utterance, mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id)))
-				index += 1
-	return [future.result() for future in tqdm(futures) if future.result() is not None]
+	metadata = []
+	failed = 0
+	trimmed_samples = 0
+	processed_samples = 0
+	last_flush = time.time()
+	for (wav_path, record, row), future in tqdm(_run_jobs(executor, jobs(), max_in_flight)):
+		if future is not None:
+			try:
+				row, packed_artifacts, trimmed = future.result()
+			except Exception as e:
+				failed += 1
+				print('failed to process {}: {}'.format(wav_path, repr(e)))
+				if failed_file is not None:
+					failed_file.write('{}|{}\n'.format(wav_path, repr(e)))
+					failed_file.flush()
+				continue
+			trimmed_samples += trimmed
+			if row is not None:
+				processed_samples += row[3]
+			if packed_artifacts is not None:
+				for kind, filename, data in packed_artifacts:
+					shards.write(kind, filename, data)
+				if time.time() - last_flush > 60:
+					# make progress of long runs visible to readers and resumable
+					shards.flush()
+					last_flush = time.time()
+		if record is not None:
+			if row is None:
+				artifacts = []
+			elif packed:
+				artifacts = ['{}/{}/{}'.format(SHARDS_DIR, kind, name) for kind, name in _artifact_names(row, hparams)]
+			else:
+				directories = {'audio': wav_dir, 'mel': mel_dir, 'linear': linear_dir}
+				artifacts = [os.path.relpath(os.path.join(directories[kind], name), manifest.out_dir)
+							 for kind, name in _artifact_names(row, hparams)]
+			manifest.add(*record, artifacts=artifacts, row=row)
+		if row is not None:
+			metadata.append(row)
+			if metadata_file is not None:
+				metadata_file.write('|'.join([str(x) for x in row]) + '\n')
+	executor.shutdown()
+	if failed:
+		print('Failed to process {} utterances'.format(failed))
+	silence.print_stats(trimmed_samples, processed_samples, hparams.sample_rate, get_hop_size(hparams))
+	if manifest is not None:
+		manifest.compact(keys)
+	return metadata
 
 
 def save_wav(wav, path, sr):
@@ -326,27 +701,16 @@ def save_wav(wav, path, sr):
 
 # From https://github.com/r9y9/Wavenet_vocoder/blob/master/utils.py
 def start_and_end_indices(quantized, silence_threshold=2):
-	for start in range(quantized.size):
-		if abs(quantized[start] - 127) > silence_threshold:
-			break
-	for end in range(quantized.size - 1, 1, -1):
-		if abs(quantized[end] - 127) > silence_threshold:
-			break
-
-	assert abs(quantized[start] - 127) > silence_threshold
-	assert abs(quantized[end] - 127) > silence_threshold
-
-	return start, end
+	return silence.start_and_end_indices(quantized, silence_threshold)
 
 
 def trim_silence(wav, hparams):
 	'''Trim leading and trailing silence
 
 	Useful for M-AILABS dataset if we choose to trim the extra 0.5 silence at beginning and end.
+	Detection is configured by hparams.trim_method (see Utils/AudioProcessing/silence.py).
 	'''
-	# Thanks @begeekmyfriend and @lautjy for pointing out the params contradiction. These params are separate and tunable per dataset.
-	return librosa.effects.trim(wav, top_db=hparams.trim_top_db, frame_length=hparams.trim_fft_size,
-								hop_length=hparams.trim_hop_size)[0]
+	return silence.trim(wav, hparams)[0]
 
 
 def get_hop_size(hparams):
@@ -357,21 +721,22 @@ def get_hop_size(hparams):
 
 
 def _lws_processor(hparams):
-	import lws
-	return lws.lws(hparams.n_fft, get_hop_size(hparams), fftsize=hparams.win_size, mode="speech")
+	return operators.lws_processor(hparams)
 
 
 def _griffin_lim(S, hparams):
-	'''librosa implementation of Griffin-Lim
-	Based on https://github.com/librosa/librosa/issues/434
+	'''Griffin-Lim reconstruction of a magnitude spectrogram [num_freq, frames]'''
+	return _griffin_lim_batch([S], hparams)[0][0]
+
+
+def _griffin_lim_batch(magnitudes, hparams):
 	'''
-	angles = np.exp(2j * np.pi * np.random.rand(*S.shape))
-	S_complex = np.abs(S).astype(np.complex)
-	y = _istft(S_complex * angles, hparams)
-	for i in range(hparams.griffin_lim_iters):
-		angles = np.exp(1j * np.angle(_stft(y, hparams)))
-		y = _istft(S_complex * angles, hparams)
-	return y
+	Griffin-Lim reconstruction of a list of magnitude spectrograms [num_freq, frames], batched and in float32
+	returns (wavs, iterations, errors)
+	'''
+	engine = operators.griffin_lim_engine(hparams)
+	return engine.run(magnitudes, hparams.griffin_lim_iters, momentum=hparams.griffin_lim_momentum,
+					  tolerance=hparams.griffin_lim_tolerance)
 
 
 def _stft(y, hparams):
@@ -382,7 +747,8 @@ def _stft(y, hparams):
 	if hparams.use_lws:
 		return _lws_processor(hparams).stft(y).T
 	else:
-		return librosa.stft(y=y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=hparams.win_size)
+		return librosa.stft(y=y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=hparams.win_size,
+							window=operators.window(hparams))
 
 
 def _istft(y, hparams):
@@ -415,28 +781,17 @@ def pad_lr(x, fsize, fshift):
 
 
 # Conversions
-_mel_basis = None
-_inv_mel_basis = None
-
-
 def _linear_to_mel(spectrogram, hparams):
-	global _mel_basis
-	if _mel_basis is None:
-		_mel_basis = _build_mel_basis(hparams)
-	return np.dot(_mel_basis, spectrogram)
+	return np.dot(operators.mel_basis(hparams), spectrogram)
 
 
 def _mel_to_linear(mel_spectrogram, hparams):
-	global _inv_mel_basis
-	if _inv_mel_basis is None:
-		_inv_mel_basis = np.linalg.pinv(_build_mel_basis(hparams))
-	return np.maximum(1e-10, np.dot(_inv_mel_basis, mel_spectrogram))
+	'''mel amplitudes to linear amplitudes, by pseudo-inverse or NNLS (hparams.mel_inversion)'''
+	return operators.mel_inverter(hparams)(mel_spectrogram)
 
 
 def _build_mel_basis(hparams):
-	assert hparams.fmax <= hparams.sample_rate // 2
-	return librosa.filters.mel(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels,
-							   fmin=hparams.fmin, fmax=hparams.fmax)
+	return operators.mel_basis(hparams)
 
 
 def _amp_to_db(x, hparams):
@@ -491,29 +846,135 @@ def preprocess(args, input_folders, out_dir, hparams):
 	linear_dir = os.path.join(out_dir, 'linear')
 	os.makedirs(mel_dir, exist_ok=True)
 	os.makedirs(wav_dir, exist_ok=True)
-	os.makedirs(linear_dir, exist_ok=True)
-
-	metadata = build_from_path(hparams, input_folders, mel_dir, linear_dir, wav_dir, args.n_jobs,
-							   tqdm=tqdm)
-	write_metadata(metadata, out_dir)
+	kinds = ('audio', 'mel')
+	if hparams.predict_linear:
+		os.makedirs(linear_dir, exist_ok=True)
+		kinds += ('linear', )
+
+	shards = ShardWriter(out_dir, kinds=kinds) if args.packed else None
+	manifest = Manifest(out_dir, hparams, shards=shards)
+	if args.force and len(manifest) > 0:
+		print('Ignoring {} previously processed utterances (--force)'.format(len(manifest)))
+		manifest.compact([])
+	elif len(manifest) > 0:
+		print('Resuming from manifest with {} processed utterances'.format(len(manifest)))
+	with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as metadata_file, \
+			open(os.path.join(out_dir, 'failed.txt'), 'w', encoding='utf-8') as failed_file:
+		metadata = build_from_path(hparams, input_folders, mel_dir, linear_dir, wav_dir, args.n_jobs,
+								   tqdm=tqdm, manifest=manifest, shards=shards, metadata_file=metadata_file,
+								   failed_file=failed_file, max_in_flight=args.max_in_flight)
+	if shards is not None:
+		shards.close()
+		print('Packed artifacts into {} ({:.2f} GB)'.format(os.path.join(out_dir, SHARDS_DIR), shards.nbytes() / 2 ** 30))
+	write_metadata(metadata, out_dir, written=True)
+	# symbol ids of the texts, loaded by the Tacotron feeder instead of running the G2P on every epoch
+	PhonemeIndex.write(MetadataIndex.MetadataIndex(os.path.join(out_dir, 'train.txt'), MetadataIndex.TACOTRON_LAYOUT), hparams)
+	write_vocoder_metadata(metadata, out_dir, hparams)
 	print('Processed audio files into: {}'.format(out_dir))
 
 
-def write_metadata(metadata, out_dir):
+def write_vocoder_metadata(metadata, out_dir, hparams):
+	'''
+	Write the metadata of the vocoders of hparams.preprocess_models, pointing to the artifacts of train.txt:
+		- wavenet: map.txt (audio|mel|mel|speaker|time_steps|mel_frames), the Wavenet_preprocessor.py layout
+		- flowavenet: flowavenet.txt (audio|mel|time_steps|text, paths relative to out_dir), the
+			Flowavenet/preprocessing.py layout, to train with --data_path out_dir --metadata flowavenet.txt
+	No artifact is computed again nor duplicated: the vocoders use the frame parameters of hparams.
+	'''
+	for model in hparams.preprocess_models:
+		if model not in PREPROCESS_MODELS:
+			raise ValueError('preprocess_models must be in {}, got {}'.format(PREPROCESS_MODELS, model))
+	raw_audio_spec = ArtifactEncoding.encode(np.zeros(1, dtype=np.float32), hparams.audio_encoding)[1]
+	if 'wavenet' in hparams.preprocess_models:
+		with open(os.path.join(out_dir, 'map.txt'), 'w', encoding='utf-8') as f:
+			for m in metadata:
+				f.write('|'.join([str(x) for x in wavenet_row(m, out_dir)]) + '\n')
+		MetadataIndex.write(os.path.join(out_dir, 'map.txt'), MetadataIndex.WAVENET_LAYOUT)
+	if 'flowavenet' in hparams.preprocess_models:
+		with open(os.path.join(out_dir, 'flowavenet.txt'), 'w', encoding='utf-8') as f:
+			for m in metadata:
+				encodings = ArtifactEncoding.parse(m)
+				if writes_raw_audio(hparams):
+					audio_name, audio_spec = raw_audio_filename(m[0]), raw_audio_spec
+				else:
+					audio_name, audio_spec = m[0], encodings.get('audio')
+				row = ('audio/' + audio_name, 'mels/' + m[1], m[3], m[5])
+				encoding_column = ArtifactEncoding.format_column([('audio', audio_spec), ('mel', encodings.get('mel'))])
+				f.write('|'.join([str(x) for x in row + ((encoding_column, ) if encoding_column else ())]) + '\n')
+		MetadataIndex.write(os.path.join(out_dir, 'flowavenet.txt'), MetadataIndex.FLOWAVENET_LAYOUT)
+
+
+def wavenet_row(m, out_dir):
+	'''map.txt row (audio|mel|mel|speaker|time_steps|mel_frames[|encodings]) of the train.txt row [m] of out_dir'''
+	encodings = ArtifactEncoding.parse(m)
+	row = (os.path.join(out_dir, 'audio', m[0]), os.path.join(out_dir, 'mels', m[1]),
+		   os.path.join(out_dir, 'mels', m[1]), '<no_g>', m[3], m[4])
+	encoding_column = ArtifactEncoding.format_column([('audio', encodings.get('audio')), ('mel', encodings.get('mel')),
+													  ('gta', encodings.get('mel'))])
+	return row + ((encoding_column, ) if encoding_column else ())
+
+
+def write_lazy_metadata(input_folders, out_dir, hparams):
+	'''
+	Write out_dir/lazy.txt, the metadata of the on the fly feature extraction mode of the feeders
+	(see Utils/AudioProcessing/feature_cache.py), without processing any audio:
+		wav path|folder id/wav name|index|time_steps|mel_frames|text
+	Lengths are the exact ones of utterances already in the manifest, else estimated from the wav header
+	(before silence trimming, -1 for unreadable files).
+	'''
+	manifest = Manifest(out_dir, hparams)
+	hop_size = get_hop_size(hparams)
+	rows = []
+	for folder_id, wav_name, wav_path, text in tqdm(_utterances(input_folders)):
+		key = '{}/{}'.format(folder_id, wav_name)
+		done = None
+		try:
+			stat = os.stat(wav_path)
+			wav_hash = manifest.recorded_hash(key, stat)
+			if wav_hash is not None:
+				done = manifest.lookup(key, wav_hash, text)
+		except OSError:
+			pass  # reported when the utterance is extracted
+		if done is not None and done[0] is None:
+			continue  # skipped by a previous extraction
+		if done is not None:
+			time_steps, mel_frames = done[0][3], done[0][4]
+		else:
+			try:
+				mel_frames = 1 + streaming.num_samples(wav_path, hparams.sample_rate) // hop_size
+				time_steps = mel_frames * hop_size
+			except Exception:
+				time_steps, mel_frames = -1, -1
+		rows.append((wav_path, key, manifest.index_of(key), time_steps, mel_frames, text))
+	metadata_filename = os.path.join(out_dir, LAZY_METADATA)
+	with open(metadata_filename, 'w', encoding='utf-8') as f:
+		for row in rows:
+			f.write('|'.join([str(x) for x in row]) + '\n')
+	MetadataIndex.write(metadata_filename, MetadataIndex.LAZY_LAYOUT)
+	PhonemeIndex.write(MetadataIndex.MetadataIndex(metadata_filename, MetadataIndex.LAZY_LAYOUT), hparams)
+	print('Write {} utterances to {}, their features are extracted by the feeders during training'.format(
+		len(rows), metadata_filename))
+
+
+def write_metadata(metadata, out_dir, written=False):
 	'''write down metadata information to train.txt file in out_dir folder
 		this metadata file holds:
 			-training data audio file name,
 			-mel spectrogram matrix file name,
-			-linear spectrogram matrix file name,
+			-linear spectrogram matrix file name (NO_LINEAR when hparams.predict_linear is False),
 			-length of audio time series array,
 			-length of spectrogram matrix
 			-and correspondent text.
 		separated by |
 		ex: 'speech-audio-00004.npy|speech-mel-00004.npy|speech-linear-00004.npy|114176|446|produced the block books, which were the immediate predecessors of the true printed book,'
+		if written is True, rows were already streamed to train.txt by build_from_path and only statistics are printed
+		the binary index of train.txt (train.index.npy, see Utils/MetadataIndex.py) is written next to it
 	'''
-	with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
-		for m in metadata:
-			f.write('|'.join([str(x) for x in m]) + '\n')
+	if not written:
+		with open(os.path.join(out_dir, 'train.txt'), 'w', encoding='utf-8') as f:
+			for m in metadata:
+				f.write('|'.join([str(x) for x in m]) + '\n')
+	MetadataIndex.write(os.path.join(out_dir, 'train.txt'), MetadataIndex.TACOTRON_LAYOUT)
 	mel_frames = sum([int(m[4]) for m in metadata])
 	timesteps = sum([int(m[3]) for m in metadata])
 	sr = hparams.sample_rate
@@ -546,7 +1007,11 @@ def get_data(args, hparams):
 def run_preprocess(args, hparams):
 	input_folders = get_data(args, hparams)
 	output_folder = os.path.join(args.base_dir, args.output)
-	preprocess(args, input_folders, output_folder, hparams)
+	if args.lazy:
+		os.makedirs(output_folder, exist_ok=True)
+		write_lazy_metadata(input_folders, output_folder, hparams)
+	else:
+		preprocess(args, input_folders, output_folder, hparams)
 
 
 def get_arguments():
@@ -559,6 +1024,14 @@ def get_arguments():
 	parser.add_argument('--dataset', default='Train_data')  # audio data folder to be used
 	parser.add_argument('--output', default='Tacotron_input')  # output folder - which holds Tacotron training data
 	parser.add_argument('--n_jobs', type=int, default=cpu_count())  # number of cpu use for multiprocessing
+	parser.add_argument('--force', action='store_true',
+						help='Reprocess every utterance instead of reusing the ones recorded in manifest.jsonl')
+	parser.add_argument('--max_in_flight', type=int, default=None,
+						help='Maximum number of utterances queued in the workers at once (default: 4 * n_jobs)')
+	parser.add_argument('--packed', action='store_true',
+						help='Pack artifacts into a few large memory mapped shards instead of one .npy file per artifact')
+	parser.add_argument('--lazy', action='store_true',
+						help='Only write lazy.txt: features are extracted by the training feeders and cached in the output folder')
 	args = parser.parse_args()
 	return args
 
@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import librosa
+import numpy as np
+from scipy.io import wavfile
+from Utils.Hyperparams import hparams
+from Utils.AudioProcessing import AudioPreprocess, profiler
+from Utils.AudioProcessing.manifest import FEATURE_HPARAMS
+from Utils.DatasetShards import ShardWriter
+
+'''
+Throughput benchmark of the audio preprocessing (AudioPreprocess.py), on a synthetic corpus.
+
+	python -m Utils.AudioProcessing.benchmark --n_utterances 200 --n_jobs 1,2,4 --output bench.json
+
+	- a corpus of sine (or noise) utterances of random lengths, with leading and trailing silence and fake
+		transcripts, is generated in the Train_data layout (<speaker>/wavs/*.wav, <speaker>/transcript.txt)
+	- stages: every utterance is processed once by _process_utterance in this process, with the stage timer of
+		profiler.py on, which gives the wall time of each stage (decode, resample, trim, stft, mel, save...)
+	- scaling: build_from_path, the real preprocessing pipeline, is run on the corpus for every --n_jobs value,
+		giving utterances and audio seconds per second (per core) and the bytes written
+The results are printed and saved as json. With --baseline (the json of a previous run), the throughput of each
+worker count is compared to it, and the command fails when it regressed by more than --max_regression.
+'''
+
+CORPUS_SIGNALS = ('sine', 'noise')
+
+
+def make_corpus(root, n_utterances=200, min_seconds=1., max_seconds=5., signal='sine', sample_rate=None,
+				n_speakers=1, seed=0):
+	'''
+	Write a synthetic corpus of [n_utterances] 16 bits wavs of uniform random lengths into [root]
+
+	Returns:
+		- A tuple (input_dirs, audio_seconds)
+	'''
+	if signal not in CORPUS_SIGNALS:
+		raise ValueError('signal must be in {}, got {}'.format(CORPUS_SIGNALS, signal))
+	sample_rate = sample_rate or hparams.sample_rate
+	rng = np.random.RandomState(seed)
+	input_dirs, audio_seconds = [], 0.
+	for speaker in range(n_speakers):
+		folder_id = str(speaker + 1)
+		input_dir = os.path.join(root, folder_id)
+		os.makedirs(os.path.join(input_dir, 'wavs'), exist_ok=True)
+		with open(os.path.join(input_dir, 'transcript.txt'), 'w', encoding='utf-8') as f:
+			for i in range(speaker, n_utterances, n_speakers):
+				seconds = rng.uniform(min_seconds, max_seconds)
+				n = int(seconds * sample_rate)
+				if signal == 'sine':
+					t = np.arange(n) / sample_rate
+					speech = np.sin(2 * np.pi * rng.uniform(100, 400) * t) * (0.5 + 0.3 * np.sin(2 * np.pi * 3 * t))
+				else:
+					speech = rng.uniform(-1, 1, n)
+				# silences for the trimming stage
+				silence = np.zeros(int(rng.uniform(0.1, 0.5) * sample_rate))
+				wav = np.concatenate([silence, 0.5 * speech, silence])
+				wav_name = '{}_{:05d}.wav'.format(folder_id, i)
+				wavfile.write(os.path.join(input_dir, 'wavs', wav_name), sample_rate, (wav * 32767).astype(np.int16))
+				text = '벤치마크 문장 {}'.format(i)
+				f.write('{}/{}|{}|{}|{}|{:.2f}|benchmark sentence\n'.format(folder_id, wav_name, text, text, text,
+																			len(wav) / sample_rate))
+				audio_seconds += len(wav) / sample_rate
+		input_dirs.append(input_dir)
+	return input_dirs, audio_seconds
+
+
+def _output_dirs(out_dir):
+	dirs = [os.path.join(out_dir, name) for name in ('mels', 'linear', 'audio')]
+	for directory in dirs:
+		os.makedirs(directory, exist_ok=True)
+	return dirs
+
+
+def _disk_usage(directory):
+	return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def profile_stages(input_dirs, out_dir, hparams):
+	'''Wall time of each stage of _process_utterance over the corpus, in this process'''
+	mel_dir, linear_dir, wav_dir = _output_dirs(out_dir)
+	# operators and lazily imported decoders / resamplers are set up on the first utterance, out of the measure
+	for folder_id, _, wav_path, text in AudioPreprocess._utterances(input_dirs):
+		AudioPreprocess._process_utterance(mel_dir, linear_dir, wav_dir, 0, wav_path, text, hparams, folder_id)
+		break
+	profiler.enable()
+	start = time.perf_counter()
+	utterances = 0
+	for index, (folder_id, _, wav_path, text) in enumerate(AudioPreprocess._utterances(input_dirs)):
+		AudioPreprocess._process_utterance(mel_dir, linear_dir, wav_dir, index, wav_path, text, hparams, folder_id)
+		utterances += 1
+	total = time.perf_counter() - start
+	stages = profiler.stats()
+	profiler.disable()
+	for stats in stages.values():
+		stats['ms_per_utterance'] = 1000 * stats['seconds'] / max(1, utterances)
+		stats['share'] = stats['seconds'] / total
+	other = total - sum(stats['seconds'] for stats in stages.values())
+	stages['other'] = {'seconds': other, 'calls': utterances, 'ms_per_utterance': 1000 * other / max(1, utterances),
+					   'share': other / total}
+	return {'utterances': utterances, 'seconds': total, 'stages': stages}
+
+
+def run_pipeline(input_dirs, out_dir, hparams, n_jobs, packed=False, audio_seconds=None):
+	'''Throughput of build_from_path with [n_jobs] workers, writing into the empty folder [out_dir]'''
+	mel_dir, linear_dir, wav_dir = _output_dirs(out_dir)
+	shards = ShardWriter(out_dir) if packed else None
+	start = time.perf_counter()
+	metadata = AudioPreprocess.build_from_path(hparams, input_dirs, mel_dir, linear_dir, wav_dir, n_jobs=n_jobs,
+											   shards=shards)
+	if shards is not None:
+		shards.close()
+	seconds = time.perf_counter() - start
+	result = {'n_jobs': n_jobs, 'packed': packed, 'seconds': seconds, 'utterances': len(metadata),
+			  'utterances_per_second': len(metadata) / seconds,
+			  'utterances_per_second_per_core': len(metadata) / seconds / n_jobs,
+			  'bytes_written': _disk_usage(out_dir)}
+	if audio_seconds is not None:
+		result['audio_seconds_per_second'] = audio_seconds / seconds
+	return result
+
+
+def environment():
+	return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+			'numpy': np.__version__, 'librosa': librosa.__version__}
+
+
+def compare(results, baseline, max_regression):
+	'''Relative throughput change of every worker count of [results] also in [baseline], and the regressed ones'''
+	previous = {(r['n_jobs'], r['packed']): r for r in baseline.get('scaling', [])}
+	changes, regressions = [], []
+	for r in results['scaling']:
+		before = previous.get((r['n_jobs'], r['packed']))
+		if before is None:
+			continue
+		change = r['utterances_per_second'] / before['utterances_per_second'] - 1
+		changes.append({'n_jobs': r['n_jobs'], 'packed': r['packed'], 'change': change})
+		if change < -max_regression:
+			regressions.append(r['n_jobs'])
+	return changes, regressions
+
+
+def benchmark(args, hparams):
+	work_dir = tempfile.mkdtemp(prefix='preprocess_benchmark_', dir=args.work_dir)
+	try:
+		input_dirs, audio_seconds = make_corpus(os.path.join(work_dir, 'corpus'), args.n_utterances,
+												args.min_seconds, args.max_seconds, args.signal,
+												args.corpus_sample_rate or hparams.sample_rate, args.n_speakers,
+												args.seed)
+		results = {'corpus': {'utterances': args.n_utterances, 'audio_seconds': audio_seconds,
+							  'min_seconds': args.min_seconds, 'max_seconds': args.max_seconds, 'signal': args.signal,
+							  'sample_rate': args.corpus_sample_rate or hparams.sample_rate},
+				   'hparams': {name: value for name, value in hparams.values().items() if name in FEATURE_HPARAMS},
+				   'environment': environment()}
+		results['stages'] = profile_stages(input_dirs, os.path.join(work_dir, 'stages'), hparams)
+		results['scaling'] = []
+		for n_jobs in args.n_jobs:
+			out_dir = os.path.join(work_dir, 'out-{}'.format(n_jobs))
+			results['scaling'].append(run_pipeline(input_dirs, out_dir, hparams, n_jobs, args.packed, audio_seconds))
+			shutil.rmtree(out_dir)
+	finally:
+		if not args.keep:
+			shutil.rmtree(work_dir)
+	return results
+
+
+def report(results):
+	stages = results['stages']
+	print('\nStages ({} utterances, {:.1f} s of audio, 1 process):'.format(stages['utterances'],
+																		 results['corpus']['audio_seconds']))
+	for name, stats in sorted(stages['stages'].items(), key=lambda item: -item[1]['seconds']):
+		print('  {:<14}{:>10.2f} ms/utt {:>7.1%}'.format(name, stats['ms_per_utterance'], stats['share']))
+	print('\n  {:>6} {:>10} {:>10} {:>14} {:>12} {:>12}'.format('n_jobs', 'seconds', 'utt/s', 'utt/s/core',
+																 'audio s/s', 'MB written'))
+	for r in results['scaling']:
+		print('  {:>6} {:>10.2f} {:>10.2f} {:>14.2f} {:>12.1f} {:>12.1f}'.format(
+			r['n_jobs'], r['seconds'], r['utterances_per_second'], r['utterances_per_second_per_core'],
+			r.get('audio_seconds_per_second', 0.), r['bytes_written'] / 2 ** 20))
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Preprocessing throughput benchmark on a synthetic corpus')
+	parser.add_argument('--hparams', default='',
+						help='Hyperparameter overrides as a comma-separated list of name=value pairs')
+	parser.add_argument('--n_utterances', type=int, default=200)
+	parser.add_argument('--min_seconds', type=float, default=1.)
+	parser.add_argument('--max_seconds', type=float, default=5.)
+	parser.add_argument('--signal', default='sine', choices=CORPUS_SIGNALS)
+	parser.add_argument('--corpus_sample_rate', type=int, default=None,
+						help='Sample rate of the generated wavs (default: hparams.sample_rate, no resampling)')
+	parser.add_argument('--n_speakers', type=int, default=1)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--n_jobs', default='1,{}'.format(os.cpu_count()),
+						help='Comma separated worker counts of the scaling runs')
+	parser.add_argument('--packed', action='store_true', help='Pack the artifacts into shards in the scaling runs')
+	parser.add_argument('--work_dir', default=None, help='Folder of the corpus and outputs (default: system temp)')
+	parser.add_argument('--keep', action='store_true', help='Keep the generated corpus')
+	parser.add_argument('--output', default=None, help='json file the results are written to')
+	parser.add_argument('--baseline', default=None, help='json results of a previous run to compare with')
+	parser.add_argument('--max_regression', type=float, default=0.1,
+						help='Relative throughput loss against the baseline which fails the benchmark')
+	args = parser.parse_args()
+	args.n_jobs = sorted(set(int(n) for n in args.n_jobs.split(',')))
+	modified_hp = hparams.parse(args.hparams)
+
+	results = benchmark(args, modified_hp)
+	report(results)
+	regressions = []
+	if args.baseline is not None:
+		with open(args.baseline, encoding='utf-8') as f:
+			changes, regressions = compare(results, json.load(f), args.max_regression)
+		results['baseline'] = {'path': args.baseline, 'changes': changes}
+		for change in changes:
+			print('  n_jobs {}: {:+.1%} utt/s against {}'.format(change['n_jobs'], change['change'], args.baseline))
+	if args.output is not None:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+	if regressions:
+		print('Throughput regressed by more than {:.0%} for n_jobs {}'.format(args.max_regression, regressions))
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
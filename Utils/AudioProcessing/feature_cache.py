@@ -0,0 +1,131 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from Utils.AudioProcessing import AudioPreprocess
+from Utils.AudioProcessing.manifest import Manifest, hash_file
+
+'''
+On the fly feature extraction for the training feeders.
+
+AudioPreprocess.py --lazy only writes <out_dir>/lazy.txt (see MetadataIndex.LAZY_LAYOUT), which points at the source
+wavs. When a feeder is given lazy.txt, the lines of the utterances it samples are resolved by FeatureCache.rows():
+	- utterances already extracted (same wav content and feature hparams, artifacts still on disk) are read from
+		<out_dir>/manifest.jsonl, the bookkeeping of AudioPreprocess.py
+	- the others are extracted by _process_utterance in a pool of worker processes, their artifacts are written to
+		<out_dir>/audio, mels and linear and their train.txt row is recorded in the manifest
+The feeders submit() the next group of utterances as soon as the current one is loaded, so during the first epoch the
+features of a group are extracted while the model trains on the previous one. Later epochs (and later runs, lazy or
+after an AudioPreprocess.py run on the same folder) only load them.
+'''
+
+
+def _extract(out_dir, hparams, wav_path, key, index, text):
+	'''Worker job: features of one utterance, returns (wav_size, wav_mtime, wav_hash, train.txt row or None)'''
+	stat = os.stat(wav_path)
+	wav_hash = hash_file(wav_path)
+	folder_id = key.rsplit('/', 1)[0]
+	row, _, _ = AudioPreprocess._process_utterance(os.path.join(out_dir, 'mels'), os.path.join(out_dir, 'linear'),
+												   os.path.join(out_dir, 'audio'), index, wav_path, text, hparams,
+												   folder_id)
+	return stat.st_size, stat.st_mtime, wav_hash, row
+
+
+class FeatureCache:
+	'''
+		train.txt rows of lazy.txt lines, extracted on first use.
+	'''
+
+	def __init__(self, out_dir, hparams, n_jobs=None):
+		self.out_dir = out_dir
+		self._hparams = hparams
+		self._n_jobs = n_jobs or hparams.lazy_extraction_jobs or multiprocessing.cpu_count()
+		self._manifest = Manifest(out_dir, hparams)
+		# rows resolved by this process, None for skipped (too long) or failed utterances
+		self._rows = {}
+		# extractions submitted and not collected yet: key -> (lazy.txt line, future)
+		self._pending = {}
+		self._executor = None
+		# guards the bookkeeping (rows, pending, manifest), never held while waiting for an extraction
+		self._lock = threading.Lock()
+		os.makedirs(os.path.join(out_dir, 'mels'), exist_ok=True)
+		os.makedirs(os.path.join(out_dir, 'audio'), exist_ok=True)
+		if hparams.predict_linear:
+			os.makedirs(os.path.join(out_dir, 'linear'), exist_ok=True)
+
+	def submit(self, metas):
+		'''Start the extraction of the lazy.txt lines [metas] not extracted yet, without waiting for it'''
+		with self._lock:
+			for meta in metas:
+				key = meta[1]
+				if key in self._rows or key in self._pending:
+					continue
+				done = self._lookup(meta)
+				if done is not None:
+					self._rows[key] = done[0]
+					continue
+				if self._executor is None:
+					# spawned workers: the training process already runs the threads of the framework
+					self._executor = ProcessPoolExecutor(max_workers=self._n_jobs,
+														 mp_context=multiprocessing.get_context('spawn'))
+				self._pending[key] = (meta, self._executor.submit(_extract, self.out_dir, self._hparams, meta[0], key,
+																  int(meta[2]), meta[5]))
+
+	def rows(self, metas):
+		'''
+		train.txt rows (lists of str) of the lazy.txt lines [metas], None for utterances without features. Lines not
+		submitted yet are submitted, then the extractions they need are waited for
+		'''
+		self.submit(metas)
+		with self._lock:
+			pending = {meta[1]: self._pending[meta[1]] for meta in metas if meta[1] in self._pending}
+		for key, (meta, future) in pending.items():
+			try:
+				result = future.result()
+			except Exception as e:
+				result = e
+			with self._lock:
+				# another thread may have collected it meanwhile
+				if self._pending.pop(key, None) is not None:
+					self._record(meta, result)
+		with self._lock:
+			return [self._rows[meta[1]] for meta in metas]
+
+	def _lookup(self, meta):
+		wav_path, key, _, _, _, text = meta[:6]
+		try:
+			wav_hash = self._manifest.recorded_hash(key, os.stat(wav_path))
+		except OSError:
+			return None
+		if wav_hash is None:
+			return None
+		done = self._manifest.lookup(key, wav_hash, text)
+		if done is None or done[0] is None:
+			return done
+		return ([str(x) for x in done[0]], )
+
+	def _record(self, meta, result):
+		'''Record the _extract [result] (or its exception) of the lazy.txt line [meta], under the lock'''
+		wav_path, key, index, _, _, text = meta[:6]
+		if isinstance(result, Exception):
+			# not recorded: retried by the next run
+			print('failed to process {}: {}'.format(wav_path, repr(result)))
+			self._rows[key] = None
+			return
+		wav_size, wav_mtime, wav_hash, row = result
+		artifacts = []
+		if row is not None:
+			directories = {'audio': 'audio', 'mel': 'mels', 'linear': 'linear'}
+			artifacts = ['{}/{}'.format(directories[kind], name) for kind, name in AudioPreprocess._artifact_names(row, self._hparams)]
+		self._manifest.add(key, wav_size, wav_mtime, wav_hash, text, int(index), artifacts, row)
+		self._rows[key] = [str(x) for x in row] if row is not None else None
+
+	def close(self):
+		if self._executor is not None:
+			self._executor.shutdown()
+			self._executor = None
+		self._manifest.close()
+
+
+def is_lazy_metadata(metadata_filename):
+	return os.path.basename(metadata_filename) == AudioPreprocess.LAZY_METADATA
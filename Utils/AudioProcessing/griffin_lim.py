@@ -0,0 +1,149 @@
+import numpy as np
+
+try:
+	from scipy import fft as _fft
+	_FFT_KWARGS = {'workers': -1}  # multithreaded FFTs, single precision is kept
+except ImportError:  # scipy < 1.4
+	_fft = np.fft
+	_FFT_KWARGS = {}
+
+'''
+Batched Griffin-Lim phase reconstruction, with an optional Fast Griffin-Lim (momentum) mode and early stopping.
+
+Spectrograms of different lengths are zero padded to the longest one of their batch, and all the STFT / inverse STFT
+of an iteration run as one batched real FFT in float32 / complex64. The analysis window and the overlap-add window
+normalisation only depend on the STFT parameters and are computed once (engines are cached by operators.py).
+STFT conventions are the ones of librosa (centered frames, hann window of win_size padded to n_fft).
+'''
+
+
+class GriffinLim:
+	'''
+		Griffin-Lim engine for a given STFT configuration (n_fft, hop_size, win_size).
+	'''
+
+	def __init__(self, n_fft, hop_size, win_size=None):
+		self.n_fft = n_fft
+		self.hop_size = hop_size
+		self.win_size = win_size if win_size is not None else n_fft
+		n = np.arange(self.win_size)
+		window = 0.5 - 0.5 * np.cos(2 * np.pi * n / self.win_size)  # periodic hann window
+		left = (n_fft - self.win_size) // 2
+		self.window = np.pad(window, (left, n_fft - self.win_size - left), mode='constant').astype(np.float32)
+		self._window_sums = {}
+
+	def stft(self, y):
+		'''complex64 STFT [batch, frames, num_freq] of a batch of time series [batch, samples]'''
+		pad = self.n_fft // 2
+		y = np.pad(np.asarray(y, dtype=np.float32), ((0, 0), (pad, pad)), mode='reflect')
+		n_frames = 1 + (y.shape[1] - self.n_fft) // self.hop_size
+		frames = np.lib.stride_tricks.as_strided(
+			y, shape=(y.shape[0], n_frames, self.n_fft),
+			strides=(y.strides[0], y.strides[1] * self.hop_size, y.strides[1]), writeable=False)
+		return _fft.rfft(frames * self.window, n=self.n_fft, axis=-1, **_FFT_KWARGS)
+
+	def istft(self, stft_matrix):
+		'''time series [batch, (frames - 1) * hop_size] of a batch of STFT [batch, frames, num_freq]'''
+		batch, n_frames, _ = stft_matrix.shape
+		frames = _fft.irfft(stft_matrix, n=self.n_fft, axis=-1, **_FFT_KWARGS).astype(np.float32, copy=False)
+		frames *= self.window
+		y = self._overlap_add(frames)
+		y /= self._window_sum(n_frames)
+		pad = self.n_fft // 2
+		return y[:, pad: pad + (n_frames - 1) * self.hop_size]
+
+	def _overlap_add(self, frames):
+		# add the frames chunk by chunk of hop_size samples: ceil(n_fft / hop_size) vectorized additions
+		batch, n_frames, n_fft = frames.shape
+		hop = self.hop_size
+		n_chunks = -(-n_fft // hop)
+		y = np.zeros((batch, n_frames + n_chunks, hop), dtype=np.float32)
+		for k in range(n_chunks):
+			chunk = frames[:, :, k * hop: (k + 1) * hop]
+			y[:, k: k + n_frames, :chunk.shape[2]] += chunk
+		return y.reshape(batch, -1)[:, :n_fft + hop * (n_frames - 1)]
+
+	def _window_sum(self, n_frames):
+		'''squared window overlap-add of [n_frames] frames (tiny values replaced by 1 as librosa does)'''
+		if n_frames not in self._window_sums:
+			window_sum = self._overlap_add(np.broadcast_to(self.window ** 2, (1, n_frames, self.n_fft)))[0]
+			window_sum[window_sum < np.finfo(np.float32).tiny] = 1.
+			if len(self._window_sums) > 64:
+				self._window_sums.clear()
+			self._window_sums[n_frames] = window_sum
+		return self._window_sums[n_frames]
+
+	def run(self, magnitudes, n_iters, momentum=0., tolerance=None, batch_size=16):
+		'''
+		Reconstruct time series from linear magnitude spectrograms
+
+		Args:
+			- magnitudes: list of magnitude spectrograms [num_freq, frames] (frames may differ)
+			- n_iters: maximum number of iterations
+			- momentum: Optional, Fast Griffin-Lim momentum (0.99 is usual), 0 runs the classic Griffin-Lim
+			- tolerance: Optional, an utterance stops iterating as soon as its spectral convergence
+				(||S - |STFT(y)||| / ||S||) is below tolerance. None always runs n_iters iterations
+			- batch_size: Optional, number of spectrograms reconstructed together
+
+		Returns:
+			- A tuple (wavs, iterations, errors), in the order of [magnitudes]:
+				- wavs: float32 time series, (frames - 1) * hop_size samples each
+				- iterations: number of iterations run for each utterance
+				- errors: final spectral convergence of each utterance
+		'''
+		# batch spectrograms of similar lengths together to limit padding
+		order = sorted(range(len(magnitudes)), key=lambda i: magnitudes[i].shape[1])
+		wavs = [None] * len(magnitudes)
+		iterations = [0] * len(magnitudes)
+		errors = [0.] * len(magnitudes)
+		for start in range(0, len(order), batch_size):
+			indices = order[start: start + batch_size]
+			lengths = [magnitudes[i].shape[1] for i in indices]
+			batch = self._pad([magnitudes[i] for i in indices])
+			for b, y, n_iter, error in self._run_batch(batch, lengths, n_iters, momentum, tolerance):
+				i = indices[b]
+				wavs[i] = y[:(lengths[b] - 1) * self.hop_size]
+				iterations[i] = n_iter
+				errors[i] = error
+		return wavs, iterations, errors
+
+	def _pad(self, magnitudes):
+		# [batch, frames, num_freq] float32, zero magnitude in the padded frames
+		n_frames = max(m.shape[1] for m in magnitudes)
+		batch = np.zeros((len(magnitudes), n_frames, self.n_fft // 2 + 1), dtype=np.float32)
+		for b, m in enumerate(magnitudes):
+			batch[b, :m.shape[1]] = np.abs(m).T
+		return batch
+
+	def _run_batch(self, S, lengths, n_iters, momentum, tolerance):
+		'''
+		Fast Griffin-Lim (Perraudin et al., 2013) on a padded batch, classic Griffin-Lim when momentum is 0.
+		Yields (batch index, wav, iterations, spectral convergence) of every utterance as soon as it is done,
+		finished utterances are removed from the batch.
+		'''
+		active = np.arange(S.shape[0])
+		mask = (np.arange(S.shape[1])[None, :] < np.array(lengths)[:, None]).astype(np.float32)[:, :, None]
+		S_norm = np.sqrt(np.sum(S.astype(np.float64) ** 2, axis=(1, 2)))
+		angles = np.exp(2j * np.pi * np.random.rand(*S.shape)).astype(np.complex64)
+		rebuilt = np.zeros_like(angles)
+		accelerate = momentum / (1 + momentum)
+		for i in range(n_iters + 1):
+			y = self.istft(S * angles)
+			previous = rebuilt
+			rebuilt = self.stft(y)
+			# spectral convergence of the current estimates (padded frames excluded)
+			diff = (np.abs(rebuilt) - S) * mask
+			error = np.sqrt(np.sum(diff.astype(np.float64) ** 2, axis=(1, 2))) / np.maximum(S_norm, 1e-8)
+			done = error <= tolerance if tolerance is not None else np.zeros(len(active), dtype=bool)
+			if i == n_iters:
+				done[:] = True
+			for b in np.flatnonzero(done):
+				yield active[b], y[b], i, float(error[b])
+			if done.all():
+				return
+			if done.any():
+				keep = ~done
+				active, S, mask, S_norm = active[keep], S[keep], mask[keep], S_norm[keep]
+				rebuilt, previous = rebuilt[keep], previous[keep]
+			angles = rebuilt - accelerate * previous if momentum else rebuilt
+			angles /= np.maximum(np.abs(angles), 1e-8)
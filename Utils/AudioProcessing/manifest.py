@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+
+'''
+Bookkeeping for incremental preprocessing.
+
+AudioPreprocess.py records every processed utterance in <out_dir>/manifest.jsonl (one json record per line):
+	- key: speaker folder and wav name of the utterance
+	- wav_size, wav_mtime, wav_hash: identity of the source wav (sha1 of its content)
+	- text: transcript of the utterance
+	- hparams_hash: hash of the hparams the features depend on
+	- index: numeric index used in the artifact file names
+	- artifacts: output files of the utterance, relative to out_dir (shards/<kind>/<name> for packed artifacts)
+	- row: the train.txt row of the utterance (null when the utterance was skipped)
+
+Records are appended as soon as an utterance is done, so an interrupted run can be resumed,
+and on a rerun only new or changed utterances are processed again. The last record of a key wins.
+'''
+
+# hparams which change the content of the preprocessed artifacts
+FEATURE_HPARAMS = ['sample_rate', 'n_fft', 'hop_size', 'win_size', 'frame_shift_ms', 'num_mels', 'fmin', 'fmax',
+				   'min_level_db', 'ref_level_db', 'signal_normalization', 'allow_clipping_in_normalization',
+				   'symmetric_mels', 'max_abs_value', 'use_lws', 'rescale', 'rescaling_max', 'trim_silence',
+				   'trim_fft_size', 'trim_hop_size', 'trim_top_db', 'trim_method', 'trim_energy_db',
+				   'silence_threshold', 'input_type', 'quantize_channels', 'clip_mels_length', 'max_mel_frames',
+				   'preemphasize', 'preemphasis', 'predict_linear', 'audio_encoding', 'spectrogram_encoding',
+				   'preprocess_models']
+
+
+def hash_file(path, block_size=1 << 20):
+	'''sha1 of the content of file [path]'''
+	sha = hashlib.sha1()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(block_size), b''):
+			sha.update(block)
+	return sha.hexdigest()
+
+
+def hparams_hash(hparams, names=FEATURE_HPARAMS):
+	'''sha1 of the hparams values listed in [names] (missing hparams are ignored)'''
+	values = hparams.values()
+	relevant = {name: values[name] for name in names if name in values}
+	return hashlib.sha1(json.dumps(relevant, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+	'''
+		Remembers processed utterances of an output folder between preprocessing runs.
+	'''
+
+	def __init__(self, out_dir, hparams, filename='manifest.jsonl', shards=None):
+		self.out_dir = out_dir
+		self._shards = shards
+		self.path = os.path.join(out_dir, filename)
+		self.hparams_hash = hparams_hash(hparams)
+		self._records = {}
+		self._file = None
+		if os.path.exists(self.path):
+			with open(self.path, encoding='utf-8') as f:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:  # last line of an interrupted run
+						continue
+					self._records[record['key']] = record
+		self._next_index = max([r['index'] for r in self._records.values()], default=-1) + 1
+
+	def __len__(self):
+		return len(self._records)
+
+	def source_hash(self, key, wav_path):
+		'''Hash of the source wav, only re-read from disk when its size or modification time changed'''
+		stat = os.stat(wav_path)
+		wav_hash = self.recorded_hash(key, stat)
+		if wav_hash is not None:
+			return wav_hash, stat
+		return hash_file(wav_path), stat
+
+	def recorded_hash(self, key, stat):
+		'''Recorded hash of the source wav of [key] if its size and modification time did not change, else None'''
+		record = self._records.get(key)
+		if record is not None and record['wav_size'] == stat.st_size and record['wav_mtime'] == stat.st_mtime:
+			return record['wav_hash']
+		return None
+
+	def lookup(self, key, wav_hash, text):
+		'''
+		Return the recorded result of an utterance if it is still valid:
+			- None if the utterance must be (re)processed
+			- a tuple (row, ) otherwise, row being None for utterances skipped by preprocessing
+		'''
+		record = self._records.get(key)
+		if record is None or record['wav_hash'] != wav_hash or record['hparams_hash'] != self.hparams_hash:
+			return None
+		if not all(self._artifact_exists(a) for a in record['artifacts']):
+			return None
+		row = record['row']
+		if row is None:
+			return (None, )
+		if record['text'] != text:
+			# features do not depend on the transcript, only update the row
+			row = row[:-1] + [text]
+			self.add(key, record['wav_size'], record['wav_mtime'], wav_hash, text, record['index'],
+					 record['artifacts'], row)
+		return (tuple(row), )
+
+	def _artifact_exists(self, artifact):
+		# packed artifacts are recorded as shards/<kind>/<name>
+		parts = artifact.split('/')
+		if len(parts) == 3 and parts[0] == 'shards':
+			return self._shards is not None and self._shards.has(parts[1], parts[2])
+		return os.path.exists(os.path.join(self.out_dir, artifact))
+
+	def index_of(self, key):
+		'''Numeric index of [key], utterances keep their index (and file names) between runs'''
+		record = self._records.get(key)
+		if record is not None:
+			return record['index']
+		index = self._next_index
+		self._next_index += 1
+		return index
+
+	def add(self, key, wav_size, wav_mtime, wav_hash, text, index, artifacts, row):
+		record = {'key': key, 'wav_size': wav_size, 'wav_mtime': wav_mtime, 'wav_hash': wav_hash, 'text': text,
+				  'hparams_hash': self.hparams_hash, 'index': index, 'artifacts': list(artifacts),
+				  'row': list(row) if row is not None else None}
+		self._records[key] = record
+		if self._file is None:
+			self._file = open(self.path, 'a', encoding='utf-8')
+		self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+		self._file.flush()
+
+	def compact(self, keys):
+		'''Rewrite the manifest with the latest record of [keys] only'''
+		self.close()
+		self._records = {key: self._records[key] for key in keys if key in self._records}
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w', encoding='utf-8') as f:
+			for record in self._records.values():
+				f.write(json.dumps(record, ensure_ascii=False) + '\n')
+		os.replace(tmp_path, self.path)
+
+	def close(self):
+		if self._file is not None:
+			self._file.close()
+			self._file = None
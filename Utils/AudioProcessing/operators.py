@@ -0,0 +1,136 @@
+import os
+import threading
+import librosa
+import librosa.filters
+import numpy as np
+
+from Utils.AudioProcessing.griffin_lim import GriffinLim
+
+'''
+Process-wide cache of the operators derived from the audio hparams.
+
+Mel filterbank, its inverse (pseudo-inverse or NNLS solver), lws processors, STFT windows and Griffin-Lim engines
+only depend on a few hparams. They are built once per process, on first use, and shared by every conversion
+function of AudioPreprocess.py and Utils/Utils.py. Each operator is keyed by the hparams it depends on,
+so a changed hparams object never gets a stale operator.
+
+The cache is protected by a reentrant lock (operators are built from other operators). A forked process
+(preprocessing workers) starts with a new lock and keeps the operators already built by its parent.
+Cached arrays are read only.
+'''
+
+MEL_INVERSIONS = ('pinv', 'nnls')
+
+_cache = {}
+_lock = threading.RLock()
+_pid = os.getpid()
+
+
+def cached(name, key, build):
+	'''Return the operator [name] for [key] (a tuple of hparams values), calling build() on first use'''
+	global _lock, _pid
+	if _pid != os.getpid():
+		# forked process: the parent lock may have been held during the fork
+		_lock = threading.RLock()
+		_pid = os.getpid()
+	full_key = (name, ) + tuple(key)
+	operator = _cache.get(full_key)
+	if operator is None:
+		with _lock:
+			operator = _cache.get(full_key)
+			if operator is None:
+				operator = build()
+				if isinstance(operator, np.ndarray):
+					operator.setflags(write=False)
+				_cache[full_key] = operator
+	return operator
+
+
+def _hop_size(hparams):
+	if hparams.hop_size is None:
+		return int(hparams.frame_shift_ms / 1000 * hparams.sample_rate)
+	return hparams.hop_size
+
+
+def _win_size(hparams):
+	return hparams.win_size if hparams.win_size is not None else hparams.n_fft
+
+
+def stft_key(hparams):
+	return hparams.n_fft, _hop_size(hparams), hparams.win_size
+
+
+def mel_key(hparams):
+	return hparams.sample_rate, hparams.n_fft, hparams.num_mels, hparams.fmin, hparams.fmax
+
+
+def mel_basis(hparams):
+	'''mel filterbank [num_mels, num_freq]'''
+	def build():
+		# require max voice frequency is less than a half of sample rate
+		assert hparams.fmax <= hparams.sample_rate // 2
+		return librosa.filters.mel(sr=hparams.sample_rate, n_fft=hparams.n_fft, n_mels=hparams.num_mels,
+								   fmin=hparams.fmin, fmax=hparams.fmax)
+	return cached('mel_basis', mel_key(hparams), build)
+
+
+def inv_mel_basis(hparams):
+	'''pseudo-inverse of the mel filterbank [num_freq, num_mels]'''
+	return cached('inv_mel_basis', mel_key(hparams), lambda: np.linalg.pinv(mel_basis(hparams)))
+
+
+def mel_inverter(hparams):
+	'''
+	Function mapping mel amplitudes [num_mels, frames] to linear amplitudes [num_freq, frames],
+	by pseudo-inverse or non negative least squares depending on hparams.mel_inversion
+	'''
+	method = getattr(hparams, 'mel_inversion', 'pinv')
+	if method == 'pinv':
+		inverse = inv_mel_basis(hparams)
+		return lambda mel: np.maximum(1e-10, np.dot(inverse, mel))
+	if method == 'nnls':
+		return cached('nnls', mel_key(hparams), lambda: NNLSMelInverter(mel_basis(hparams), inv_mel_basis(hparams)))
+	raise ValueError('mel_inversion must be one of {}, got {}'.format(MEL_INVERSIONS, method))
+
+
+class NNLSMelInverter:
+	'''
+		Non negative least squares inversion of the mel filterbank: argmin_{x >= 0} ||M x - mel||,
+		solved for all the frames at once by accelerated projected gradient, starting from the clipped pseudo-inverse.
+	'''
+
+	def __init__(self, basis, inverse, n_iters=50):
+		self._basis = np.asarray(basis, dtype=np.float32)
+		self._inverse = np.asarray(inverse, dtype=np.float32)
+		self._step = 1. / np.linalg.norm(self._basis, ord=2) ** 2
+		self._n_iters = n_iters
+
+	def __call__(self, mel):
+		mel = np.asarray(mel, dtype=np.float32)
+		x = np.maximum(0., np.dot(self._inverse, mel))
+		z, t = x, 1.
+		for i in range(self._n_iters):
+			gradient = np.dot(self._basis.T, np.dot(self._basis, z) - mel)
+			x_next = np.maximum(0., z - self._step * gradient)
+			t_next = (1 + np.sqrt(1 + 4 * t * t)) / 2
+			z = x_next + ((t - 1) / t_next) * (x_next - x)
+			x, t = x_next, t_next
+		return np.maximum(1e-10, x)
+
+
+def window(hparams):
+	'''hann analysis window of win_size samples (librosa pads it to n_fft)'''
+	return cached('window', (_win_size(hparams), ),
+				  lambda: librosa.filters.get_window('hann', _win_size(hparams), fftbins=True))
+
+
+def lws_processor(hparams):
+	def build():
+		import lws
+		return lws.lws(hparams.n_fft, _hop_size(hparams), fftsize=hparams.win_size, mode="speech")
+	return cached('lws', stft_key(hparams), build)
+
+
+def griffin_lim_engine(hparams):
+	return cached('griffin_lim', stft_key(hparams),
+				  lambda: GriffinLim(hparams.n_fft, _hop_size(hparams), hparams.win_size))
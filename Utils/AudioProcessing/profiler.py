@@ -0,0 +1,43 @@
+import time
+from contextlib import contextmanager
+
+'''
+Per-stage wall time of the preprocessing code.
+
+_process_utterance and load_wav mark their stages (decode, resample, trim, quantize, stft, mel, linear, encode, save)
+with stage(). Timing is off by default (stage() then does nothing), Utils/AudioProcessing/benchmark.py turns it on in
+its own process to break the cost of an utterance down.
+'''
+
+_totals = None
+
+
+def enable():
+	'''Start accumulating stage times (resets previous ones)'''
+	global _totals
+	_totals = {}
+
+
+def disable():
+	global _totals
+	_totals = None
+
+
+def stats():
+	'''{stage: {'seconds': total wall time, 'calls': number of calls}} accumulated since enable()'''
+	if _totals is None:
+		return {}
+	return {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in _totals.items()}
+
+
+@contextmanager
+def stage(name):
+	if _totals is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		seconds, calls = _totals.get(name, (0., 0))
+		_totals[name] = (seconds + time.perf_counter() - start, calls + 1)
@@ -0,0 +1,85 @@
+import numpy as np
+
+'''
+Vectorized detection of leading and trailing silence.
+
+Used by the Tacotron (AudioPreprocess.py), Wavenet (Wavenet_preprocessor.py) preprocessing
+and by trimming.py, so every path removes the same silence for the same hparams:
+	- trim_method: 'top_db' (frames trim_top_db dB below the loudest frame are silent, like librosa.effects.trim)
+		or 'energy' (frames below trim_energy_db dBFS are silent)
+	- trim_fft_size, trim_hop_size: frame and hop length (in samples) of the energy analysis
+'''
+
+TRIM_METHODS = ('top_db', 'energy')
+
+
+def frame_db(wav, frame_length, hop_length):
+	'''RMS energy (in dBFS) of the frames of [wav], a frame starting every [hop_length] samples'''
+	wav = np.asarray(wav, dtype=np.float64)
+	if len(wav) < frame_length:
+		wav = np.pad(wav, (0, frame_length - len(wav)), mode='constant')
+	# energy of every frame from a cumulative sum of the squared signal: O(n), no framed copy of the wav
+	energy = np.concatenate([[0.], np.cumsum(wav ** 2)])
+	starts = np.arange(0, len(wav) - frame_length + 1, hop_length)
+	power = (energy[starts + frame_length] - energy[starts]) / frame_length
+	return 10 * np.log10(np.maximum(power, 1e-10))
+
+
+def silence_bounds(wav, hparams, pad=0):
+	'''
+	Sample indices (start, end) of the part of [wav] between its leading and trailing silence.
+	[pad] samples of silence are kept on both sides. A wav which is silent everywhere is kept whole.
+	'''
+	return bounds_from_db(frame_db(wav, hparams.trim_fft_size, hparams.trim_hop_size), len(wav), hparams, pad)
+
+
+def bounds_from_db(db, n_samples, hparams, pad=0):
+	'''silence_bounds of a signal of [n_samples] samples from its frame energies [db] (see frame_db)'''
+	frame_length, hop_length = hparams.trim_fft_size, hparams.trim_hop_size
+	method = getattr(hparams, 'trim_method', 'top_db')
+	if method == 'top_db':
+		threshold = db.max() - hparams.trim_top_db
+	elif method == 'energy':
+		threshold = hparams.trim_energy_db
+	else:
+		raise ValueError('trim_method must be one of {}, got {}'.format(TRIM_METHODS, method))
+
+	loud = np.flatnonzero(db > threshold)
+	if loud.size == 0:
+		return 0, n_samples
+	start = max(0, loud[0] * hop_length - pad)
+	end = min(n_samples, loud[-1] * hop_length + frame_length + pad)
+	return int(start), int(end)
+
+
+def trim(wav, hparams, pad=0):
+	'''Trim leading and trailing silence of [wav], return the trimmed wav and the number of samples removed'''
+	start, end = silence_bounds(wav, hparams, pad)
+	return wav[start: end], len(wav) - (end - start)
+
+
+def start_and_end_indices(quantized, silence_threshold=2):
+	'''
+	Indices of the first and last samples of a mu-law quantized signal (256 channels) farther than
+	[silence_threshold] from silence (127).
+	'''
+	loud = np.flatnonzero(np.abs(np.asarray(quantized, dtype=np.int64) - 127) > silence_threshold)
+	assert loud.size > 0 and loud[-1] > 1
+	return loud[0], loud[-1]
+
+
+def print_stats(trimmed_samples, kept_samples, sample_rate, hop_size):
+	'''Report how much silence was removed from a dataset (in frames of [hop_size] samples)'''
+	if trimmed_samples == 0:
+		return
+	print('Trimmed {} frames of silence ({:.2f} hours, {:.1f}% of the frames)'.format(
+		trimmed_samples // hop_size, trimmed_samples / sample_rate / 3600,
+		100 * trimmed_samples / (trimmed_samples + kept_samples)))
+
+
+def print_duration_stats(trimmed_seconds, kept_seconds):
+	'''Report how much silence was removed from files of any sample rate (in seconds, no model frames)'''
+	if trimmed_seconds == 0:
+		return
+	print('Trimmed {:.1f} s of silence ({:.2f} hours, {:.1f}% of the audio)'.format(
+		trimmed_seconds, trimmed_seconds / 3600, 100 * trimmed_seconds / (trimmed_seconds + kept_seconds)))
\ No newline at end of file
@@ -0,0 +1,57 @@
+import numpy as np
+
+'''
+Stitching of the waveforms of the segments of a long-form text (see Utils/TextProcessing/Segmenter.py) into one.
+
+At every junction the end of a segment fades out and the start of the next one fades in over long_form_crossfade
+seconds (no click where the Griffin-Lim / Wavenet output does not end on a zero), with a pause in between depending on
+the boundary the segment ends on:
+	- long_form_sentence_pause, long_form_clause_pause, long_form_word_pause (seconds)
+	- a pause of 0: the two segments overlap over the crossfade, with linear (equal gain) fades summing to 1 so the
+		junction is never louder than the segments; fades into and out of silence keep the equal power shape
+'''
+
+
+def pause_seconds(boundary, hparams):
+	'''Pause (in seconds) after a segment ending on [boundary] (Segmenter.SENTENCE, CLAUSE, WORD or None)'''
+	if boundary is None:
+		return 0.
+	return getattr(hparams, 'long_form_{}_pause'.format(boundary))
+
+
+def _fades(length, overlap=False):
+	'''
+	Fade in and fade out curves of [length] samples: equal gain (linear, summing to 1) when they [overlap], equal power
+	(sin / cos) when they fade from or into silence
+	'''
+	t = (np.arange(length) + .5) / length
+	if overlap:
+		return t, 1. - t
+	return np.sin(.5 * np.pi * t), np.cos(.5 * np.pi * t)
+
+
+def stitch(wavs, pauses, sample_rate, crossfade=0.01):
+	'''
+	Join [wavs], putting pauses[i] seconds of silence after wavs[i] (pauses[-1] is ignored), with [crossfade] seconds
+	fades at every junction
+
+	Returns:
+		- The float32 waveform
+	'''
+	assert len(wavs) == len(pauses)
+	wavs = [np.asarray(wav, dtype=np.float32) for wav in wavs]
+	parts = [wavs[0]] if wavs else []
+	for wav, pause in zip(wavs[1:], pauses[:-1]):
+		previous = parts[-1]
+		n_fade = min(int(crossfade * sample_rate), len(previous), len(wav))
+		n_pause = int(round(pause * sample_rate))
+		fade_in, fade_out = _fades(n_fade, overlap=n_pause <= 0)
+		head, tail = wav[:n_fade] * fade_in, previous[len(previous) - n_fade:] * fade_out
+		if n_pause > 0:
+			parts[-1] = np.concatenate([previous[:len(previous) - n_fade], tail])
+			parts += [np.zeros(n_pause, dtype=np.float32), np.concatenate([head, wav[n_fade:]])]
+		else:
+			# no pause: the fades overlap
+			parts[-1] = previous[:len(previous) - n_fade]
+			parts.append(np.concatenate([tail + head, wav[n_fade:]]))
+	return np.concatenate(parts).astype(np.float32) if parts else np.zeros(0, dtype=np.float32)
@@ -0,0 +1,129 @@
+import inspect
+import librosa
+import numpy as np
+import soundfile as sf
+
+from Utils.AudioProcessing.silence import frame_db
+
+'''
+Block-wise reading and analysis of long recordings, with a memory use bounded by the block size.
+
+	- read_blocks: mono float32 blocks of a sound file at the requested sample rate, the same samples as
+		librosa.load (resampling is streamed with soxr when the file has another sample rate)
+	- StreamingSTFT: STFT of a signal given block by block. Frames are computed as soon as their samples are
+		available and the centered padding of librosa.stft is applied at both ends of the signal, so the concatenated
+		frames are the ones of a single librosa.stft call over the whole signal
+	- frame_db_blocks: block-wise silence.frame_db, used to find the silence bounds of a long file without loading it
+'''
+
+# padding of the first and last frames of librosa.stft(center=True), it changed from 'reflect' to 'constant' in 0.10
+STFT_PAD_MODE = inspect.signature(librosa.stft).parameters['pad_mode'].default
+
+
+def read_blocks(path, sr, block_size=1 << 20):
+	'''Yield the mono float32 samples of the sound file [path] at [sr] Hz, [block_size] input samples at a time'''
+	with sf.SoundFile(path) as f:
+		resampler = None
+		if f.samplerate != sr:
+			import soxr
+			resampler = soxr.ResampleStream(f.samplerate, sr, 1, dtype='float32', quality='HQ')
+		while True:
+			block = f.read(block_size, dtype='float32', always_2d=True)
+			last = len(block) < block_size
+			# channels mean, as librosa.to_mono
+			y = block[:, 0] if block.shape[1] == 1 else np.mean(block, axis=1)
+			if resampler is not None:
+				y = resampler.resample_chunk(np.ascontiguousarray(y), last=last)
+			if len(y) > 0:
+				yield y
+			if last:
+				return
+
+
+def num_samples(path, sr):
+	'''Number of samples of the sound file [path] once resampled to [sr] Hz, read from its header'''
+	info = sf.info(path)
+	return int(np.ceil(info.frames * sr / info.samplerate))
+
+
+class StreamingSTFT:
+	'''
+		Centered STFT (librosa conventions) of a signal fed block by block:
+		process() returns the frames completed by a block, flush() the last ones once the signal is over.
+	'''
+
+	def __init__(self, n_fft, hop_size, win_size, window, pad_mode=STFT_PAD_MODE):
+		self.n_fft = n_fft
+		self.hop_size = hop_size
+		self.win_size = win_size
+		self.window = window
+		self.pad_mode = pad_mode
+		self._buffer = np.zeros(0, dtype=np.float32)
+		self._started = False
+
+	def _pad(self, y, side):
+		pad = self.n_fft // 2
+		width = (pad, 0) if side == 'left' else (0, pad)
+		return np.pad(y, width, mode=self.pad_mode)
+
+	def _frames(self, y):
+		# stft of every complete frame of y, frames start every hop_size samples from its first sample
+		n_frames = 1 + (len(y) - self.n_fft) // self.hop_size
+		if n_frames <= 0:
+			return None, 0
+		stft = librosa.stft(y=y[:(n_frames - 1) * self.hop_size + self.n_fft], n_fft=self.n_fft,
+							hop_length=self.hop_size, win_length=self.win_size, window=self.window, center=False)
+		return stft, n_frames * self.hop_size
+
+	def process(self, block):
+		'''complex STFT frames [num_freq, frames] completed by [block] (frames may be 0)'''
+		self._buffer = np.concatenate([self._buffer, np.asarray(block, dtype=np.float32)])
+		if not self._started:
+			# the left padding is a function of the first n_fft // 2 + 1 samples (reflect)
+			if len(self._buffer) <= self.n_fft // 2:
+				return np.zeros((self.n_fft // 2 + 1, 0), dtype=np.complex64)
+			self._buffer = self._pad(self._buffer, 'left')
+			self._started = True
+		# keep the last n_fft // 2 + 1 samples: the right padding is a function of them (reflect)
+		stft, consumed = self._frames(self._buffer[:max(0, len(self._buffer) - self.n_fft // 2 - 1)])
+		if stft is None:
+			return np.zeros((self.n_fft // 2 + 1, 0), dtype=np.complex64)
+		self._buffer = self._buffer[consumed:]
+		return stft
+
+	def flush(self):
+		'''last complex STFT frames [num_freq, frames] of the signal'''
+		if not self._started:
+			self._buffer = self._pad(self._buffer, 'left')
+			self._started = True
+		stft, _ = self._frames(self._pad(self._buffer, 'right'))
+		self._buffer = np.zeros(0, dtype=np.float32)
+		self._started = False
+		if stft is None:
+			return np.zeros((self.n_fft // 2 + 1, 0), dtype=np.complex64)
+		return stft
+
+
+def frame_db_blocks(blocks, frame_length, hop_length):
+	'''
+	Frame energies (dBFS) of a signal given as [blocks], as silence.frame_db over the whole signal
+	(one value per hop_length samples is kept in memory, not the signal).
+
+	Returns:
+		- A tuple (db, n_samples)
+	'''
+	dbs, tail = [], np.zeros(0, dtype=np.float32)
+	n_samples = 0
+	for block in blocks:
+		n_samples += len(block)
+		y = np.concatenate([tail, block])
+		n_frames = 1 + (len(y) - frame_length) // hop_length if len(y) >= frame_length else 0
+		if n_frames > 0:
+			dbs.append(frame_db(y[:(n_frames - 1) * hop_length + frame_length], frame_length, hop_length))
+			tail = y[n_frames * hop_length:]
+		else:
+			tail = y
+	if n_samples < frame_length:
+		# silence.frame_db zero pads a signal shorter than a frame to one frame
+		dbs.append(frame_db(tail, frame_length, hop_length))
+	return np.concatenate(dbs), n_samples
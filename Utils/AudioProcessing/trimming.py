@@ -1,8 +1,17 @@
 from pydub import AudioSegment
+import argparse
 import os
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from functools import partial
+from multiprocessing import cpu_count
 import pandas as pd
 import librosa
+from scipy import signal
+from tqdm import tqdm
 from Utils.Hyperparams import hparams
+from Utils.AudioProcessing import silence
+import numpy as np
 import soundfile
 '''
 This file do not necessary in training or synthesizing Tacotron and Wavenet. 
@@ -11,6 +20,10 @@ It is used to reformat new wav files in case of training other voice using pre t
 For example, you have trained Tacotron and Wavenet using a A dataset, then you want to train with B dataset, 
 but B dataset wav file has different sample rate from A dataset. This file is using to upsampling sample rate.
 also, it provide a tool to trim out silence at beginning and end of wav file. 
+
+ingest() does all of it in one pass over the source files (decode once, resample, trim, write the final wav),
+spread over a pool of workers:
+    python -m Utils.AudioProcessing.trimming --input_dir raw_recordings --output_dir wavs --n_jobs 8
 '''
 
 def convert_to_wav(input_audio_files, output_dir=None):
@@ -54,53 +67,163 @@ def detect_leading_silence(sound, silence_threshold=-50.0, chunk_size=10):
     sound is a pydub.AudioSegment
     silence_threshold in dB
     chunk_size in ms
-    iterate over chunks until you find the first one with sound
+    find the first chunk with sound (energy of all the chunks is computed at once)
     '''
-    trim_ms = 0 # ms
-    assert chunk_size > 0 # to avoid infinite loop
-    while sound[trim_ms:trim_ms+chunk_size].dBFS < silence_threshold and trim_ms < len(sound):
-        trim_ms += chunk_size
-    return trim_ms
+    assert chunk_size > 0
+    samples = np.array(sound.get_array_of_samples(), dtype=np.float64) / sound.max_possible_amplitude
+    chunk = max(1, int(sound.frame_rate * chunk_size / 1000) * sound.channels)
+    loud = np.flatnonzero(silence.frame_db(samples, chunk, chunk) >= silence_threshold)
+    if loud.size == 0:
+        return len(sound)
+    return int(loud[0]) * chunk_size
+
 input_wav_files = 'D:\\locs\data\\audio_data\\zeroth_korean_male_20_6minutes\\converted\\wavs_16000Hz\\'
 
 def trimming(input_wav_files, output_dir=None, natural_silence_pad=200):
     '''
     triming out silences (keep a little silence to make sound more natural
+    silence is detected as in preprocessing (hparams.trim_method, see silence.py)
     :param input_wav_files: folder of wav files
     :param output_dir:  folder to export new wavs
-    :param natural_silence_pad: size of silence to keep
+    :param natural_silence_pad: size of silence to keep (in ms)
     :return:
     '''
     files = []## storing files name
     length = []## storing files' length
+    # seconds: the files may have different sample rates
+    trimmed_seconds = 0.
+    kept_seconds = 0.
+    if output_dir is None:
+        output_dir = input_wav_files + 'trimmed\\'
+    os.makedirs(output_dir, exist_ok=True)
     for file in os.listdir(input_wav_files):
         if file.endswith('.wav'):
             files.append(file)## add file name to list
-            sound = AudioSegment.from_file(input_wav_files + file, format="wav")
-            start_trim = detect_leading_silence(sound)
-            end_trim = detect_leading_silence(sound.reverse())
-            duration = len(sound)
-
-            if start_trim > natural_silence_pad:
-                start_trim = start_trim - natural_silence_pad ### if silence part greater than narural silence pad, trim it
-            else:
-                start_trim=0                 ### if silence part smaller than narural silence pad, do not trim it
-            if end_trim > natural_silence_pad:
-                end_trim = end_trim - natural_silence_pad ### if silence part greater than narural silence pad, trim it
-            else:
-                end_trim=0                  ### if silence part smaller than narural silence pad, do not trim it
-            trimmed_sound = sound[start_trim:duration - end_trim]
-
-            length.append(len(trimmed_sound)/1000) ## calculate file length (in ms) and add to length list
-            ## create output_dir if necessary
-            if output_dir is None:
-                output_dir = input_wav_files + 'trimmed\\'
-            os.makedirs(output_dir, exist_ok=True)
-            ### write down sound file info ( file length, file name) into a csv file
-            info_df = pd.DataFrame(files)
-            info_df = info_df.assign(duaration=length)
-            info_df.to_csv(output_dir + 'trimmed_wav_info.csv')
+            sound, sample_rate = soundfile.read(input_wav_files + file)
+            mono = sound.mean(axis=1) if sound.ndim > 1 else sound
+            start, end = silence.silence_bounds(mono, hparams, pad=int(natural_silence_pad * sample_rate / 1000))
+            trimmed_sound = sound[start: end]
+            trimmed_seconds += (len(sound) - len(trimmed_sound)) / sample_rate
+            kept_seconds += len(trimmed_sound) / sample_rate
+
+            length.append(len(trimmed_sound) / sample_rate) ## calculate file length (in s) and add to length list
             try:
-                trimmed_sound.export(output_dir+file, format='wav')
+                soundfile.write(output_dir + file, trimmed_sound, sample_rate)
             except PermissionError:
                 raise ('Could not write wav file, check output folder permission..')
+    ### write down sound file info ( file length, file name) into a csv file
+    info_df = pd.DataFrame(files)
+    info_df = info_df.assign(duaration=length)
+    info_df.to_csv(output_dir + 'trimmed_wav_info.csv')
+    silence.print_duration_stats(trimmed_seconds, kept_seconds)
+
+
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.mp3', '.ogg')
+MAX_POLYPHASE_FACTOR = 1000  # largest up / down factor resampled with a polyphase filter
+
+
+def _decode(path):
+    '''float32 samples [samples, channels] and sample rate of an audio file (pydub for what soundfile cannot read)'''
+    try:
+        sound, sample_rate = soundfile.read(path, dtype='float32', always_2d=True)
+    except RuntimeError:
+        segment = AudioSegment.from_file(path)
+        sound = np.array(segment.get_array_of_samples(), dtype=np.float32).reshape(-1, segment.channels)
+        sound /= segment.max_possible_amplitude
+        sample_rate = segment.frame_rate
+    return sound, sample_rate
+
+
+def resample(sound, orig_sr, target_sr):
+    '''resample [sound] [samples, channels], by a polyphase filter when the rate ratio has small integer terms'''
+    if orig_sr == target_sr:
+        return sound
+    ratio = Fraction(int(target_sr), int(orig_sr))
+    if ratio.numerator <= MAX_POLYPHASE_FACTOR and ratio.denominator <= MAX_POLYPHASE_FACTOR:
+        return signal.resample_poly(sound, ratio.numerator, ratio.denominator, axis=0).astype(np.float32)
+    return librosa.resample(sound.T, orig_sr=orig_sr, target_sr=target_sr).T.astype(np.float32)
+
+
+def _ingest_file(input_path, output_path, sample_rate, natural_silence_pad, trim, force):
+    '''
+    Decode, resample, trim and write one file, return (output name, duration in s, trimmed samples, kept samples,
+    error): error is None, or the repr of the exception the file raised (duration then None)
+    '''
+    name = os.path.basename(output_path)
+    try:
+        return _ingest(input_path, output_path, sample_rate, natural_silence_pad, trim, force) + (None, )
+    except Exception as e:
+        # an unreadable or corrupted file must not abort the ingestion of the others
+        return name, None, 0, 0, repr(e)
+
+
+def _ingest(input_path, output_path, sample_rate, natural_silence_pad, trim, force):
+    name = os.path.basename(output_path)
+    if not force and os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path):
+        # skip if done: the final wav is already up to date
+        return name, soundfile.info(output_path).duration, 0, 0
+    sound, orig_sr = _decode(input_path)
+    sound = resample(sound, orig_sr, sample_rate)
+    trimmed_samples = 0
+    if trim:
+        start, end = silence.silence_bounds(sound.mean(axis=1), hparams,
+                                            pad=int(natural_silence_pad * sample_rate / 1000))
+        trimmed_samples = len(sound) - (end - start)
+        sound = sound[start: end]
+    soundfile.write(output_path, np.clip(sound, -1., 1.), sample_rate, subtype='PCM_16')
+    return name, len(sound) / sample_rate, trimmed_samples, len(sound)
+
+
+def ingest(input_dir, output_dir, sample_rate=hparams.sample_rate, natural_silence_pad=200, trim=True, n_jobs=None,
+           force=False):
+    '''
+    convert_to_wav, resample_wav and trimming in a single pass: each source file of [input_dir] is decoded once,
+    resampled to [sample_rate], trimmed (keeping [natural_silence_pad] ms of silence) and written as a 16 bits wav
+    in [output_dir]. Files run on [n_jobs] workers, files whose wav is newer than their source are skipped
+    (unless [force]). The durations are written to trimmed_wav_info.csv as trimming() does, the files which could not
+    be processed to failed.txt (source path|error), without stopping the others.
+    [output_dir] must differ from [input_dir]: the final wavs would replace their sources (and, being as new as them,
+    would all be skipped).
+    '''
+    if os.path.realpath(input_dir) == os.path.realpath(output_dir):
+        raise ValueError('output_dir must differ from input_dir ({})'.format(input_dir))
+    os.makedirs(output_dir, exist_ok=True)
+    sources = sorted(file for file in os.listdir(input_dir) if file.lower().endswith(AUDIO_EXTENSIONS))
+    n_jobs = n_jobs or cpu_count()
+    work = partial(_ingest_file, sample_rate=sample_rate, natural_silence_pad=natural_silence_pad, trim=trim, force=force)
+    input_paths = [os.path.join(input_dir, file) for file in sources]
+    output_paths = [os.path.join(output_dir, os.path.splitext(file)[0] + '.wav') for file in sources]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        results = list(tqdm(executor.map(work, input_paths, output_paths, chunksize=4), total=len(sources)))
+    failed = [(input_path, r[4]) for input_path, r in zip(input_paths, results) if r[4] is not None]
+    with open(os.path.join(output_dir, 'failed.txt'), 'w', encoding='utf-8') as f:
+        for input_path, error in failed:
+            print('failed to process {}: {}'.format(input_path, error))
+            f.write('{}|{}\n'.format(input_path, error))
+    if failed:
+        print('Failed to process {} files, listed in {}'.format(len(failed), os.path.join(output_dir, 'failed.txt')))
+    done = [r for r in results if r[4] is None]
+    info_df = pd.DataFrame([name for name, _, _, _, _ in done])
+    info_df = info_df.assign(duaration=[length for _, length, _, _, _ in done])
+    info_df.to_csv(os.path.join(output_dir, 'trimmed_wav_info.csv'))
+    # seconds at the ingestion sample rate (hparams.hop_size is in samples of hparams.sample_rate)
+    silence.print_duration_stats(sum(r[2] for r in done) / sample_rate, sum(r[3] for r in done) / sample_rate)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input_dir', required=True, help='folder of the source audio files')
+    parser.add_argument('--output_dir', required=True, help='folder to write the final wavs to')
+    parser.add_argument('--sample_rate', type=int, default=hparams.sample_rate)
+    parser.add_argument('--natural_silence_pad', type=int, default=200, help='silence to keep on both sides (in ms)')
+    parser.add_argument('--no_trim', action='store_true', help='only convert and resample')
+    parser.add_argument('--n_jobs', type=int, default=cpu_count())
+    parser.add_argument('--force', action='store_true', help='process files whose wav is already up to date')
+    args = parser.parse_args()
+    ingest(args.input_dir, args.output_dir, args.sample_rate, args.natural_silence_pad, not args.no_trim, args.n_jobs,
+           args.force)
+
+
+if __name__ == '__main__':
+    main()
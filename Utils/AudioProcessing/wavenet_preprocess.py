@@ -2,7 +2,7 @@ import argparse
 import os
 from multiprocessing import cpu_count
 
-from Utils import Wavenet_preprocessor
+from Utils import Wavenet_preprocessor, MetadataIndex
 from Utils.Hyperparams import hparams
 from tqdm import tqdm
 
@@ -19,6 +19,7 @@ def write_metadata(metadata, out_dir):
 	with open(os.path.join(out_dir, 'map.txt'), 'w', encoding='utf-8') as f:
 		for m in metadata:
 			f.write('|'.join([str(x) for x in m]) + '\n')
+	MetadataIndex.write(os.path.join(out_dir, 'map.txt'), MetadataIndex.WAVENET_LAYOUT)
 	mel_frames = sum([int(m[5]) for m in metadata])
 	timesteps = sum([int(m[4]) for m in metadata])
 	sr = hparams.sample_rate
@@ -0,0 +1,172 @@
+import os
+import threading
+import numpy as np
+
+'''
+Packed storage of preprocessed artifacts.
+
+Instead of one .npy file per artifact, a packed dataset folder holds a "shards" sub folder with:
+    - <kind>-<shard id>.bin: large files holding the raw bytes of many artifacts back to back
+    - <kind>-index.npz: the artifact names and, for each of them, its shard, byte offset, shape and dtype
+where kind is one of audio, mel, linear.
+
+Shards are opened with np.memmap, reading an artifact is a zero-copy slice of the mapped file.
+Artifacts keep the file names used by the .npy layout, so train.txt is the same for both layouts and
+load() can be used as a drop-in replacement of np.load(os.path.join(dir, name)).
+'''
+
+SHARDS_DIR = 'shards'
+_ALIGNMENT = 64  # byte alignment of every artifact inside its shard
+_DTYPES = [np.float32, np.int16, np.float16, np.uint8, np.uint16, np.int32, np.float64, np.int64]
+_INDEX_DTYPE = np.dtype([('shard', np.int32), ('offset', np.int64), ('rows', np.int64), ('cols', np.int64),
+                         ('dtype', np.int8)])
+
+
+def _index_path(shard_dir, kind):
+    return os.path.join(shard_dir, '{}-index.npz'.format(kind))
+
+
+def _shard_path(shard_dir, kind, shard):
+    return os.path.join(shard_dir, '{}-{:03d}.bin'.format(kind, shard))
+
+
+def _read_index(shard_dir, kind):
+    path = _index_path(shard_dir, kind)
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as index:
+        return dict(zip(index['names'].tolist(), index['table']))
+
+
+class ShardWriter:
+    """
+        Appends artifacts to the shards of a dataset folder.
+
+        Opening an existing packed folder continues it: new artifacts go to new bytes at the end of the
+        shards and rewritten artifacts simply point to their new copy (the old bytes are left unused).
+    """
+
+    def __init__(self, data_dir, kinds=('audio', 'mel', 'linear'), shard_size=2 ** 30):
+        self._dir = os.path.join(data_dir, SHARDS_DIR)
+        os.makedirs(self._dir, exist_ok=True)
+        self._shard_size = shard_size
+        self._entries = {}
+        self._files = {}
+        for kind in kinds:
+            self._entries[kind] = _read_index(self._dir, kind)
+            shard = max([int(e['shard']) for e in self._entries[kind].values()], default=0)
+            self._files[kind] = [shard, open(_shard_path(self._dir, kind, shard), 'ab')]
+
+    def has(self, kind, name):
+        return name in self._entries.get(kind, {})
+
+    def write(self, kind, name, array):
+        array = np.ascontiguousarray(array)
+        assert array.ndim in (1, 2), 'only 1D and 2D artifacts can be packed'
+        shard, f = self._files[kind]
+        offset = f.tell()
+        if offset > 0 and offset + array.nbytes > self._shard_size:
+            # start a new shard
+            f.close()
+            shard += 1
+            f = open(_shard_path(self._dir, kind, shard), 'ab')
+            self._files[kind] = [shard, f]
+            offset = f.tell()
+        if offset % _ALIGNMENT:
+            f.write(b'\0' * (_ALIGNMENT - offset % _ALIGNMENT))
+            offset = f.tell()
+        f.write(array.tobytes())
+        entry = np.zeros((), dtype=_INDEX_DTYPE)
+        entry['shard'] = shard
+        entry['offset'] = offset
+        entry['rows'] = array.shape[0]
+        entry['cols'] = array.shape[1] if array.ndim == 2 else -1
+        entry['dtype'] = _DTYPES.index(array.dtype.type)
+        self._entries[kind][name] = entry
+
+    def flush(self):
+        '''Make every written artifact visible to readers (writes the indexes)'''
+        for kind, entries in self._entries.items():
+            self._files[kind][1].flush()
+            names = np.array(list(entries.keys()), dtype=np.str_)
+            table = np.array(list(entries.values()), dtype=_INDEX_DTYPE)
+            tmp_path = os.path.join(self._dir, '{}-index.tmp.npz'.format(kind))
+            np.savez(tmp_path, names=names, table=table)
+            os.replace(tmp_path, _index_path(self._dir, kind))
+
+    def close(self):
+        self.flush()
+        for shard, f in self._files.values():
+            f.close()
+
+    def nbytes(self):
+        return sum(os.path.getsize(os.path.join(self._dir, f)) for f in os.listdir(self._dir) if f.endswith('.bin'))
+
+
+class ShardReader:
+    """
+        Zero-copy access to the artifacts of a packed dataset folder.
+    """
+
+    def __init__(self, data_dir):
+        self._dir = os.path.join(data_dir, SHARDS_DIR)
+        self._entries = {}
+        self._maps = {}
+        for f in os.listdir(self._dir):
+            if f.endswith('-index.npz'):
+                kind = f[:-len('-index.npz')]
+                self._entries[kind] = _read_index(self._dir, kind)
+
+    @staticmethod
+    def exists(data_dir):
+        shard_dir = os.path.join(data_dir, SHARDS_DIR)
+        return os.path.isdir(shard_dir) and any(f.endswith('-index.npz') for f in os.listdir(shard_dir))
+
+    def has(self, kind, name):
+        return name in self._entries.get(kind, {})
+
+    def load(self, kind, name):
+        entry = self._entries[kind][name]
+        data = self._map(kind, int(entry['shard']))
+        dtype = np.dtype(_DTYPES[entry['dtype']])
+        shape = (int(entry['rows']), ) if entry['cols'] < 0 else (int(entry['rows']), int(entry['cols']))
+        offset = int(entry['offset'])
+        return data[offset: offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+    def _map(self, kind, shard):
+        key = (kind, shard)
+        if key not in self._maps:
+            self._maps[key] = np.memmap(_shard_path(self._dir, kind, shard), dtype=np.uint8, mode='r')
+        return self._maps[key]
+
+
+# readers of the dataset folders seen by load() (None for folders which are not packed)
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(data_dir):
+    '''Return the ShardReader of [data_dir], or None if the folder is not packed'''
+    data_dir = os.path.abspath(data_dir)
+    if data_dir not in _readers:
+        with _readers_lock:
+            if data_dir not in _readers:
+                _readers[data_dir] = ShardReader(data_dir) if ShardReader.exists(data_dir) else None
+    return _readers[data_dir]
+
+
+def load(path, kind):
+    '''
+    Load the [kind] artifact stored at [path].
+
+    The artifact is read from the shards of its dataset folder (the folder of [path] or its parent,
+    e.g. Tacotron_input for Tacotron_input/mels/speech-mel-00001-kss.npy) when that folder is packed,
+    and from the .npy file itself otherwise.
+    '''
+    directory = os.path.dirname(path)
+    name = os.path.basename(path)
+    for data_dir in (os.path.dirname(directory), directory):
+        reader = get_reader(data_dir)
+        if reader is not None and reader.has(kind, name):
+            return reader.load(kind, name)
+    return np.load(path)
@@ -67,9 +67,15 @@ hparams = tf.contrib.training.HParams(
     trim_fft_size = 512,    ## use to trim silent part of M-AILABS dataset
     trim_hop_size = 128,    # use to trim silent part of M-AILABS dataset
     trim_top_db = 60,   # use to trim silent part of M-AILABS dataset
+    trim_method = 'top_db', # silence detection: 'top_db' (trim_top_db below the loudest frame) or 'energy' (below trim_energy_db)
+    trim_energy_db = -50,   # frames quieter than this (in dBFS) are silent when trim_method is 'energy'
     rescale=True,  # whether rescale audio data before processing
     rescaling_max = 0.999,    #max scaling (if rescale is true, this parameter will be used)
     trim_silence = True,        #whether trim out silent parts
+    audio_encoding = 'float32',        # preprocessed audio on disk: 'float32' or 'int16' (PCM, half the size)
+    spectrogram_encoding = 'float32',  # preprocessed spectrograms on disk: 'float32', 'float16', 'uint8' or 'uint16' (quantized per utterance)
+    preprocess_models = ['tacotron'],  # models preprocessing writes metadata for, sharing the audio and mels: 'tacotron', 'wavenet' (map.txt), 'flowavenet' (flowavenet.txt)
+    lazy_extraction_jobs = None,  # worker processes extracting the features of lazy.txt utterances during training (None: cpu count)
     sample_rate=44100, #22050, 44100
     fmin=25,  # min of voice frequency
     fmax=7600,  # max of voice frequency
@@ -79,7 +85,10 @@ hparams = tf.contrib.training.HParams(
     wavenet_weight_normalization = False,
     #linear spectrogram params
     power=1.2,
-    griffin_lim_iters=60,
+    mel_inversion='pinv',   # mel to linear amplitudes for Griffin-Lim: 'pinv' (pseudo-inverse) or 'nnls' (non negative least squares)
+    griffin_lim_iters=60,   # maximum number of Griffin-Lim iterations
+    griffin_lim_momentum=0.99,  # Fast Griffin-Lim momentum (0. for the classic Griffin-Lim)
+    griffin_lim_tolerance=None, # early stopping (lower latency, lower quality): stop an utterance once its spectral convergence is below this, e.g. 0.12 (None: always run griffin_lim_iters)
     ### mel spectrogram params
     predict_linear = False,         #whether model predicts linear spectrogram
     signal_normalization=True,
@@ -90,6 +99,7 @@ hparams = tf.contrib.training.HParams(
     num_freq=1025,  # (= n_fft / 2 + 1) only used when adding linear spectrograms post processing network
     clip_mels_length=True,  # For cases of OOM (Not really recommended, working on a workaround)
     max_mel_frames=1000,  # Only relevant when clip_mels_length = True
+    stream_stft_min_seconds=30,  # recordings longer than this (file header) are trimmed and analysed block by block from the file, never loaded whole (None: never; not with use_lws, packed shards, mu-law quantization, flowavenet or uint8/uint16 spectrograms)
     n_fft=2048,  # Extra window size is filled with 0 padding to match this parameter
     hop_size=275,  # For 22050Hz, 275 ~= 12.5 ms
     win_size=1024,  # For 22050Hz, 1100 ~= 50 ms (If None, win_size = n_fft) keep win_size/sample_rate ratio at 20~40 ms
@@ -157,6 +167,16 @@ hparams = tf.contrib.training.HParams(
     tacotron_num_gpus = 1,
     split_on_cpu = True,
     tacotron_synthesis_batch_size = 1,
+    tacotron_synthesis_text_jobs = None,  # worker processes converting the synthesis sentences to symbol ids ahead of the model (None: cpu count, 0: in the main process)
+    phoneme_cache_path = None,  # sqlite file caching the symbol ids of the synthesized texts across runs, relative to base_dir (None: no cache)
+    phoneme_cache_entries = 100000,  # texts kept in the phoneme cache, the least recently used ones are removed
+    long_form_min_chars = 30,  # long-form inference (synthesize.py --long_form): texts are cut in segments of min to max chars at sentence, clause or word boundaries
+    long_form_max_chars = 100,
+    long_form_batch_size = 16,  # segments synthesized together (of similar lengths)
+    long_form_sentence_pause = 0.35,  # silence (in seconds) put between the segments when stitching their audio, after a sentence end
+    long_form_clause_pause = 0.15,  # after a clause end (, ; :)
+    long_form_word_pause = 0.,  # after a segment cut between two words
+    long_form_crossfade = 0.01,  # fade out / fade in (in seconds) at every junction
     tacotron_data_random_state = 1324,
     outputs_per_step = 2,
     tacotron_random_seed=45454,
@@ -0,0 +1,128 @@
+import os
+import numpy as np
+
+'''
+Binary index of a metadata file (train.txt, map.txt, lazy.txt).
+
+The index is a structured numpy array saved next to the metadata file (train.txt -> train.index.npy) with one
+record per line:
+    - offset, length: byte range of the line in the metadata file
+    - time_steps, mel_frames: audio and mel lengths of the utterance (-1 when the file does not hold them)
+    - text_length: number of characters of the text, text_id: number of the distinct text (repeated sentences
+      share the same id)
+    - speaker: speaker / folder id
+It is written by write_metadata() of the preprocessing scripts and rebuilt on load when missing or older than
+the metadata file. Loaders memory map both files: statistics, filtering and length sorting are array operations
+on the records, and a line is only read and split when its utterance is loaded (row()).
+'''
+
+INDEX_SUFFIX = '.index.npy'
+INDEX_DTYPE = np.dtype([('offset', np.int64), ('length', np.int32), ('time_steps', np.int64), ('mel_frames', np.int32),
+                        ('text_length', np.int32), ('text_id', np.int32), ('speaker', 'S32')])
+
+# column (or function of the split line) of every field, for each metadata layout
+# Tacotron train.txt: audio|mel|linear|time_steps|mel_frames|text, the folder id ends the audio file name
+TACOTRON_LAYOUT = {'time_steps': 3, 'mel_frames': 4, 'text': 5,
+                   'speaker': lambda meta: meta[0].split('-', 3)[-1][:-len('.npy')]}
+# Wavenet map.txt: audio|mel|mel|speaker|time_steps|mel_frames (GTA map.txt: audio|mel|gta mel|speaker|text)
+WAVENET_LAYOUT = {'speaker': 3, 'time_steps': 4, 'mel_frames': 5}
+# Flowavenet train.txt: audio|mel|time_steps|text
+FLOWAVENET_LAYOUT = {'time_steps': 2, 'text': 3}
+# lazy.txt: wav path|folder id/wav name|index|time_steps|mel_frames|text, lengths estimated from the wav header
+# until the utterance is extracted (see Utils/AudioProcessing/feature_cache.py)
+LAZY_LAYOUT = {'time_steps': 3, 'mel_frames': 4, 'text': 5, 'speaker': lambda meta: meta[1].rsplit('/', 1)[0]}
+
+
+def index_path(metadata_filename):
+    return os.path.splitext(metadata_filename)[0] + INDEX_SUFFIX
+
+
+def _field(meta, layout, name):
+    column = layout.get(name)
+    if column is None:
+        return None
+    if callable(column):
+        return column(meta)
+    return meta[column] if column < len(meta) else None
+
+
+def _int_field(meta, layout, name):
+    value = _field(meta, layout, name)
+    return int(value) if value is not None and value.isdigit() else -1
+
+
+def build(metadata_filename, layout):
+    '''Index records of [metadata_filename], split with [layout]'''
+    records, text_ids = [], {}
+    offset = 0
+    with open(metadata_filename, 'rb') as f:
+        for line in f:
+            content = line.rstrip(b'\r\n')
+            if content:
+                meta = content.decode('utf-8').split('|')
+                text = _field(meta, layout, 'text') or ''
+                speaker = _field(meta, layout, 'speaker') or ''
+                records.append((offset, len(content), _int_field(meta, layout, 'time_steps'),
+                                _int_field(meta, layout, 'mel_frames'), len(text),
+                                text_ids.setdefault(text, len(text_ids)), speaker.encode('utf-8')[:32]))
+            offset += len(line)
+    return np.array(records, dtype=INDEX_DTYPE)
+
+
+def write(metadata_filename, layout):
+    '''Write the index of [metadata_filename] next to it'''
+    records = build(metadata_filename, layout)
+    np.save(index_path(metadata_filename), records, allow_pickle=False)
+    return records
+
+
+def _is_fresh(metadata_filename):
+    path = index_path(metadata_filename)
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(metadata_filename)
+
+
+class MetadataIndex:
+    '''
+        Memory mapped metadata file and index.
+    '''
+
+    def __init__(self, metadata_filename, layout):
+        self.metadata_filename = metadata_filename
+        self.layout = layout
+        if _is_fresh(metadata_filename):
+            self.records = np.load(index_path(metadata_filename), mmap_mode='r', allow_pickle=False)
+        else:
+            try:
+                self.records = write(metadata_filename, layout)
+            except IOError:  # read only dataset
+                self.records = build(metadata_filename, layout)
+        if os.path.getsize(metadata_filename) > 0:
+            self._lines = np.memmap(metadata_filename, dtype=np.uint8, mode='r')
+        else:
+            self._lines = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.records)
+
+    def row(self, i):
+        '''Split metadata line of utterance [i]'''
+        offset, length = int(self.records['offset'][i]), int(self.records['length'][i])
+        return self._lines[offset: offset + length].tobytes().decode('utf-8').split('|')
+
+    def text(self, i):
+        '''Text of utterance [i]'''
+        return _field(self.row(i), self.layout, 'text') or ''
+
+    def select(self, max_mel_frames=None, max_time_steps=None):
+        '''Indices of the utterances within the given lengths (unknown lengths are kept)'''
+        keep = np.ones(len(self.records), dtype=bool)
+        if max_mel_frames is not None:
+            keep &= self.records['mel_frames'] <= max_mel_frames
+        if max_time_steps is not None:
+            keep &= self.records['time_steps'] <= max_time_steps
+        return np.flatnonzero(keep)
+
+    def sort_by_length(self, indices, field='mel_frames'):
+        '''[indices] sorted by increasing utterance length'''
+        indices = np.asarray(indices)
+        return indices[np.argsort(self.records[field][indices], kind='stable')]
@@ -0,0 +1,84 @@
+import os
+import numpy as np
+from Utils.Infolog import log
+from Utils.TextProcessing.HangulUtils import hangul_to_sequence, symbol_table_version
+
+'''
+Symbol id sequences of the texts of a metadata file, computed once instead of on every epoch.
+
+The sequences are saved next to the metadata file (train.txt -> train.phonemes.npz), one per distinct text of its
+binary index (MetadataIndex text_id):
+    - ids: concatenated hangul_to_sequence ids (int32)
+    - offsets: start of the ids of each text_id in ids (int64, one more than the number of texts)
+    - hangul_type, version: hparams.hangul_type and HangulUtils.symbol_table_version() of the ids
+They are written by the preprocessing after train.txt, and recomputed on load when missing, older than the metadata
+file or made with another symbol table (hangul_type, rulebook, conversion code).
+'''
+
+PHONEMES_SUFFIX = '.phonemes.npz'
+
+
+def phonemes_path(metadata_filename):
+    return os.path.splitext(metadata_filename)[0] + PHONEMES_SUFFIX
+
+
+def build(metadata, hparams):
+    '''(ids, offsets) of the distinct texts of [metadata] (a MetadataIndex), in text_id order'''
+    # first utterance of every text_id (text ids are numbered from 0 in order of appearance)
+    _, first = np.unique(metadata.records['text_id'], return_index=True)
+    n_texts = len(first)
+    sequences = [hangul_to_sequence(dir=hparams.base_dir, hangul_text=metadata.text(i), hangul_type=hparams.hangul_type)
+                 for i in first]
+    offsets = np.zeros(n_texts + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+    ids = np.fromiter((i for sequence in sequences for i in sequence), dtype=np.int32, count=int(offsets[-1]))
+    return ids, offsets
+
+
+def write(metadata, hparams, ids=None, offsets=None):
+    '''Write the sequences of [metadata] (a MetadataIndex) next to its metadata file'''
+    if ids is None:
+        ids, offsets = build(metadata, hparams)
+    with open(phonemes_path(metadata.metadata_filename), 'wb') as f:
+        np.savez(f, ids=ids, offsets=offsets, hangul_type=np.int32(hparams.hangul_type),
+                 version=np.array(symbol_table_version(hparams.base_dir)))
+    return ids, offsets
+
+
+def _load_fresh(metadata, hparams):
+    '''(ids, offsets) saved for [metadata], None when missing or stale'''
+    path = phonemes_path(metadata.metadata_filename)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(metadata.metadata_filename):
+        return None
+    with np.load(path, allow_pickle=False) as saved:
+        if int(saved['hangul_type']) != hparams.hangul_type or str(saved['version']) != symbol_table_version(hparams.base_dir):
+            return None
+        ids, offsets = saved['ids'], saved['offsets']
+    n_texts = int(metadata.records['text_id'].max()) + 1 if len(metadata) else 0
+    if len(offsets) != n_texts + 1:
+        return None
+    return ids, offsets
+
+
+class PhonemeIndex:
+    '''
+        Precomputed symbol ids of the utterances of a MetadataIndex.
+    '''
+
+    def __init__(self, metadata, hparams):
+        self._text_ids = metadata.records['text_id']
+        loaded = _load_fresh(metadata, hparams)
+        if loaded is None:
+            log('Computing the symbol ids of {} ({} texts)'.format(metadata.metadata_filename,
+                                                                   len(np.unique(self._text_ids))))
+            loaded = build(metadata, hparams)
+            try:
+                write(metadata, hparams, *loaded)
+            except IOError:  # read only dataset
+                pass
+        self._ids, self._offsets = loaded
+
+    def sequence(self, i):
+        '''int32 symbol ids of the text of utterance [i]'''
+        text_id = self._text_ids[i]
+        return self._ids[self._offsets[text_id]: self._offsets[text_id + 1]]
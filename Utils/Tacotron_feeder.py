@@ -5,8 +5,12 @@ from Utils.Hyperparams import hparams
 import numpy as np
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
-from Utils.TextProcessing.HangulUtils import hangul_to_sequence
 from Utils.Infolog import log
+from Utils import DatasetShards, ArtifactEncoding
+from Utils.MetadataIndex import MetadataIndex, TACOTRON_LAYOUT, LAZY_LAYOUT
+from Utils.PhonemeIndex import PhonemeIndex
+from Utils.AudioProcessing.AudioPreprocess import NO_LINEAR, linear_from_audio
+from Utils.AudioProcessing.feature_cache import FeatureCache, is_lazy_metadata
 
 _batches_per_group = 32
 
@@ -50,13 +54,19 @@ def _prepare_batch( batches, outputs_per_step):
                                                                                     outputs_per_step)
         token_targets = np.concatenate((token_targets, token_target_cur_device),
                                        axis=1) if token_targets is not None else token_target_cur_device
-        linear_targets_cur_device, linear_target_max_len = _prepare_targets([x[3] for x in batch],
-                                                                                 outputs_per_step)
-        linear_targets = np.concatenate((linear_targets, linear_targets_cur_device),
-                                        axis=1) if linear_targets is not None else linear_targets_cur_device
+        if batch[0][3] is None:
+            # linear targets are not used by the model: nothing to pad nor to feed
+            linear_target_max_len = 0
+        else:
+            linear_targets_cur_device, linear_target_max_len = _prepare_targets([x[3] for x in batch],
+                                                                                     outputs_per_step)
+            linear_targets = np.concatenate((linear_targets, linear_targets_cur_device),
+                                            axis=1) if linear_targets is not None else linear_targets_cur_device
         split_infos.append([input_max_len, mel_target_max_len, token_target_max_len, linear_target_max_len])
 
     split_infos = np.asarray(split_infos, dtype=np.int32)
+    if linear_targets is None:
+        return (inputs, input_lengths, mel_targets, token_targets, targets_lengths, split_infos)
     return (inputs, input_lengths, mel_targets, token_targets, linear_targets, targets_lengths, split_infos)
 
     # def _prepare_batch( batch, outputs_per_step):
@@ -122,32 +132,48 @@ class Feeder:
         self._coord = coordinator
         self._hparams = hparams
         self._train_offset = 0
-        self._test_offset = 0
         # Load metadata
         #load mel spectrogram numpy matrix data
         self._mel_dir = os.path.join(os.path.dirname(metadata_filename), 'mels')
         #load linear spectrograme numpy matrix data
         self._linear_dir = os.path.join(os.path.dirname(metadata_filename), 'linear')
-        #load metadata of text which are stored in train.txt file
-        with open(metadata_filename, encoding='utf-8') as f:
-            self._metadata = [line.strip().split('|') for line in f] ### major variable
-            ##calculate total audio length (for logging information)
-            #calculate length in milisecond per hop_size
-            frame_shift_ms = hparams.hop_size / hparams.sample_rate
-            #calculate length in hour by getting 4th variable in train.txt
-            hours = sum([int(x[4]) for x in self._metadata]) * frame_shift_ms / (3600)
-            log('Loaded metadata for {} examples ({:.2f} hours)'.format(len(self._metadata), hours))
+        #audio time series, linear targets are computed from them when they were not preprocessed
+        self._audio_dir = os.path.join(os.path.dirname(metadata_filename), 'audio')
+        #linear targets are only loaded, padded and fed when the model predicts linear spectrograms
+        self._use_linear = hparams.predict_linear
+        #lazy.txt (AudioPreprocess.py --lazy) points at the source wavs, features are extracted when first sampled
+        self._cache = None
+        if is_lazy_metadata(metadata_filename):
+            self._cache = FeatureCache(os.path.dirname(metadata_filename), hparams)
+        #load metadata of text which are stored in train.txt file, lines are read from the memory mapped file on use
+        self._metadata = MetadataIndex(metadata_filename, LAZY_LAYOUT if self._cache else TACOTRON_LAYOUT) ### major variable
+        #symbol ids of the texts, precomputed by the preprocessing (recomputed here when missing or stale)
+        self._phonemes = PhonemeIndex(self._metadata, hparams)
+        mel_frames = self._metadata.records['mel_frames']
+        ##calculate total audio length (for logging information)
+        #calculate length in milisecond per hop_size
+        frame_shift_ms = hparams.hop_size / hparams.sample_rate
+        #calculate length in hour from the mel frames of the index
+        hours = int(mel_frames[mel_frames > 0].sum()) * frame_shift_ms / (3600)
+        log('Loaded metadata for {} examples ({:.2f} hours{})'.format(len(self._metadata), hours,
+                                                                   ', before silence trimming' if self._cache else ''))
+        # utterances longer than max_mel_frames (e.g. preprocessed with other hparams) are left out
+        # (lazy lengths are not trimmed yet, too long utterances are left out when they are extracted)
+        clip = hparams.clip_mels_length and self._cache is None
+        indices = self._metadata.select(max_mel_frames=hparams.max_mel_frames if clip else None)
+        if len(indices) < len(self._metadata):
+            log('Skipped {} examples longer than {} mel frames'.format(len(self._metadata) - len(indices), hparams.max_mel_frames))
 
 
         # Train test split
         ## training dataset: _train_meta
         ## test dataset: _test_meta
+        ## both hold indices of metadata lines
         if hparams.tacotron_test_size is None:
             assert hparams.tacotron_test_batches is not None
         test_size = (hparams.tacotron_test_size if hparams.tacotron_test_size is not None
                      else hparams.tacotron_test_batches * hparams.tacotron_batch_size)
-        indices = np.arange(len(self._metadata))    # create a integer array from 0 to len(metadata)
-        # indicate train index and test index from above array
+        # indicate train index and test index from the metadata indices
         train_indices, test_indices = train_test_split(indices, test_size=test_size, random_state=hparams.tacotron_data_random_state)
         # Make sure test_indices is a multiple of batch_size else round up
         len_test_indices = _round_up(len(test_indices), hparams.tacotron_batch_size)
@@ -157,8 +183,8 @@ class Feeder:
         test_indices = test_indices[:len_test_indices]
         # new train_indices by joining old one with redundant test_indices
         train_indices = np.concatenate([train_indices, extra_test])
-        self._train_meta = list(np.array(self._metadata)[train_indices])
-        self._test_meta = list(np.array(self._metadata)[test_indices])
+        self._train_meta = train_indices
+        self._test_meta = test_indices
         self.test_steps = len(self._test_meta) // hparams.tacotron_batch_size
         if hparams.tacotron_test_size is None:
             assert hparams.tacotron_test_batches == self.test_steps
@@ -177,32 +203,31 @@ class Feeder:
                 tf.placeholder(tf.int32, shape=(None,), name='targets_lengths'),
                 tf.placeholder(tf.int32, shape=(hparams.tacotron_num_gpus, None), name='split_infos'),
             ]
+            dtypes = [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32, tf.int32]
+            if not self._use_linear:
+                # linear targets never go through the queue
+                del self._placeholders[4], dtypes[4]
 
             # Create queue for buffering data
-            queue = tf.FIFOQueue(8, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32, tf.int32], name='input_queue')
+            queue = tf.FIFOQueue(8, dtypes, name='input_queue')
             self._enqueue_op = queue.enqueue(self._placeholders)
-            self.inputs, self.input_lengths, self.mel_targets, self.token_targets, self.linear_targets, self.targets_lengths, self.split_infos = queue.dequeue()
-            self.inputs.set_shape(self._placeholders[0].shape)
-            self.input_lengths.set_shape(self._placeholders[1].shape)
-            self.mel_targets.set_shape(self._placeholders[2].shape)
-            self.token_targets.set_shape(self._placeholders[3].shape)
-            self.linear_targets.set_shape(self._placeholders[4].shape)
-            self.targets_lengths.set_shape(self._placeholders[5].shape)
-            self.split_infos.set_shape(self._placeholders[6].shape)
+            self.inputs, self.input_lengths, self.mel_targets, self.token_targets, self.linear_targets, \
+            self.targets_lengths, self.split_infos = self._dequeue(queue)
 
             # Create eval queue for buffering eval data
-            eval_queue = tf.FIFOQueue(1, [tf.int32, tf.int32, tf.float32, tf.float32, tf.float32, tf.int32, tf.int32],
-                                      name='eval_queue')
+            eval_queue = tf.FIFOQueue(1, dtypes, name='eval_queue')
             self._eval_enqueue_op = eval_queue.enqueue(self._placeholders)
             self.eval_inputs, self.eval_input_lengths, self.eval_mel_targets, self.eval_token_targets, \
-            self.eval_linear_targets, self.eval_targets_lengths,self.eval_split_infos = eval_queue.dequeue()
-            self.eval_inputs.set_shape(self._placeholders[0].shape)
-            self.eval_input_lengths.set_shape(self._placeholders[1].shape)
-            self.eval_mel_targets.set_shape(self._placeholders[2].shape)
-            self.eval_token_targets.set_shape(self._placeholders[3].shape)
-            self.eval_linear_targets.set_shape(self._placeholders[4].shape)
-            self.eval_targets_lengths.set_shape(self._placeholders[5].shape)
-            self.eval_split_infos.set_shape(self._placeholders[6].shape)
+            self.eval_linear_targets, self.eval_targets_lengths, self.eval_split_infos = self._dequeue(eval_queue)
+
+    def _dequeue(self, queue):
+        '''Dequeue a batch from [queue], linear targets being None when they are not used'''
+        tensors = list(queue.dequeue())
+        for tensor, placeholder in zip(tensors, self._placeholders):
+            tensor.set_shape(placeholder.shape)
+        if not self._use_linear:
+            tensors = tensors[:4] + [None] + tensors[4:]
+        return tensors
 
     def start_threads(self, session):
         self._session = session
@@ -213,16 +238,34 @@ class Feeder:
         thread.daemon = True  # Thread will close when parent quits
         thread.start()
 
-    def _get_test_groups(self):
-        meta = self._test_meta[self._test_offset]
-        self._test_offset += 1
-
-        text = meta[5]
-        input_data = np.asarray(hangul_to_sequence(dir=hparams.base_dir, hangul_text= text, hangul_type=hparams.hangul_type), dtype=np.int32)
-        mel_target = np.load(os.path.join(self._mel_dir, meta[1]))
+    def _submit_examples(self, indices):
+        """Reads the metadata lines [indices] and starts the feature extraction of the lazy ones, returns the lines
+        """
+        metas = [self._metadata.row(i) for i in indices]
+        if self._cache is not None:
+            self._cache.submit(metas)
+        return metas
+
+    def _get_examples(self, indices, metas=None):
+        """Gets the examples of metadata lines [indices] (read into [metas] by _submit_examples, or read here),
+        extracting the features of lazy lines on first use (lazy utterances without features, too long or unreadable,
+        are left out)
+        """
+        if metas is None:
+            metas = [self._metadata.row(i) for i in indices]
+        if self._cache is not None:
+            metas = self._cache.rows(metas)
+        return [self._get_example(i, meta) for i, meta in zip(indices, metas) if meta is not None]
+
+    def _get_example(self, index, meta):
+        """Gets the example (input, mel_target, token_target, linear_target, mel_length) of metadata line [index]
+        (its train.txt row being [meta]) from disk
+        """
+        input_data = self._phonemes.sequence(index)
+        mel_target = self._load(self._mel_dir, meta, 1, 'mel')
         # Create parallel sequences containing zeros to represent a non finished sequence
         token_target = np.asarray([0.] * (len(mel_target) - 1))
-        linear_target = np.load(os.path.join(self._linear_dir, meta[2]))
+        linear_target = self._get_linear_target(meta, len(mel_target))
         return (input_data, mel_target, token_target, linear_target, len(mel_target))
 
     def make_test_batches(self):
@@ -230,25 +273,32 @@ class Feeder:
         # Read a group of examples
         n = self._hparams.tacotron_batch_size
         r = self._hparams.outputs_per_step
-        # Test on entire test set
-        examples = [self._get_test_groups() for i in range(len(self._test_meta))]
-        # Bucket examples based on similar output sequence length for efficiency
-        examples.sort(key=lambda x: x[-1])
-        batches = [examples[i: i + n] for i in range(0, len(examples), n)]
+        # Test on entire test set, bucket examples based on similar output sequence length for efficiency
+        examples = self._get_examples(self._metadata.sort_by_length(self._test_meta))
+        batches = [examples[i: i + n] for i in range(0, len(examples) - n + 1, n)]
         np.random.shuffle(batches)
         log('\nGenerated {} test batches of size {} in {:.3f} sec'.format(len(batches), n, time.time() - start))
         return batches, r
 
+    def _next_train_group(self):
+        """Metadata line indices of the next group of training examples, bucketed based on similar output sequence
+        length for efficiency (sorted on the index before loading), and their lines (see _submit_examples)
+        """
+        n = self._hparams.tacotron_batch_size
+        indices = self._metadata.sort_by_length([self._next_train_index() for i in range(n * _batches_per_group)])
+        return indices, self._submit_examples(indices)
+
     def _enqueue_next_train_group(self):
+        group = self._next_train_group()
         while not self._coord.should_stop():
             start = time.time()
             # Read a group of examples
             n = self._hparams.tacotron_batch_size
             r = self._hparams.outputs_per_step
-            examples = [self._get_next_example() for i in range(n * _batches_per_group)]
-            # Bucket examples based on similar output sequence length for efficiency
-            examples.sort(key=lambda x: x[-1])
-            batches = [examples[i: i + n] for i in range(0, len(examples), n)]
+            examples = self._get_examples(*group)
+            # the features of the next group (lazy.txt) are extracted while this one is fed to the model
+            group = self._next_train_group()
+            batches = [examples[i: i + n] for i in range(0, len(examples) - n + 1, n)]
             np.random.shuffle(batches)
             log('\nGenerated {} train batches of size {} in {:.3f} sec'.format(len(batches), n, time.time() - start))
             for batch in batches:
@@ -258,24 +308,36 @@ class Feeder:
     def _enqueue_next_test_group(self):
         # Create test batches once and evaluate on them for all test steps
         test_batches, r = self.make_test_batches()
+        if not test_batches:
+            # e.g. no lazy test utterance could be extracted: nothing to evaluate on (looping would spin)
+            log('No test batches, the evaluation queue is not fed')
+            return
         while not self._coord.should_stop():
             for batch in test_batches:
                 feed_dict = dict(zip(self._placeholders, _prepare_batch(batch, r)))
                 self._session.run(self._eval_enqueue_op, feed_dict=feed_dict)
 
-    def _get_next_example(self):
-        """Gets a single example (input, mel_target, token_target, linear_target, mel_length) from_ disk
+    def _next_train_index(self):
+        """Gets the metadata line index of the next training example, reshuffling after each epoch
         """
         if self._train_offset >= len(self._train_meta):
             self._train_offset = 0
             np.random.shuffle(self._train_meta)
-        meta = self._train_meta[self._train_offset]
+        index = self._train_meta[self._train_offset]
         self._train_offset += 1
-        text = meta[5]
-        input_data = np.asarray(hangul_to_sequence(dir=hparams.base_dir, hangul_text=text, hangul_type=hparams.hangul_type), dtype=np.int32)
-        mel_target = np.load(os.path.join(self._mel_dir, meta[1]))
-        # Create parallel sequences containing zeros to represent a non finished sequence
-        token_target = np.asarray([0.] * (len(mel_target) - 1))
-        linear_target = np.load(os.path.join(self._linear_dir, meta[2]))
-        return (input_data, mel_target, token_target, linear_target, len(mel_target))
+        return index
+
+    def _get_linear_target(self, meta, mel_frames):
+        '''Linear target of an example: None when not used, computed from its audio when it was not preprocessed'''
+        if not self._use_linear:
+            return None
+        if meta[2] == NO_LINEAR:
+            audio = self._load(self._audio_dir, meta, 0, 'audio')
+            return linear_from_audio(audio, mel_frames, self._hparams)
+        return self._load(self._linear_dir, meta, 2, 'linear')
+
+    def _load(self, directory, meta, column, kind):
+        '''Load the [kind] artifact named in [column] of a metadata row, decoded to float32'''
+        array = DatasetShards.load(os.path.join(directory, meta[column]), kind)
+        return ArtifactEncoding.decode(array, ArtifactEncoding.parse(meta).get(kind))
 
@@ -3,11 +3,14 @@ from platform import system
 import numpy as np
 import tensorflow as tf
 from TacotronModel.modules.Tacotron import Tacotron
-from Utils.AudioProcessing.AudioPreprocess import mel_to_audio_serie, save_wav, inv_preemphasis
+from Utils.AudioProcessing.AudioPreprocess import mel_to_audio_serie, mels_to_audio_series, save_wav
 from Utils.Infolog import log
+from Utils import DatasetShards, ArtifactEncoding
 from Utils.Plot import plot_spectrogram, plot_alignment
-from Utils.Tacotron_feeder import _prepare_inputs, _prepare_targets, _get_output_lengths
+from Utils.Tacotron_feeder import _prepare_targets, _get_output_lengths
 from Utils.TextProcessing.HangulUtils import hangul_to_sequence
+from Utils.TextProcessing.TextBatcher import pad_inputs
+from Utils.TextProcessing.PhonemeCache import open_cache
 
 
 class Synthesizer:
@@ -36,6 +39,8 @@ class Synthesizer:
 
         self.GTA = GTA
         self.hparams = hparams
+        # symbol ids of the texts converted by earlier requests and runs (None: no cache)
+        self.phoneme_cache = open_cache(hparams)
 
         log('Loading checkpoint: %s' % checkpoint_path)
         # Memory allocation on the GPUs as needed
@@ -57,40 +62,42 @@ class Synthesizer:
 
     ### synthesize : synth.synthesize(texts, i+1, synth_dir, None, mel_filenames)
     ### inference: synth.synthesize(text, i + 1, inference_dir, log_dir, None)
-    def synthesize(self, texts, basenames, out_dir, log_dir, mel_filenames):
-        
+    def synthesize(self, texts, basenames, out_dir, log_dir, mel_filenames, mel_encodings=None, seqs=None):
+        '''seqs: symbol ids of the texts (e.g. converted ahead by a TextBatcher), computed here if None'''
         hparams = self.hparams
+        if seqs is None and self.phoneme_cache is not None:
+            seqs = [self.phoneme_cache.sequence(text) for text in texts]
+        elif seqs is None:
+            seqs = [np.asarray(hangul_to_sequence(dir=hparams.base_dir, hangul_text=text, hangul_type=hparams.hangul_type)) for text in texts]
 
         # Repeat last sample until number of samples is dividable by the number of GPUs (last run scenario)
         while len(texts) % hparams.tacotron_num_gpus != 0:
             texts.append(texts[-1])
+            seqs.append(seqs[-1])
             basenames.append(basenames[-1])
             if mel_filenames is not None:
                 mel_filenames.append(mel_filenames[-1])
+            if mel_encodings is not None:
+                mel_encodings.append(mel_encodings[-1])
         assert 0 == len(texts) % self.hparams.tacotron_num_gpus
-        seqs = [np.asarray(hangul_to_sequence(dir=hparams.base_dir, hangul_text=text, hangul_type=hparams.hangul_type)) for text in texts]
-        input_lengths = [len(seq) for seq in seqs]
         ## calculate sequence length on each GPU device
         sequence_size_per_device = len(seqs)// hparams.tacotron_num_gpus
 
-        ##### create input sequence on each GPU then concat
-        split_infos = []
-
-        input_sequence = None ### synthesize input sequence
-        for i in range(hparams.tacotron_num_gpus):
-            on_device_input_sequence = seqs[sequence_size_per_device*i : sequence_size_per_device*(i+1)]
-            on_device_input_sequence_padded, input_length = _prepare_inputs(inputs = on_device_input_sequence)
-            input_sequence = np.concatenate((input_sequence, on_device_input_sequence_padded), axis=1) if input_sequence is not None else on_device_input_sequence_padded
-            split_infos.append([input_length, 0,0,0])
+        ##### input sequences padded on each GPU then concatenated
+        input_sequence, input_lengths, device_lengths = pad_inputs(seqs, hparams.tacotron_num_gpus)
+        split_infos = [[input_length, 0, 0, 0] for input_length in device_lengths]
 
         ### add input info to feed dict
         feed_dict = {
             self.inputs: input_sequence,
-            self.input_lengths: np.asarray(input_lengths, dtype=np.int32)
+            self.input_lengths: input_lengths
         }
 
         if self.GTA:
-            np_targets = [np.load(mel_filename) for mel_filename in mel_filenames]
+            # mel targets stored with a compact encoding (ArtifactEncoding spec per file) are decoded to float32
+            mel_encodings = mel_encodings or [None] * len(mel_filenames)
+            np_targets = [ArtifactEncoding.decode(DatasetShards.load(mel_filename, 'mel'), spec)
+                          for mel_filename, spec in zip(mel_filenames, mel_encodings)]
             assert len(np_targets) == len(texts)
 
             #### get target sequence from mel_targets on each GPU
@@ -150,6 +157,9 @@ class Synthesizer:
         
         saved_mels_paths = []
         speaker_ids=[]
+        if log_dir is not None:
+            # invert the mels of the whole batch at once (mel -> wav)
+            wavs = mels_to_audio_series([mel.T for mel in mels], hparams)
         for (i,mel), text in zip(enumerate(mels), texts):
             # Get speaker id for global conditioning (only used with GTA generally)
             if hparams.gin_channels > 0:
@@ -169,8 +179,7 @@ class Synthesizer:
 
             if log_dir is not None:
                 # save wav (mel -> wav)
-                wav = mel_to_audio_serie(mel.T, hparams)
-                wav = inv_preemphasis(wav, hparams.preemphasis, hparams.preemphasize)
+                wav = wavs[i]
                 save_wav(wav, os.path.join(log_dir, 'wavs/speech-wav-{}-mel.wav'.format(basenames[i])),
                          sr=hparams.sample_rate)
                 # save alignments
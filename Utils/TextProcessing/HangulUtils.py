@@ -5,10 +5,13 @@ https://www.github.com/kyubyong/kss
 '''
 
 from __future__ import print_function
+import hashlib
 import os
+import re
 from itertools import chain
+import numpy as np
 from Utils.Hyperparams import hparams
-from Utils.TextProcessing.KoG2P import runKoG2P
+from Utils.TextProcessing.KoG2P import get_g2p
 
 hangul_symbol_1 = [u"␀", u"␃", u'"', " ", "!", ",", ".", "?", 'aa', 'c0', 'cc', 'ch', 'ee', 'h0', 'ii', 'k0', 'kf', 'kh',
                    'kk',
@@ -46,23 +49,29 @@ else:
     raise Exception('Hangul type must in range (1:5)')
 
 
+# bump when the text to id conversion changes (number_to_hangul, jamo tables...): precomputed ids are then recomputed
+SEQUENCE_VERSION = 1
+
+
+def symbol_table_version(dir=''):
+    '''Version of the ids hangul_to_sequence returns: hash of the symbol table, of the G2P rulebook and of SEQUENCE_VERSION'''
+    sha = hashlib.sha1('{}|{}'.format(SEQUENCE_VERSION, hangul_type).encode('utf-8'))
+    sha.update('|'.join(sorted(hangul_to_ids, key=hangul_to_ids.get)).encode('utf-8'))
+    if hangul_type == 1:
+        with open(os.path.join(dir, 'Utils/TextProcessing/rulebook.txt'), 'rb') as f:
+            sha.update(f.read())
+    return '{}-{}'.format(hangul_type, sha.hexdigest()[:12])
+
+
 def hangul_to_sequence(dir, hangul_text, hangul_type=1):
-    # load conversion dictionaries
-    j2hcj, j2sj, j2shcj = load_j2hcj(), load_j2sj(), load_j2shcj()
     rulebook = os.path.join(dir, 'Utils/TextProcessing/rulebook.txt')
-    hangul_text = number_to_hangul(hangul_text)
+    hangul_text = normalize_text(hangul_text)
     hangul_text = hangul_text + u"␃"  # ␃: EOS
     if hangul_type == 1:
-        hangul_text = runKoG2P(hangul_text, rulebook)
-    else:
-        if hangul_type == 3:
-            hangul_text = [j2hcj[char] for char in hangul_text]
-        elif hangul_type == 4:
-            hangul_text = [j2sj[char] for char in hangul_text]
-        elif hangul_type == 5:
-            hangul_text = [j2shcj[char] for char in hangul_text]
-    sequence = [hangul_to_ids[char] for char in hangul_text]
-    return sequence
+        hangul_text = get_g2p(rulebook).convert(hangul_text)
+        return [hangul_to_ids[char] for char in hangul_text]
+    # syllables are decomposed into jamo (converted for types 3 to 5) by one translate, then looked up all at once
+    return jamo_to_ids(hangul_text.translate(jamo_table(hangul_type)))
 
 ##m = hangul_to_sequence(dir='', hangul_text='사진좀봐라',hangul_type=1)
 
@@ -117,15 +126,69 @@ def load_j2shcj():
     return j2shcj
 
 
+# Precomputed conversion tables of hangul_to_sequence (hangul_type 2 to 5)
+SYLLABLES = range(0xAC00, 0xD7A4)  # the 11,172 precomposed syllables
+
+
+def decompose_syllable(syllable):
+    '''Conjoining jamo (0x01100-0x011FF) of the code point [syllable]: leading consonant, vowel and final consonant if any'''
+    index = syllable - SYLLABLES[0]
+    jamo = chr(0x1100 + index // 588) + chr(0x1161 + index % 588 // 28)
+    if index % 28:
+        jamo += chr(0x11A7 + index % 28)
+    return jamo
+
+
+def _translate_table(conversion=None):
+    '''str.translate table decomposing every syllable into jamo, converted by the dictionary [conversion] if given'''
+    table = {syllable: decompose_syllable(syllable) for syllable in SYLLABLES}
+    if conversion is not None:
+        # characters without a conversion are kept: they have no symbol id anyway
+        conversion = {ord(j): converted for j, converted in conversion.items()}
+        table = {syllable: jamo.translate(conversion) for syllable, jamo in table.items()}
+        table.update(conversion)
+    return table
+
+
+_jamo_conversions = {2: None, 3: load_j2hcj, 4: load_j2sj, 5: load_j2shcj}
+# hangul_type: str.translate table of the text
+jamo_tables = {}
+
+
+def jamo_table(hangul_type):
+    '''str.translate table of hangul_to_sequence for [hangul_type] (2 to 5), built once'''
+    table = jamo_tables.get(hangul_type)
+    if table is None:
+        conversion = _jamo_conversions[hangul_type]
+        table = jamo_tables[hangul_type] = _translate_table(conversion() if conversion is not None else None)
+    return table
+
+
+if hangul_type != 1:
+    jamo_table(hangul_type)
+
+# code point -> symbol id of the single character symbols of hangul_to_ids (all of them for types 2 to 5), -1 for
+# characters without symbol, the last entry is for all code points above the table
+code_to_id = np.full(max(ord(char) for char in hangul_to_ids if len(char) == 1) + 2, -1, dtype=np.int32)
+for char, idx in hangul_to_ids.items():
+    if len(char) == 1:
+        code_to_id[ord(char)] = idx
+
+
+def jamo_to_ids(text):
+    '''Symbol ids of the characters of [text], raises KeyError for a character without symbol'''
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    ids = code_to_id[np.minimum(codes, len(code_to_id) - 1)]
+    unknown = ids < 0
+    if unknown.any():
+        raise KeyError(text[int(np.argmax(unknown))])
+    return ids.tolist()
+
+
 # 숫자를 입력받아서 한글로 출력하는 함수
 # 1~999
 def number_to_hangul(text):
-    import re
-    numbers = re.findall(r"[+-]?\d+(?:\.\d+)?", text)
-    for number in numbers:
-        number_text = digit2txt(number)
-        text = text.replace(number, number_text, 1)
-    return text
+    return _number_re.sub(_expand_number, text)
 
 
 def digit2txt(strNum):
@@ -192,3 +255,134 @@ def digit2txt(strNum):
         if index >= len(strNum):
             break
     return resultStr
+
+
+# Single pass text normalizer of hangul_to_sequence: numbers (with their sign, currency and unit), then symbols, are
+# found by one compiled alternation and replaced by their reading. Numbers are read with the tables below, which give
+# the output of digit2txt, and readings are memoized. Only characters without symbol id are expanded, so the ids of
+# texts hangul_to_sequence already converted do not change.
+
+_txt_digit = ['', '십', '백', '천', '만', '억']
+_txt_number = ['', '일', '이', '삼', '사', '오', '육', '칠', '팔', '구']
+
+
+def _digit_reading(position, digit):
+    '''digit2txt reading of [digit] at [position] digits from the right of the integer part'''
+    shown = True
+    if position > 1 and position not in (4, 9) and digit == 1:
+        reading = ''
+    elif digit == 0:
+        reading = ''
+        shown = position in (4, 9)
+    else:
+        reading = _txt_number[digit]
+    if shown:
+        reading += _txt_digit[position - 9 if position > 9 else position - 4 if position > 4 else position]
+    return reading
+
+
+# _number_readings[n]: {digit: reading} of the digits of an n digit integer part, for up to 15 digits
+_number_readings = [[{str(digit): _digit_reading(position, digit) for digit in range(10)}
+                     for position in reversed(range(n))] for n in range(16)]
+# digits of longer numbers (phone, account numbers...) are read one by one
+_single_digits = {str(digit): reading for digit, reading in enumerate(['공'] + _txt_number[1:])}
+
+SIGNS = {'-': '마이너스', '+': '플러스'}
+CURRENCIES = {'$': '달러', '₩': '원', '€': '유로', '£': '파운드', '¥': '엔'}
+# read after a number (the longest unit matches)
+UNITS = {'km/h': '킬로미터', 'km': '킬로미터', 'cm': '센티미터', 'mm': '밀리미터', 'm': '미터', 'kg': '킬로그램',
+         'mg': '밀리그램', 'g': '그램', 'ml': '밀리리터', 'l': '리터', 'L': '리터', 'GB': '기가바이트', 'MB': '메가바이트',
+         'KB': '킬로바이트', '%': '퍼센트', '℃': '도', '°C': '도', '°': '도'}
+# symbols out of the symbol tables
+SYMBOLS = {'%': '퍼센트', '&': '앤드', '+': '플러스', '=': '는', '~': '에서', '℃': '도', '°': '도',
+           '$': '달러', '₩': '원', '€': '유로', '£': '파운드', '¥': '엔',
+           '-': ' ', '/': ' ', '·': ' ', '_': ' ', '|': ' ', '*': ' ', '^': ' ', '\\': ' ', '<': ' ', '>': ' ',
+           '(': ' ', ')': ' ', '[': ' ', ']': ' ', '{': ' ', '}': ' ', '「': ' ', '」': ' ', '『': ' ', '』': ' ',
+           ':': ',', ';': ',', '…': '.', '．': '.', '，': ',', '！': '!', '？': '?',
+           '“': '"', '”': '"', "'": '', '‘': '', '’': ''}
+
+
+def _alternation(words):
+    return '|'.join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+# a sign is only read at the start of a word (3-4 is a range, not 3 and -4)
+_number_pattern = r'(?P<sign>(?<![\w.])[+-])?(?P<number>\d+(?:\.\d+)?)'
+_number_re = re.compile(_number_pattern)
+_normalize_re = re.compile(r'(?P<currency>[{}])?{}(?:(?P<unit>{})(?![A-Za-z]))?|(?P<symbol>[{}])'.format(
+    ''.join(re.escape(c) for c in CURRENCIES), _number_pattern, _alternation(UNITS),
+    ''.join(re.escape(c) for c in SYMBOLS)))
+# first characters of the matches of _normalize_re: most texts have none, and a character class is searched much
+# faster than the alternation
+_token_start_re = re.compile(r'[\d{}]'.format(''.join(re.escape(c) for c in set(CURRENCIES) | set(SIGNS) | set(SYMBOLS))))
+
+
+def read_number(number):
+    '''Hangul reading of the unsigned number string [number] (digits, optional decimal part), as digit2txt'''
+    if not number.isascii():  # other unicode digits
+        number = ''.join(str(int(ch)) if ch != '.' else ch for ch in number)
+    integer, _, fraction = number.partition('.')
+    longest = len(_number_readings) - 1
+    if len(integer) > longest and integer[:-longest].strip('0'):
+        reading = ''.join(map(_single_digits.__getitem__, integer))
+    else:
+        # leading zeros are not read
+        integer = integer[-longest:]
+        reading = ''.join(map(dict.__getitem__, _number_readings[len(integer)], integer))
+    if fraction:
+        reading += '쩜 ' + ''.join(map(_number_readings[1][0].__getitem__, fraction))
+    return reading
+
+
+def _expand_number(match):
+    reading = read_number(match.group('number'))
+    sign = match.group('sign')
+    return reading if sign is None else SIGNS[sign] + reading
+
+
+def _expand(match):
+    symbol = match.group('symbol')
+    if symbol is not None:
+        return SYMBOLS[symbol]
+    reading = _expand_number(match)
+    currency, unit = match.group('currency', 'unit')
+    if currency is not None:
+        reading += CURRENCIES[currency]
+    if unit is not None:
+        reading += UNITS[unit]
+    return reading
+
+
+# matched text: reading, of the most frequent numbers, dates, amounts... (a matched text has only one reading)
+_readings = {}
+_MAX_READINGS = 1 << 16
+
+
+def _expand_match(match):
+    token = match.group()
+    reading = _readings.get(token)
+    if reading is None:
+        reading = _expand(match)
+        if len(_readings) < _MAX_READINGS:
+            _readings[token] = reading
+    return reading
+
+
+def normalize_text(text):
+    '''[text] with its numbers, units and symbols replaced by their hangul reading'''
+    # _normalize_re.sub(_expand_match, text), only trying _normalize_re where a match can start
+    start = _token_start_re.search(text)
+    if start is None:
+        return text
+    pieces, last = [], 0
+    while start is not None:
+        position = start.start()
+        match = _normalize_re.match(text, position)
+        if match is None:
+            start = _token_start_re.search(text, position + 1)
+            continue
+        pieces += [text[last:position], _expand_match(match)]
+        last = match.end()
+        start = _token_start_re.search(text, last)
+    pieces.append(text[last:])
+    return ''.join(pieces)
@@ -5,10 +5,20 @@ This is mostly adapted from https://github.com/scarletcho/KoG2P
 The author made this to run on both python 2 and 3, but we adapted to support only python 3
 '''
 
+import argparse
 import datetime as dt
+import os
+import random
 import re
 import math
 import sys
+import threading
+import time
+from bisect import bisect_right
+try:
+    from re import _parser as sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse
 
 # Check Python version
 ver_info = sys.version_info
@@ -61,6 +71,23 @@ def readRules(pver, rule_book):
     return rule_in, rule_out
 
 
+# Romanization tables (according to Korean Spontaneous Speech corpus; 성인자유발화코퍼스)
+ONS = ('k0', 'kk', 'nn', 't0', 'tt', 'rr', 'mm', 'p0', 'pp',
+       's0', 'ss', 'oh', 'c0', 'cc', 'ch', 'kh', 'th', 'ph', 'h0')
+NUC = ('aa', 'qq', 'ya', 'yq', 'vv', 'ee', 'yv', 'ye', 'oo', 'wa',
+       'wq', 'wo', 'yo', 'uu', 'wv', 'we', 'wi', 'yu', 'xx', 'xi', 'ii')
+COD = ('', 'kf', 'kk', 'ks', 'nf', 'nc', 'nh', 'tf',
+       'll', 'lk', 'lm', 'lb', 'ls', 'lt', 'lp', 'lh',
+       'mf', 'pf', 'ps', 's0', 'ss', 'oh', 'c0', 'ch',
+       'kh', 'th', 'ph', 'h0')
+
+# patterns of graph2phone and graph2prono, compiled once
+_delimiters_re = re.compile("`+")
+_final_oh_re = re.compile('oh`$')
+_final_space_re = re.compile(u' $')
+_ats_re = re.compile(u'@+')
+
+
 def isHangul(charint):
     hangul_init = 44032
     hangul_fin = 55203
@@ -82,6 +109,25 @@ def checkCharType(var_list):
     return checked
 
 
+class _Romanization(dict):
+    '''str.translate table of graph2phone: romanized syllables and space, other characters are added when first seen'''
+
+    def __missing__(self, char):
+        romanized = self[char] = "`" + chr(char) + "`"
+        return romanized
+
+
+def _romanize(syllable):
+    df = syllable - 44032
+    # onset, nucleus and coda (empty coda gives an empty field, collapsed by graph2phone)
+    return "`@" + ONS[df // 588] + "`" + NUC[df % 588 // 28] + "`" + COD[df % 28] + "`"
+
+
+# Romanization of the 11,172 precomposed syllables, computed once
+_romanization = _Romanization((syllable, _romanize(syllable)) for syllable in range(44032, 55204))
+_romanization[32] = '`#`'  # whitespace
+
+
 def graph2phone(graphs):
     # Encode graphemes as utf8
     try:
@@ -89,54 +135,11 @@ def graph2phone(graphs):
     except AttributeError:
         pass
 
-    integers = []
-    for i in range(len(graphs)):
-        integers.append(ord(graphs[i]))
-
-    # Romanization (according to Korean Spontaneous Speech corpus; 성인자유발화코퍼스)
-    phones = ''
-    ONS = ['k0', 'kk', 'nn', 't0', 'tt', 'rr', 'mm', 'p0', 'pp',
-           's0', 'ss', 'oh', 'c0', 'cc', 'ch', 'kh', 'th', 'ph', 'h0']
-    NUC = ['aa', 'qq', 'ya', 'yq', 'vv', 'ee', 'yv', 'ye', 'oo', 'wa',
-           'wq', 'wo', 'yo', 'uu', 'wv', 'we', 'wi', 'yu', 'xx', 'xi', 'ii']
-    COD = ['', 'kf', 'kk', 'ks', 'nf', 'nc', 'nh', 'tf',
-           'll', 'lk', 'lm', 'lb', 'ls', 'lt', 'lp', 'lh',
-           'mf', 'pf', 'ps', 's0', 'ss', 'oh', 'c0', 'ch',
-           'kh', 'th', 'ph', 'h0']
-
-    # Pronunciation
-    idx = checkCharType(integers)
-    iElement = 0
-    while iElement < len(integers):
-        if idx[iElement] == 0:  # not space characters
-            base = 44032
-            df = int(integers[iElement]) - base
-            iONS = int(math.floor(df / 588)) + 1
-            iNUC = int(math.floor((df % 588) / 28)) + 1
-            iCOD = int((df % 588) % 28) + 1
-
-            s1 = '@' + ONS[iONS - 1]  # onset
-            s2 = NUC[iNUC - 1]  # nucleus
-
-            if COD[iCOD - 1]:  # coda
-                s3 = COD[iCOD - 1]
-            else:
-                s3 = ''
-            tmp = "`" + s1 + "`" + s2 + "`" + s3 + "`"
-            phones = phones + tmp
-
-        elif idx[iElement] == 1:  # space character
-            tmp = '`#`'
-            phones = phones + tmp
-
-        else:  # non-Hangul
-            phones += "`" + chr(integers[iElement]) + "`"
-
-        iElement += 1
-        tmp = ''
+    # Romanization (ONS, NUC and COD tables)
+    phones = graphs.translate(_romanization)
 
     # Collapse syllable delimiters (`).
-    phones = re.sub("`+", "`", phones)
+    phones = _delimiters_re.sub("`", phones)
 
     # 초성 이응 삭제
     phones = phones.replace("`@oh`", "`@")
@@ -146,12 +149,12 @@ def graph2phone(graphs):
     phones = phones.replace("oh`@", "ng`@")
     # print(phones,"===")
     phones = phones.replace("oh`#", "ng`#")
-    phones = re.sub('oh`$', 'ng`', phones)
+    phones = _final_oh_re.sub('ng`', phones)
     return phones
 
 
 def phone2prono(phones, rule_in, rule_out):
-    # Apply g2p rules
+    # Apply g2p rules (rule_in: pattern strings or compiled patterns)
     for pattern, replacement in zip(rule_in, rule_out):
         _phones = phones
         phones = re.sub(pattern, replacement, phones)
@@ -163,14 +166,13 @@ def phone2prono(phones, rule_in, rule_out):
 
 
 def graph2prono(graphs, rule_in, rule_out):
-    import re
     romanized = graph2phone(graphs)
     prono = phone2prono(romanized, rule_in, rule_out)
 
-    prono = re.sub(u'`', u' ', prono)
-    prono = re.sub(u' $', u'', prono)
+    prono = prono.replace(u'`', u' ')
+    prono = _final_space_re.sub(u'', prono)
     # prono = re.sub(u'#', u'@', prono)
-    prono = re.sub(u'@+', u'@', prono)
+    prono = _ats_re.sub(u'@', prono)
 
     prono_prev = prono
     identical = False
@@ -181,13 +183,13 @@ def graph2prono(graphs, rule_in, rule_out):
     # print('=> Initial output: ' + prono)
     prono_new=''
     while not identical:
-        prono_new = phone2prono(re.sub(u' ', u'`', prono_prev + u'`'), rule_in, rule_out)
-        prono_new = re.sub(u'`', u' ', prono_new)
-        prono_new = re.sub(u' $', u'', prono_new)
+        prono_new = phone2prono((prono_prev + u'`').replace(u' ', u'`'), rule_in, rule_out)
+        prono_new = prono_new.replace(u'`', u' ')
+        prono_new = _final_space_re.sub(u'', prono_new)
 
-        if re.sub(u'@', u'', prono_prev) == re.sub(u'@', u'', prono_new):
+        if prono_prev.replace(u'@', u'') == prono_new.replace(u'@', u''):
             identical = True
-            prono_new = re.sub(u'@', u'', prono_new)
+            prono_new = prono_new.replace(u'@', u'')
         else:
             loop_cnt += 1
             prono_prev = prono_new
@@ -195,8 +197,331 @@ def graph2prono(graphs, rule_in, rule_out):
     return prono_new
 
 
+# Rule engine of KoG2P.graph2prono
+#
+# graph2prono applies every rule to the whole string, pass after pass, until a pass changes nothing but '@'s. KoG2P
+# gives the same output with less work:
+#   - trigger: every rule has a set of literals one of which is in any string it matches (from the parsed pattern),
+#       rules none of whose literals is in the string are not run
+#   - dirty spans: after the first pass, a rule can only match near a span matched in the previous pass or earlier in
+#       this one (elsewhere the string is what the previous pass already saw), so the following passes only search the
+#       rules around those spans, [width] characters wide (the characters a match looks at, lookarounds included)
+# Rules with an unbounded width (or a pattern element the helpers below do not know) are always searched entirely.
+
+_REPEATS = ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT')
+_ONE_CHARACTER = ('LITERAL', 'NOT_LITERAL', 'ANY', 'IN')
+# hot spans closer than this are merged
+_SPAN_GAP = 32
+# above this many hot spans, a rule is searched once from the first to the last one
+_MAX_SPAN_SEARCHES = 4
+
+
+def _literals(items):
+    '''Candidate triggers of the parsed pattern [items]: tuples of literals one of which is in every match'''
+    candidates, run = [], ''
+    for op, av in items:
+        name = str(op)
+        if name == 'LITERAL':
+            run += chr(av)
+            continue
+        if run:
+            candidates.append((run, ))
+            run = ''
+        if name == 'SUBPATTERN':
+            candidates += _literals(av[-1])
+        elif name in _REPEATS and av[0] >= 1:
+            candidates += _literals(av[2])
+        elif name == 'ASSERT':
+            candidates += _literals(av[1])
+        elif name == 'BRANCH':
+            alternatives = [_best_trigger(_literals(alternative)) for alternative in av[1]]
+            if all(alternatives):
+                candidates.append(tuple(sorted(set(literal for a in alternatives for literal in a))))
+    if run:
+        candidates.append((run, ))
+    return candidates
+
+
+def _best_trigger(candidates):
+    # longest shortest literal, then fewest literals
+    return max(candidates, key=lambda c: (min(len(literal) for literal in c), -len(c)), default=None)
+
+
+def _width(items):
+    '''Characters a match of the parsed pattern [items] looks at (lookarounds included), None when unbounded'''
+    total = 0
+    for op, av in items:
+        name = str(op)
+        if name in _ONE_CHARACTER:
+            width = 1
+        elif name == 'AT':
+            width = 0
+        elif name == 'SUBPATTERN':
+            width = _width(av[-1])
+        elif name in ('ASSERT', 'ASSERT_NOT'):
+            width = _width(av[1])
+        elif name == 'BRANCH':
+            widths = [_width(alternative) for alternative in av[1]]
+            width = None if None in widths else max(widths)
+        elif name in _REPEATS:
+            width = _width(av[2])
+            if width is not None:
+                width = None if av[1] == sre_parse.MAXREPEAT else av[1] * width
+        else:
+            return None
+        if width is None:
+            return None
+        total += width
+    return total
+
+
+def rule_trigger(pattern):
+    '''Literals one of which is in every string the compiled [pattern] matches, None when unknown'''
+    if pattern.flags & ~re.UNICODE:
+        return None
+    return _best_trigger(_literals(sre_parse.parse(pattern.pattern, pattern.flags)))
+
+
+def rule_width(pattern):
+    '''Characters a match of the compiled [pattern] looks at, None when unbounded or unknown'''
+    if pattern.flags & ~re.UNICODE:
+        return None
+    return _width(sre_parse.parse(pattern.pattern, pattern.flags))
+
+
+def _merge(spans):
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + _SPAN_GAP:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _move(spans, edits):
+    '''[spans] of a string after the [edits] (start, end, replacement length) to it, plus the replaced spans'''
+    starts = [start for start, _, _ in edits]
+    # length change of the edits before each edit
+    shifts, shift = [], 0
+    for start, end, length in edits:
+        shifts.append(shift)
+        shift += length - (end - start)
+
+    def position(x, after):
+        i = bisect_right(starts, x) - 1
+        if i < 0:
+            return x
+        start, end, length = edits[i]
+        if x >= end:
+            return x + shifts[i] + length - (end - start)
+        # inside a replaced span: the whole replacement for span ends
+        return start + shifts[i] + (length if after else 0)
+
+    moved = [(position(start, False), position(end, True)) for start, end in spans]
+    moved += [(start + shift, start + shift + length) for (start, _, length), shift in zip(edits, shifts)]
+    return _merge(moved)
+
+
+def _search_near(pattern, phones, spans, width):
+    '''Whether [pattern] matches [phones] around one of [spans], looking at most [width] characters'''
+    if len(spans) > _MAX_SPAN_SEARCHES:
+        return pattern.search(phones, max(0, spans[0][0] - width), spans[-1][1] + 2 * width) is not None
+    for start, end in spans:
+        if pattern.search(phones, max(0, start - width), end + 2 * width) is not None:
+            return True
+    return False
+
+
+def _common_prefix(a, b):
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _follow(old, new, spans):
+    '''[spans] of the string [old] in its changed version [new], plus the changed part'''
+    if old == new:
+        return spans
+    prefix = _common_prefix(old, new)
+    suffix = _common_prefix(old[prefix:][::-1], new[prefix:][::-1])
+    return _move(spans, [(prefix, len(old) - suffix, len(new) - suffix - prefix)])
+
+
+class KoG2P:
+    '''
+        Grapheme to phoneme converter of a rulebook, read and compiled once.
+    '''
+
+    def __init__(self, rulebook):
+        rule_in, rule_out = readRules(ver_info[0], rulebook)
+        self.rule_in = [re.compile(pattern) for pattern in rule_in]
+        self.rule_out = rule_out
+        # (pattern, replacement, whether it has group references, trigger, width)
+        self._rules = [(pattern, replacement, '\\' in replacement, rule_trigger(pattern) or (), rule_width(pattern))
+                       for pattern, replacement in zip(self.rule_in, self.rule_out)]
+
+    def convert(self, graph):
+        '''phones of the text [graph] (word boundaries are ' ' phones)'''
+        prono = self.graph2prono(graph)
+        return [phone.replace("#", " ") for phone in prono.split()]
+
+    def phone2prono(self, phones, hot=None):
+        '''
+        phone2prono() of [phones], only searching the rules around the spans [hot] (everywhere if None)
+
+        Returns:
+            - A tuple (prono, spans matched by the rules in prono)
+        '''
+        matched = []
+        for pattern, replacement, template, trigger, width in self._rules:
+            for literal in trigger:
+                if literal in phones:
+                    break
+            else:
+                if trigger:
+                    continue
+            if hot is not None and width is not None and not _search_near(pattern, phones, hot, width):
+                continue
+            pieces, edits, last = [], [], 0
+            for match in pattern.finditer(phones):
+                start, end = match.span()
+                replaced = match.expand(replacement) if template else replacement
+                pieces += [phones[last:start], replaced]
+                edits.append((start, end, len(replaced)))
+                last = end
+            if not edits:
+                continue
+            pieces.append(phones[last:])
+            phones = ''.join(pieces)
+            matched = _move(matched, edits)
+            if hot is not None:
+                hot = _move(hot, edits)
+        return phones, matched
+
+    def graph2prono(self, graphs):
+        '''graph2prono() with the rules of this converter'''
+        prono, matched = self.phone2prono(graph2phone(graphs))
+        phones = prono
+
+        prono = prono.replace(u'`', u' ')
+        prono = _final_space_re.sub(u'', prono)
+        prono = _ats_re.sub(u'@', prono)
+
+        prono_prev = prono
+        while True:
+            next_phones = (prono_prev + u'`').replace(u' ', u'`')
+            # the rules can only match again around what the previous pass matched
+            phones, matched = self.phone2prono(next_phones, _follow(phones, next_phones, matched))
+            prono_new = phones.replace(u'`', u' ')
+            prono_new = _final_space_re.sub(u'', prono_new)
+
+            if prono_prev.replace(u'@', u'') == prono_new.replace(u'@', u''):
+                prono_new = prono_new.replace(u'@', u'')
+                break
+            prono_prev = prono_new
+        return prono_new.strip()
+
+
+_converters = {}
+_converters_lock = threading.Lock()
+
+
+def get_g2p(rulebook):
+    '''KoG2P converter of [rulebook], built once per process'''
+    key = os.path.abspath(rulebook)
+    converter = _converters.get(key)
+    if converter is None:
+        with _converters_lock:
+            converter = _converters.get(key)
+            if converter is None:
+                converter = _converters[key] = KoG2P(rulebook)
+    return converter
+
+
 def runKoG2P(graph, rulebook):
-    [rule_in, rule_out] = readRules(ver_info[0], rulebook)
-    prono = graph2prono(graph, rule_in, rule_out)
-    phones = [phone.replace("#", " ") for phone in prono.split()]
-    return phones
+    return get_g2p(rulebook).convert(graph)
+
+
+def example_words(rulebook):
+    '''Hangul words of the comments of the rules of [rulebook] (examples of what the rules apply to)'''
+    words = set()
+    with open(rulebook, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('#') or '#' not in line.split('\t', 2)[-1]:
+                continue
+            comment = line.split('\t', 2)[-1].split('#', 1)[1]
+            for word in re.split(r'[^\uac00-\ud7a3]+', comment):
+                if word:
+                    words.add(word)
+    return sorted(words)
+
+
+def make_corpus(rulebook, n_texts=2000, max_words=400, sentences=None, seed=0):
+    '''
+    [n_texts] random texts from single words to paragraphs of up to [max_words] words, made of the example words of
+    the rulebook, the words of the [sentences] file and random syllables, digits, latin letters and punctuation
+    '''
+    rng = random.Random(seed)
+    words = example_words(rulebook)
+    if sentences is not None:
+        with open(sentences, encoding='utf-8') as f:
+            words += f.read().split()
+    punctuation = ['.', ',', '?', '!', '~', '"']
+    texts = []
+    for _ in range(n_texts):
+        n_words = int(rng.paretovariate(1.) * 3) % max_words + 1
+        text = []
+        for _ in range(n_words):
+            kind = rng.random()
+            if kind < .6 and words:
+                word = rng.choice(words)
+            elif kind < .9:
+                word = ''.join(chr(rng.randint(0xAC00, 0xD7A3)) for _ in range(rng.randint(1, 4)))
+            else:
+                word = rng.choice([str(rng.randint(0, 1000)), 'abc', 'TTS'])
+            if rng.random() < .1:
+                word += rng.choice(punctuation)
+            text.append(word)
+        texts.append(' '.join(text))
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that KoG2P.graph2prono gives the output of graph2prono, and time both')
+    parser.add_argument('--rulebook', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rulebook.txt'))
+    parser.add_argument('--n_texts', type=int, default=2000)
+    parser.add_argument('--max_words', type=int, default=400)
+    parser.add_argument('--sentences', default=None, help='Text file whose words are added to the corpus')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = make_corpus(args.rulebook, args.n_texts, args.max_words, args.sentences, args.seed)
+    converter = KoG2P(args.rulebook)
+    start = time.perf_counter()
+    expected = [graph2prono(text, converter.rule_in, converter.rule_out) for text in texts]
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    output = [converter.graph2prono(text) for text in texts]
+    seconds = time.perf_counter() - start
+
+    mismatches = [i for i, (a, b) in enumerate(zip(expected, output)) if a != b]
+    print('{} texts, {} characters'.format(len(texts), sum(len(text) for text in texts)))
+    print('graph2prono: {:.2f} s, KoG2P.graph2prono: {:.2f} s ({:.2f}x)'.format(reference_seconds, seconds,
+                                                                             reference_seconds / seconds))
+    for i in mismatches[:10]:
+        print('mismatch: {}\n  expected {}\n  got      {}'.format(texts[i], expected[i], output[i]))
+    if mismatches:
+        print('{} mismatches'.format(len(mismatches)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from Utils.TextProcessing.HangulUtils import hangul_to_sequence, normalize_text, symbol_table_version
+
+'''
+Persistent cache of the symbol ids of synthesis texts (prompts, menu items, numbers... recur a lot).
+
+The ids hangul_to_sequence gives for a text are stored in an sqlite database (hparams.phoneme_cache_path):
+    - table phonemes: version, text (normalized by normalize_text), ids (int32 bytes), used (last use time)
+    - version: hangul_type and HangulUtils.symbol_table_version(), so ids made with another symbol table, rulebook
+        or conversion code are never returned (and are evicted as they are not used any more)
+    - the database is in WAL mode: several synthesis processes can read it while one of them writes
+    - it holds at most hparams.phoneme_cache_entries texts, the least recently used ones are removed. The last use
+        times of disk hits are buffered in memory and written in one transaction on put, eviction and close, so
+        lookups stay reads
+In front of it, the ids of the most recent texts are kept in memory (least recently used first out), hits there take
+a few microseconds.
+'''
+
+
+class PhonemeCache:
+    '''
+        Symbol ids of texts, computed once and kept on disk.
+    '''
+
+    def __init__(self, path, hparams, max_entries=None, memory_entries=4096):
+        self.path = path
+        self._hparams = hparams
+        self.version = '{}|{}'.format(hparams.hangul_type, symbol_table_version(hparams.base_dir))
+        self.max_entries = max_entries or hparams.phoneme_cache_entries
+        self._memory = OrderedDict()
+        self._memory_entries = memory_entries
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._used = {}  # rowid: last use time of the disk hits, not written yet
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS phonemes (version TEXT NOT NULL, text TEXT NOT NULL, ids BLOB NOT NULL, '
+                         'used REAL NOT NULL, UNIQUE (version, text))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS phonemes_used ON phonemes (used)')
+
+    def get(self, text):
+        '''Cached int32 ids of [text], None if not cached'''
+        with self._lock:
+            ids = self._memory.get(text)
+            if ids is not None:
+                self._memory.move_to_end(text)
+                return ids
+            key = normalize_text(text)
+            row = self._db.execute('SELECT rowid, ids FROM phonemes WHERE version = ? AND text = ?',
+                                   (self.version, key)).fetchone()
+            if row is None:
+                return None
+            self._used[row[0]] = time.time()
+            ids = np.frombuffer(row[1], dtype=np.int32)
+            self._remember(text, ids)
+            return ids
+
+    def put(self, text, ids):
+        ids = np.asarray(ids, dtype=np.int32)
+        ids.setflags(write=False)  # shared by the callers of get()
+        with self._lock:
+            self._flush_used()
+            self._db.execute('INSERT OR REPLACE INTO phonemes (version, text, ids, used) VALUES (?, ?, ?, ?)',
+                             (self.version, normalize_text(text), ids.tobytes(), time.time()))
+            self._remember(text, ids)
+            self._puts += 1
+            if self._puts % (self.max_entries // 10 + 1) == 1:
+                self._evict()
+        return ids
+
+    def sequence(self, text):
+        '''int32 symbol ids of [text], converted by hangul_to_sequence on cache misses'''
+        ids = self.get(text)
+        if ids is None:
+            ids = self.put(text, hangul_to_sequence(dir=self._hparams.base_dir, hangul_text=text,
+                                                    hangul_type=self._hparams.hangul_type))
+        return ids
+
+    def _remember(self, text, ids):
+        self._memory[text] = ids
+        if len(self._memory) > self._memory_entries:
+            self._memory.popitem(last=False)
+
+    def _flush_used(self):
+        '''Write the buffered last use times in one transaction'''
+        if not self._used:
+            return
+        used, self._used = self._used, {}
+        self._db.execute('BEGIN')
+        try:
+            self._db.executemany('UPDATE phonemes SET used = ? WHERE rowid = ?',
+                                 [(when, rowid) for rowid, when in used.items()])
+            self._db.execute('COMMIT')
+        except sqlite3.Error:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def _evict(self):
+        '''Remove the least recently used texts above max_entries (and a tenth more, not to evict at every put)'''
+        self._flush_used()
+        count = self._db.execute('SELECT COUNT(*) FROM phonemes').fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute('DELETE FROM phonemes WHERE rowid IN (SELECT rowid FROM phonemes ORDER BY used LIMIT ?)',
+                             (count - self.max_entries + self.max_entries // 10, ))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM phonemes WHERE version = ?', (self.version, )).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._flush_used()
+            self._db.close()
+
+
+def open_cache(hparams):
+    '''PhonemeCache of hparams.phoneme_cache_path, None when it is not set'''
+    if not hparams.phoneme_cache_path:
+        return None
+    return PhonemeCache(os.path.join(hparams.base_dir, hparams.phoneme_cache_path), hparams)
@@ -0,0 +1,93 @@
+import re
+
+'''
+Segmentation of long-form text (paragraphs, documents) into pieces the Tacotron decodes well.
+
+A whole paragraph fed as one sentence is one huge decode: it runs into max_iters and its attention and alignment
+tensors grow with the document. segment_text() cuts it into segments of min_chars to max_chars characters:
+    - at sentence ends first (. ! ? … followed by a space, so 3.5 or 1.000 are not cut)
+    - then, in sentences longer than max_chars, at clause ends (, ; : followed by a space)
+    - then, in clauses still too long, between words, in pieces of about the same length
+    - short neighbouring pieces are merged back, up to max_chars
+Each segment comes with the boundary it ends on ('sentence', 'clause', 'word', or None for the end of the text),
+which gives the pause put after it when the audio is stitched (see Utils/AudioProcessing/stitching.py).
+'''
+
+SENTENCE = 'sentence'
+CLAUSE = 'clause'
+WORD = 'word'
+
+_sentence_end_re = re.compile(r'[.!?。…]+["\'”’)\]]*(?=\s)')
+_clause_end_re = re.compile(r'[,;:，、]+["\'”’)\]]*(?=\s)')
+_space_re = re.compile(r'\s+')
+
+
+def _split_after(text, pattern):
+    '''Pieces of [text] cut after every match of [pattern], stripped and non-empty'''
+    pieces, start = [], 0
+    for match in pattern.finditer(text):
+        pieces.append(text[start: match.end()])
+        start = match.end()
+    pieces.append(text[start:])
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+
+def _split_words(text, max_chars):
+    '''[text] cut between words into the fewest pieces of at most [max_chars] characters, of about the same length'''
+    words = []
+    for word in text.split():
+        # words longer than max_chars (e.g. long numbers or urls) are cut anywhere
+        words += [word[i: i + max_chars] for i in range(0, len(word), max_chars)]
+    n_pieces = -(-len(text) // max_chars)
+    target = len(text) / n_pieces
+    pieces, current = [], ''
+    for word in words:
+        joined = current + ' ' + word if current else word
+        if current and (len(joined) > max_chars or len(current) >= target):
+            pieces.append(current)
+            joined = word
+        current = joined
+    pieces.append(current)
+    return pieces
+
+
+def _pieces(text, max_chars):
+    '''(piece, boundary) of [text], every piece being at most [max_chars] characters long'''
+    pieces = []
+    for sentence in _split_after(text, _sentence_end_re):
+        clauses = _split_after(sentence, _clause_end_re) if len(sentence) > max_chars else [sentence]
+        for i, clause in enumerate(clauses):
+            words = _split_words(clause, max_chars) if len(clause) > max_chars else [clause]
+            pieces += [(word, WORD) for word in words[:-1]]
+            pieces.append((words[-1], SENTENCE if i == len(clauses) - 1 else CLAUSE))
+    return pieces
+
+
+def segment_text(text, min_chars=30, max_chars=100):
+    '''
+    Segments of [text] to synthesize separately
+
+    Returns:
+        - A list of (segment, boundary) tuples: segments of min_chars to max_chars characters (unless the text or one
+            of its sentences is shorter), boundary: SENTENCE, CLAUSE or WORD the segment ends on, None for the last one
+    '''
+    assert 0 < min_chars <= max_chars
+    segments = []
+    for piece, boundary in _pieces(_space_re.sub(' ', text).strip(), max_chars):
+        if segments and len(segments[-1][0]) + 1 + len(piece) <= max_chars and \
+                (len(segments[-1][0]) < min_chars or len(piece) < min_chars):
+            segments[-1] = (segments[-1][0] + ' ' + piece, boundary)
+        else:
+            segments.append((piece, boundary))
+    if segments:
+        segments[-1] = (segments[-1][0], None)
+    return segments
+
+
+def balanced_batches(lengths, batch_size):
+    '''
+    Indices of [lengths] grouped in batches of at most [batch_size], items of similar length together (sorted by
+    length), so little of every batch is padding
+    '''
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i: i + batch_size] for i in range(0, len(order), batch_size)]
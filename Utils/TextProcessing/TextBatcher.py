@@ -0,0 +1,154 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Utils.TextProcessing.HangulUtils import hangul_to_sequence
+from Utils.TextProcessing.PhonemeCache import open_cache
+
+'''
+Batch conversion of synthesis sentences to the symbol ids fed to the Tacotron inputs / input_lengths placeholders.
+
+Normalization and G2P of a sentence (hangul_to_sequence) take about as long as decoding a short one, and the
+synthesizer used to run them one sentence at a time right before session.run. TextBatcher converts sentences in a pool
+of worker processes instead:
+    - sequences(texts): the id sequences of thousands of sentences, in chunks spread over the workers
+    - batches(texts, batch_size): the sentences batch by batch with their sequences, the next [prefetch] batches
+        being converted while the caller runs the model on the current one
+    - pad_inputs(sequences, num_gpus): the padded inputs, input lengths and per device lengths of Synthesizer.synthesize
+With hparams.phoneme_cache_path, sentences are first looked up in the PhonemeCache (in this process, which also writes
+the converted ones to it), only the others are sent to the workers.
+Create the batcher before the tensorflow session: the workers are started right away, before the threads of the
+session.
+'''
+
+
+def texts_to_sequences(texts, base_dir, hangul_type):
+    '''Worker job: int32 symbol ids of [texts]'''
+    return [np.asarray(hangul_to_sequence(dir=base_dir, hangul_text=text, hangul_type=hangul_type), dtype=np.int32)
+            for text in texts]
+
+
+def pad_inputs(sequences, num_gpus=1):
+    '''
+    Feed of a batch of symbol id [sequences] split evenly over [num_gpus] devices (as Synthesizer.synthesize does):
+    each device's sequences are padded to their longest one, and the devices are concatenated along the time axis
+
+    Returns:
+        - A tuple (inputs [batch, sum of the device lengths], input_lengths [batch], device lengths [num_gpus])
+    '''
+    assert len(sequences) % num_gpus == 0
+    input_lengths = np.asarray([len(sequence) for sequence in sequences], dtype=np.int32)
+    per_device = len(sequences) // num_gpus
+    device_lengths = [int(input_lengths[per_device * i: per_device * (i + 1)].max()) for i in range(num_gpus)]
+    inputs = np.zeros((per_device, sum(device_lengths)), dtype=np.int32)  # padded with 0 (Tacotron_feeder._pad)
+    offset = 0
+    for i, device_length in enumerate(device_lengths):
+        for row, sequence in enumerate(sequences[per_device * i: per_device * (i + 1)]):
+            inputs[row, offset: offset + len(sequence)] = sequence
+        offset += device_length
+    return inputs, input_lengths, device_lengths
+
+
+class TextBatcher:
+    '''
+        Symbol ids of synthesis sentences, converted by worker processes ahead of their use.
+    '''
+
+    def __init__(self, hparams, n_jobs=None, chunk_size=32):
+        self._hparams = hparams
+        self._chunk_size = chunk_size
+        self._cache = open_cache(hparams)
+        n_jobs = hparams.tacotron_synthesis_text_jobs if n_jobs is None else n_jobs
+        n_jobs = multiprocessing.cpu_count() if n_jobs is None else n_jobs
+        # n_jobs 0: converted in this process (not overlapped with the model)
+        self._executor = ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 0 else None
+        if self._executor is not None:
+            # start the workers (and load the G2P rulebook in them) now
+            for future in [self._executor.submit(texts_to_sequences, ['가'], hparams.base_dir, hparams.hangul_type)
+                           for _ in range(n_jobs)]:
+                future.result()
+
+    def _submit(self, texts):
+        '''
+        Conversion of [texts]: a tuple (cached sequences, None for the others, futures of the sequences of the others in
+        chunks of chunk_size sentences)
+        '''
+        cached = [self._cache.get(text) for text in texts] if self._cache is not None else [None] * len(texts)
+        missing = [text for text, sequence in zip(texts, cached) if sequence is None]
+        chunks = [missing[i: i + self._chunk_size] for i in range(0, len(missing), self._chunk_size)]
+        if self._executor is None:
+            futures = [_Done(texts_to_sequences(chunk, self._hparams.base_dir, self._hparams.hangul_type))
+                       for chunk in chunks]
+        else:
+            futures = [self._executor.submit(texts_to_sequences, chunk, self._hparams.base_dir,
+                                             self._hparams.hangul_type) for chunk in chunks]
+        return cached, futures
+
+    def _result(self, texts, conversion):
+        '''Sequences of [texts] from their _submit() [conversion]'''
+        cached, futures = conversion
+        converted = iter([sequence for future in futures for sequence in future.result()])
+        sequences = []
+        for text, sequence in zip(texts, cached):
+            if sequence is None:
+                sequence = next(converted)
+                if self._cache is not None:
+                    self._cache.put(text, sequence)
+            sequences.append(sequence)
+        return sequences
+
+    def sequences(self, texts):
+        '''int32 symbol ids of every sentence of [texts]'''
+        texts = list(texts)
+        return self._result(texts, self._submit(texts))
+
+    def batch(self, texts):
+        '''
+        pad_inputs() of [texts] over hparams.tacotron_num_gpus devices, the last sentence being repeated until every
+        device has the same number of sentences (as in Synthesizer.synthesize)
+        '''
+        sequences = self.sequences(texts)
+        num_gpus = self._hparams.tacotron_num_gpus
+        sequences += sequences[-1:] * (-len(sequences) % num_gpus)
+        return pad_inputs(sequences, num_gpus)
+
+    def batches(self, texts, batch_size, prefetch=2):
+        '''
+        Generator of the (sentences, sequences) batches of [texts]: while a batch is used, the [prefetch] next ones
+        are being converted
+        '''
+        texts = list(texts)
+        pending = deque()
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start: start + batch_size]
+            pending.append((batch, self._submit(batch)))
+            if len(pending) > prefetch:
+                batch, conversion = pending.popleft()
+                yield batch, self._result(batch, conversion)
+        while pending:
+            batch, conversion = pending.popleft()
+            yield batch, self._result(batch, conversion)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Done:
+    '''Result of a job run in this process, with the interface of a future'''
+
+    def __init__(self, result):
+        self._result = result
+
+    def result(self):
+        return self._result
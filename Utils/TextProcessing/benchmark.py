@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import numpy as np
+from Utils.Hyperparams import hparams
+from Utils.TextProcessing import HangulUtils, TextPreprocessing
+from Utils.TextProcessing.KoG2P import example_words, runKoG2P
+
+'''
+Latency benchmark of the text front-end, the part of every synthesis request before the model.
+
+    python -m Utils.TextProcessing.benchmark --n_texts 300 --output text_bench.json
+
+    - corpus: generated texts of each kind, made of the example words of the G2P rulebook, the words of sentences.txt
+        and random syllables: 'word' (1 to 3 words), 'sentence' (5 to 20 words), 'paragraph' (60 to 200 words),
+        'numbers' (prices, dates, phone numbers, decimals, percentages...), plus 'sample' (the lines of sentences.txt
+        and hparams.sentences) and 'english' (sentences with numbers, amounts and abbreviations)
+    - stages: HangulUtils.normalize_text, number_to_hangul, KoG2P.runKoG2P (on normalized text), the whole
+        hangul_to_sequence for hparams.hangul_type, and the english_cleaners / basic_cleaners of TextPreprocessing.py
+    - texts hangul_to_sequence cannot convert (symbols out of the table, e.g. latin letters) are left out of the
+        korean kinds, their number is reported
+    - every stage is called once before the measure (rulebook and tables loading), then on every text of its corpus
+        kinds, --repeat times; it reports sentences and characters per second and the latency percentiles of a call
+The results are printed and saved as json. With --baseline (the json of a previous run), the sentences per second of
+each stage and corpus kind are compared to it, and the command fails when one regressed by more than --max_regression.
+'''
+
+KOREAN_KINDS = ('word', 'sentence', 'paragraph', 'numbers', 'sample')
+ENGLISH_KINDS = ('english', )
+PERCENTILES = (50, 90, 99)
+
+_rulebook = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rulebook.txt')
+_english_words = ['the', 'model', 'reads', 'a', 'sentence', 'from', 'text', 'and', 'speaks', 'it', 'with', 'prosody',
+                  'of', 'voice', 'quality', 'train', 'on', 'data', 'at', 'street']
+
+
+def _number(rng):
+    '''A random number-heavy token, as found in news and prompts'''
+    kind = rng.randrange(8)
+    if kind == 0:
+        return '{:,}원'.format(rng.randint(100, 10 ** 9))
+    if kind == 1:
+        return '{}년 {}월 {}일'.format(rng.randint(1900, 2100), rng.randint(1, 12), rng.randint(1, 31))
+    if kind == 2:
+        return '010-{:04d}-{:04d}'.format(rng.randint(0, 9999), rng.randint(0, 9999))
+    if kind == 3:
+        return '{}.{}%'.format(rng.randint(0, 100), rng.randint(0, 99))
+    if kind == 4:
+        return '{}kg'.format(rng.randint(1, 500))
+    if kind == 5:
+        return '${}'.format(rng.randint(1, 10 ** 6))
+    if kind == 6:
+        return str(rng.randint(0, 10 ** rng.randint(1, 15)))
+    return '{}시 {}분'.format(rng.randint(0, 23), rng.randint(0, 59))
+
+
+def _korean_text(rng, words, n_words, number_share=.05):
+    text = []
+    for _ in range(n_words):
+        kind = rng.random()
+        if kind < number_share:
+            word = _number(rng)
+        elif kind < .75:
+            word = rng.choice(words)
+        else:
+            word = ''.join(chr(rng.randint(0xAC00, 0xD7A3)) for _ in range(rng.randint(1, 4)))
+        if rng.random() < .1:
+            word += rng.choice(['.', ',', '?', '!'])
+        text.append(word)
+    return ' '.join(text) + '.'
+
+
+def _english_text(rng, n_words):
+    text = [rng.choice(['Mr.', 'Dr.', 'Mrs.', 'St.', 'The'])]
+    for _ in range(n_words):
+        kind = rng.random()
+        if kind < .1:
+            word = rng.choice(['${}.{:02d}'.format(rng.randint(1, 10 ** 4), rng.randint(0, 99)),
+                               '{}th'.format(rng.randint(4, 99)), '{:,}'.format(rng.randint(1000, 10 ** 7)),
+                               '£{}'.format(rng.randint(1, 999)), '{}.{}'.format(rng.randint(0, 99), rng.randint(0, 9))])
+        else:
+            word = rng.choice(_english_words)
+        text.append(word)
+    return ' '.join(text) + '.'
+
+
+def make_corpus(n_texts=300, sentences='sentences.txt', seed=0):
+    '''
+    [n_texts] texts of each generated kind and the sample sentences
+
+    Returns:
+        - A dict {kind: list of texts}
+    '''
+    rng = random.Random(seed)
+    words = example_words(_rulebook)
+    samples = list(hparams.sentences)
+    if sentences is not None and os.path.exists(sentences):
+        with open(sentences, encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        words += ' '.join(lines).split()
+        samples += lines
+    return {
+        'word': [_korean_text(rng, words, rng.randint(1, 3)) for _ in range(n_texts)],
+        'sentence': [_korean_text(rng, words, rng.randint(5, 20)) for _ in range(n_texts)],
+        'paragraph': [_korean_text(rng, words, rng.randint(60, 200)) for _ in range(max(1, n_texts // 10))],
+        'numbers': [_korean_text(rng, words, rng.randint(3, 12), number_share=.5) for _ in range(n_texts)],
+        'sample': samples,
+        'english': [_english_text(rng, rng.randint(5, 30)) for _ in range(n_texts)],
+    }
+
+
+def _convertible(text, hparams):
+    try:
+        HangulUtils.hangul_to_sequence(hparams.base_dir, text, hparams.hangul_type)
+        return True
+    except KeyError:  # symbols out of the table (e.g. latin letters)
+        return False
+
+
+def stages(hparams):
+    '''
+    Front-end stages to measure: {name: (function of a text, corpus kinds, input preparation out of the measure)}
+    '''
+    def normalized(text):
+        return HangulUtils.normalize_text(text) + '␃'
+
+    return {
+        'normalize_text': (HangulUtils.normalize_text, KOREAN_KINDS, None),
+        'number_to_hangul': (HangulUtils.number_to_hangul, KOREAN_KINDS, None),
+        'runKoG2P': (lambda text: runKoG2P(text, _rulebook), KOREAN_KINDS, normalized),
+        'hangul_to_sequence': (lambda text: HangulUtils.hangul_to_sequence(hparams.base_dir, text, hparams.hangul_type),
+                               KOREAN_KINDS, None),
+        'english_cleaners': (TextPreprocessing.english_cleaners, ENGLISH_KINDS, None),
+        'basic_cleaners': (TextPreprocessing.basic_cleaners, ENGLISH_KINDS, None),
+    }
+
+
+def measure(function, texts, repeat=3):
+    '''Throughput and per call latency of [function] over [texts], called [repeat] times on each'''
+    function(texts[0])  # rulebook, tables... loaded out of the measure
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            call_start = time.perf_counter()
+            function(text)
+            latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+    latencies = np.asarray(latencies) * 1e6
+    result = {'texts': len(texts), 'calls': len(latencies), 'seconds': seconds,
+              'sentences_per_second': len(latencies) / seconds,
+              'chars_per_second': repeat * sum(len(text) for text in texts) / seconds,
+              'max_us': float(latencies.max())}
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        result['p{}_us'.format(percentile)] = float(value)
+    return result
+
+
+def environment():
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__}
+
+
+def compare(results, baseline, max_regression):
+    '''Relative throughput change of every (stage, kind) of [results] also in [baseline], and the regressed ones'''
+    previous = {(r['stage'], r['kind']): r for r in baseline.get('stages', [])}
+    changes, regressions = [], []
+    for r in results['stages']:
+        before = previous.get((r['stage'], r['kind']))
+        if before is None:
+            continue
+        change = r['sentences_per_second'] / before['sentences_per_second'] - 1
+        changes.append({'stage': r['stage'], 'kind': r['kind'], 'change': change})
+        if change < -max_regression:
+            regressions.append('{}/{}'.format(r['stage'], r['kind']))
+    return changes, regressions
+
+
+def benchmark(args, hparams):
+    corpus = make_corpus(args.n_texts, args.sentences, args.seed)
+    # the korean stages are measured on the texts the front-end converts (it raises on latin letters)
+    dropped = {}
+    for kind in KOREAN_KINDS:
+        texts = [text for text in corpus[kind] if _convertible(text, hparams)]
+        dropped[kind], corpus[kind] = len(corpus[kind]) - len(texts), texts
+    results = {'corpus': {kind: {'texts': len(texts), 'chars': sum(len(text) for text in texts),
+                                 'dropped': dropped.get(kind, 0)} for kind, texts in corpus.items()},
+               'hparams': {'hangul_type': hparams.hangul_type,
+                           'symbol_table_version': HangulUtils.symbol_table_version(hparams.base_dir)},
+               'environment': environment(), 'stages': []}
+    for name, (function, kinds, prepare) in stages(hparams).items():
+        if args.stages and name not in args.stages:
+            continue
+        for kind in kinds:
+            texts = [prepare(text) for text in corpus[kind]] if prepare is not None else corpus[kind]
+            if not texts:
+                continue
+            result = measure(function, texts, args.repeat)
+            result.update(stage=name, kind=kind)
+            results['stages'].append(result)
+    return results
+
+
+def report(results):
+    for kind, corpus in results['corpus'].items():
+        if corpus['dropped']:
+            print('  {}: {} texts the front-end cannot convert left out'.format(kind, corpus['dropped']))
+    print('\n  {:<20}{:<11}{:>7}{:>12}{:>12}{:>10}{:>10}{:>10}{:>11}'.format(
+        'stage', 'kind', 'texts', 'sent/s', 'chars/s', 'p50 us', 'p90 us', 'p99 us', 'max us'))
+    for r in results['stages']:
+        print('  {:<20}{:<11}{:>7}{:>12.1f}{:>12.0f}{:>10.1f}{:>10.1f}{:>10.1f}{:>11.1f}'.format(
+            r['stage'], r['kind'], r['texts'], r['sentences_per_second'], r['chars_per_second'], r['p50_us'],
+            r['p90_us'], r['p99_us'], r['max_us']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Text front-end latency benchmark')
+    parser.add_argument('--hparams', default='',
+                        help='Hyperparameter overrides as a comma-separated list of name=value pairs')
+    parser.add_argument('--n_texts', type=int, default=300, help='Generated texts of each kind (a tenth for paragraphs)')
+    parser.add_argument('--sentences', default='sentences.txt', help='Sample text file (one sentence per line)')
+    parser.add_argument('--repeat', type=int, default=3, help='Calls on every text')
+    parser.add_argument('--stages', default=None, help='Comma separated stages to run (default: all)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='json file the results are written to')
+    parser.add_argument('--baseline', default=None, help='json results of a previous run to compare with')
+    parser.add_argument('--max_regression', type=float, default=0.2,
+                        help='Relative throughput loss against the baseline which fails the benchmark')
+    args = parser.parse_args()
+    args.stages = args.stages.split(',') if args.stages else None
+    modified_hp = hparams.parse(args.hparams)
+
+    results = benchmark(args, modified_hp)
+    report(results)
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline, encoding='utf-8') as f:
+            changes, regressions = compare(results, json.load(f), args.max_regression)
+        results['baseline'] = {'path': args.baseline, 'changes': changes}
+        for change in changes:
+            print('  {} {}: {:+.1%} sent/s against {}'.format(change['stage'], change['kind'], change['change'],
+                                                             args.baseline))
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False, default=str)
+    if regressions:
+        print('Throughput regressed by more than {:.0%} for {}'.format(args.max_regression, ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
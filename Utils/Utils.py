@@ -2,6 +2,8 @@ import librosa
 import librosa.filters
 from scipy.io import wavfile
 from Utils.Hyperparams import hparams
+from Utils.AudioProcessing import silence
+from Utils.AudioProcessing import operators
 import os
 import numpy as np
 import tensorflow as tf
@@ -273,27 +275,16 @@ def save_wavenet_wav(wav, path, sr):
 
 # From https://github.com/r9y9/Wavenet_vocoder/blob/master/audio.py
 def start_and_end_indices(quantized, silence_threshold=2):
-    for start in range(quantized.size):
-        if abs(quantized[start] - 127) > silence_threshold:
-            break
-    for end in range(quantized.size - 1, 1, -1):
-        if abs(quantized[end] - 127) > silence_threshold:
-            break
-
-    assert abs(quantized[start] - 127) > silence_threshold
-    assert abs(quantized[end] - 127) > silence_threshold
-
-    return start, end
+    return silence.start_and_end_indices(quantized, silence_threshold)
 
 
 def trim_silence(wav, hparams):
     '''Trim leading and trailing silence
 
     Useful for M-AILABS dataset if we choose to trim the extra 0.5 silence at beginning and end.
+    Detection is configured by hparams.trim_method (see Utils/AudioProcessing/silence.py).
     '''
-    # Thanks @begeekmyfriend and @lautjy for pointing out the params contradiction. These params are separate and tunable per dataset.
-    return librosa.effects.trim(wav, top_db=hparams.trim_top_db, frame_length=hparams.trim_fft_size,
-                                hop_length=hparams.trim_hop_size)[0]
+    return silence.trim(wav, hparams)[0]
 
 
 def get_hop_size(hparams):
@@ -305,21 +296,15 @@ def get_hop_size(hparams):
 
 
 def _lws_processor(hparams):
-    import lws
-    return lws.lws(hparams.n_fft, get_hop_size(hparams), fftsize=hparams.win_size, mode="speech")
+    return operators.lws_processor(hparams)
 
 
 def _griffin_lim(S, hparams):
-    '''librosa implementation of Griffin-Lim
-    Based on https://github.com/librosa/librosa/issues/434
-    '''
-    angles = np.exp(2j * np.pi * np.random.rand(*S.shape))
-    S_complex = np.abs(S).astype(np.complex)
-    y = _istft(S_complex * angles, hparams)
-    for i in range(hparams.griffin_lim_iters):
-        angles = np.exp(1j * np.angle(_stft(y, hparams)))
-        y = _istft(S_complex * angles, hparams)
-    return y
+    '''Griffin-Lim reconstruction of a magnitude spectrogram [num_freq, frames] (see AudioProcessing/griffin_lim.py)'''
+    engine = operators.griffin_lim_engine(hparams)
+    wavs, iterations, errors = engine.run([S], hparams.griffin_lim_iters, momentum=hparams.griffin_lim_momentum,
+                                          tolerance=hparams.griffin_lim_tolerance)
+    return wavs[0]
 
 
 def _stft(y, hparams):
@@ -330,7 +315,8 @@ def _stft(y, hparams):
     if hparams.use_lws:
         return _lws_processor(hparams).stft(y).T
     else:
-        return librosa.stft(y=y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=hparams.win_size)
+        return librosa.stft(y=y, n_fft=hparams.n_fft, hop_length=get_hop_size(hparams), win_length=hparams.win_size,
+                            window=operators.window(hparams))
 
 
 def _istft(y, hparams):
@@ -363,28 +349,17 @@ def pad_lr(x, fsize, fshift):
 
 
 # Conversions
-_mel_basis = None
-_inv_mel_basis = None
-
-
 def _linear_to_mel(spectrogram, hparams):
-    global _mel_basis
-    if _mel_basis is None:
-        _mel_basis = _build_mel_basis(hparams)
-    return np.dot(_mel_basis, spectrogram)
+    return np.dot(operators.mel_basis(hparams), spectrogram)
 
 
 def _mel_to_linear(mel_spectrogram, hparams):
-    global _inv_mel_basis
-    if _inv_mel_basis is None:
-        _inv_mel_basis = np.linalg.pinv(_build_mel_basis(hparams))
-    return np.maximum(1e-10, np.dot(_inv_mel_basis, mel_spectrogram))
+    '''mel amplitudes to linear amplitudes, by pseudo-inverse or NNLS (hparams.mel_inversion)'''
+    return operators.mel_inverter(hparams)(mel_spectrogram)
 
 
 def _build_mel_basis(hparams):
-    assert hparams.fmax <= hparams.sample_rate // 2
-    return librosa.filters.mel(hparams.sample_rate, hparams.n_fft, n_mels=hparams.num_mels,
-                               fmin=hparams.fmin, fmax=hparams.fmax)
+    return operators.mel_basis(hparams)
 
 
 def _amp_to_db(x, hparams):
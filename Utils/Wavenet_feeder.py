@@ -5,6 +5,10 @@ import time
 import numpy as np
 import tensorflow as tf
 from Utils.Infolog import log
+from Utils import DatasetShards, ArtifactEncoding
+from Utils.MetadataIndex import MetadataIndex, WAVENET_LAYOUT, LAZY_LAYOUT
+from Utils.AudioProcessing.AudioPreprocess import wavenet_row
+from Utils.AudioProcessing.feature_cache import FeatureCache, is_lazy_metadata
 from keras.utils import np_utils
 from sklearn.model_selection import train_test_split
 from Utils.Hyperparams import hparams
@@ -25,7 +29,6 @@ class Feeder:
 		self._coord = coordinator
 		self._hparams = hparams
 		self._train_offset = 0
-		self._test_offset = 0
 
 		if hparams.symmetric_mels:
 			self._spec_pad = -(hparams.max_abs_value + .1)
@@ -37,8 +40,12 @@ class Feeder:
 
 		#Load metadata
 		self._data_dir = os.path.dirname(metadata_filename)
-		with open(metadata_filename, 'r') as f:
-			self._metadata = [line.strip().split('|') for line in f]
+		#lazy.txt (AudioPreprocess.py --lazy) points at the source wavs, features are extracted when first sampled
+		self._cache = None
+		if is_lazy_metadata(metadata_filename):
+			self._cache = FeatureCache(self._data_dir, hparams)
+		#Lines are read from the memory mapped metadata file when their utterance is loaded
+		self._metadata = MetadataIndex(metadata_filename, LAZY_LAYOUT if self._cache else WAVENET_LAYOUT)
 
 		#Train test split
 		if hparams.wavenet_test_size is None:
@@ -46,7 +53,12 @@ class Feeder:
 
 		test_size = (hparams.wavenet_test_size if hparams.wavenet_test_size is not None
 			else hparams.wavenet_test_batches * hparams.wavenet_batch_size)
-		indices = np.arange(len(self._metadata))
+		#Utterances longer than max_mel_frames (e.g. preprocessed with other hparams) are left out
+		#(lazy lengths are not trimmed yet, too long utterances are left out when they are extracted)
+		clip = hparams.clip_mels_length and self._cache is None
+		indices = self._metadata.select(max_mel_frames=hparams.max_mel_frames if clip else None)
+		if len(indices) < len(self._metadata):
+			log('Skipped {} examples longer than {} mel frames'.format(len(self._metadata) - len(indices), hparams.max_mel_frames))
 		train_indices, test_indices = train_test_split(indices,
 			test_size=test_size, random_state=hparams.wavenet_data_random_state)
 
@@ -56,8 +68,9 @@ class Feeder:
 		test_indices = test_indices[:len_test_indices]
 		train_indices = np.concatenate([train_indices, extra_test])
 
-		self._train_meta = list(np.array(self._metadata)[train_indices])
-		self._test_meta = list(np.array(self._metadata)[test_indices])
+		#Indices of metadata lines
+		self._train_meta = train_indices
+		self._test_meta = test_indices
 
 		self.test_steps = len(self._test_meta) // hparams.wavenet_batch_size
 
@@ -162,32 +175,6 @@ class Feeder:
 		thread.daemon = True #Thread will close when parent quits
 		thread.start()
 
-	def _get_test_groups(self):
-		meta = self._test_meta[self._test_offset]
-		self._test_offset += 1
-
-		if self._hparams.train_with_GTA:
-			mel_file = meta[2]
-		else:
-			mel_file = meta[1]
-		audio_file = meta[0]
-
-		input_data = np.load(os.path.join(self._base_dir, audio_file))
-
-		if self.local_condition:
-			local_condition_features = np.load(os.path.join(self._base_dir, mel_file))
-		else:
-			local_condition_features = None
-
-		if self.global_condition:
-			global_condition_features = meta[3]
-			if global_condition_features == '<no_g>':
-				raise RuntimeError('Please redo the wavenet preprocessing (or GTA synthesis) to assign global condition features!')
-		else:
-			global_condition_features = None
-
-		return (input_data, local_condition_features, global_condition_features, len(input_data))
-
 	def make_test_batches(self):
 		start = time.time()
 
@@ -195,24 +182,36 @@ class Feeder:
 		n = 1
 
 		#Test on entire test set (one sample at an evaluation step)
-		examples = [self._get_test_groups() for i in range(len(self._test_meta))]
+		examples = self._get_examples(self._test_meta)
 		batches = [examples[i: i+n] for i in range(0, len(examples), n)]
 		np.random.shuffle(batches)
 
 		log('\nGenerated {} test batches of size {} in {:.3f} sec'.format(len(batches), n, time.time() - start))
 		return batches
 
+	def _next_train_group(self):
+		'''Metadata line indices of the next group of training examples, bucketed based on similar output length for
+		efficiency (sorted on the index before loading, GTA rows without lengths keep their order), and their lines
+		(see _submit_examples)
+		'''
+		n = self._hparams.wavenet_batch_size
+		indices = self._metadata.sort_by_length([self._next_train_index() for i in range(n * _batches_per_group)],
+			field='time_steps')
+		return indices, self._submit_examples(indices)
+
 	def _enqueue_next_train_group(self):
+		group = self._next_train_group()
 		while not self._coord.should_stop():
 			start = time.time()
 
 			# Read a group of examples
 			n = self._hparams.wavenet_batch_size
-			examples = [self._get_next_example() for i in range(n * _batches_per_group)]
+			examples = self._get_examples(*group)
+			# the features of the next group (lazy.txt) are extracted while this one is fed to the model
+			group = self._next_train_group()
 
-			# Bucket examples base on similiar output length for efficiency
-			examples.sort(key=lambda x: x[-1])
-			batches = [examples[i: i+n] for i in range(0, len(examples), n)]
+			# full batches only (lazy utterances without features are left out of their group)
+			batches = [examples[i: i+n] for i in range(0, len(examples) - n + 1, n)]
 			np.random.shuffle(batches)
 
 			log('\nGenerated {} train batches of size {} in {:.3f} sec'.format(len(batches), n, time.time() - start))
@@ -222,32 +221,60 @@ class Feeder:
 
 	def _enqueue_next_test_group(self):
 		test_batches = self.make_test_batches()
+		if not test_batches:
+			# e.g. no lazy test utterance could be extracted: nothing to evaluate on (looping would spin)
+			log('No test batches, the evaluation queue is not fed')
+			return
 		while not self._coord.should_stop():
 			for batch in test_batches:
 				feed_dict = dict(zip(self._placeholders, self._prepare_batch(batch)))
 				self._session.run(self._eval_enqueue_op, feed_dict=feed_dict)
 
-	def _get_next_example(self):
-		'''Get a single example (input, output, len_output) from disk
+	def _next_train_index(self):
+		'''Get the metadata line index of the next training example, reshuffling after each epoch
 		'''
 		if self._train_offset >= len(self._train_meta):
 			self._train_offset = 0
 			np.random.shuffle(self._train_meta)
-		meta = self._train_meta[self._train_offset]
+		index = self._train_meta[self._train_offset]
 		self._train_offset += 1
+		return index
 
+	def _submit_examples(self, indices):
+		'''Read the metadata lines [indices] and start the feature extraction of the lazy ones, return the lines
+		'''
+		metas = [self._metadata.row(i) for i in indices]
+		if self._cache is not None:
+			self._cache.submit(metas)
+		return metas
+
+	def _get_examples(self, indices, metas=None):
+		'''Get the examples of metadata lines [indices] (read into [metas] by _submit_examples, or read here),
+		extracting the features of lazy lines on first use (lazy utterances without features, too long or unreadable,
+		are left out)
+		'''
+		if metas is None:
+			metas = [self._metadata.row(i) for i in indices]
+		if self._cache is not None:
+			metas = [wavenet_row(meta, self._data_dir) for meta in self._cache.rows(metas) if meta is not None]
+		return [self._get_example(meta) for meta in metas]
+
+	def _get_example(self, meta):
+		'''Get a single example (input, output, len_output) of a map.txt row from disk
+		'''
 		if self._hparams.train_with_GTA:
-			mel_file = meta[2]
+			mel_file, mel_kind = meta[2], 'gta'
 			if 'linear' in mel_file:
 				raise RuntimeError('Linear spectrogram files selected instead of GTA mels, did you specify the wrong metadata?')
 		else:
-			mel_file = meta[1]
+			mel_file, mel_kind = meta[1], 'mel'
 		audio_file = meta[0]
 
-		input_data = np.load(os.path.join(self._base_dir, audio_file))
+		encodings = ArtifactEncoding.parse(meta)
+		input_data = self._load(audio_file, 'audio', encodings.get('audio'))
 
 		if self.local_condition:
-			local_condition_features = np.load(os.path.join(self._base_dir, mel_file))
+			local_condition_features = self._load(mel_file, 'mel', encodings.get(mel_kind))
 		else:
 			local_condition_features = None
 
@@ -260,6 +287,10 @@ class Feeder:
 
 		return (input_data, local_condition_features, global_condition_features, len(input_data))
 
+	def _load(self, filename, kind, spec):
+		'''Load an artifact of the dataset, decoded to float32 when stored with an [spec] encoding'''
+		return ArtifactEncoding.decode(DatasetShards.load(os.path.join(self._base_dir, filename), kind), spec)
+
 
 	def _prepare_batch(self, batch):
 		np.random.shuffle(batch)
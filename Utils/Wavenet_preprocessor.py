@@ -4,6 +4,8 @@ from functools import partial
 
 import numpy as np
 from Utils.AudioProcessing import AudioPreprocess as audio
+from Utils.AudioProcessing import silence
+from Utils import ArtifactEncoding
 from Utils.Utils import is_mulaw, is_mulaw_quantize, mulaw, mulaw_quantize
 
 
@@ -33,7 +35,16 @@ def build_from_path(hparams, input_dir, mel_dir, wav_dir, n_jobs=12, tqdm=lambda
 		basename = os.path.basename(wav_path).replace('.wav', '')
 		futures.append(executor.submit(partial(_process_utterance, mel_dir, wav_dir, basename, wav_path, hparams)))
 
-	return [future.result() for future in tqdm(futures) if future.result() is not None]
+	metadata = []
+	trimmed_samples = 0
+	for future in tqdm(futures):
+		row, trimmed = future.result()
+		trimmed_samples += trimmed
+		if row is not None:
+			metadata.append(row)
+	silence.print_stats(trimmed_samples, sum(row[4] for row in metadata), hparams.sample_rate,
+						audio.get_hop_size(hparams))
+	return metadata
 
 
 def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
@@ -53,19 +64,26 @@ def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
 		- hparams: hyper parameters
 
 	Returns:
-		- A tuple: (audio_filename, mel_filename, linear_filename, time_steps, mel_frames, linear_frames, text)
+		- A tuple (row, trimmed_samples):
+			- row: (audio_filename, mel_filename, mel_filename, speaker_id, time_steps, mel_frames), None when the
+				utterance is skipped. An encoding column is appended when some artifacts are not float32
+			- trimmed_samples: number of samples of leading and trailing silence removed
 	"""
 	try:
+		# Recordings too long for max_mel_frames are skipped without loading them
+		if audio.exceeds_max_frames(wav_path, hparams):
+			return None, 0
 		# Load the audio as numpy array
 		wav = audio.load_wav(wav_path, sr=hparams.sample_rate)
 	except FileNotFoundError: #catch missing wav exception
 		print('file {} present in csv metadata is not present in wav folder. skipping!'.format(
 			wav_path))
-		return None
+		return None, 0
 
 	#M-AILABS extra silence specific
+	trimmed_samples = 0
 	if hparams.trim_silence:
-		wav = audio.trim_silence(wav, hparams)
+		wav, trimmed_samples = silence.trim(wav, hparams)
 
 	#Pre-emphasize
 	preem_wav = audio.preemphasis(wav, hparams.preemphasis, hparams.preemphasize)
@@ -88,6 +106,7 @@ def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
 
 		#Trim silences
 		start, end = audio.start_and_end_indices(out, hparams.silence_threshold)
+		trimmed_samples += len(wav) - (end - start)
 		wav = wav[start: end]
 		preem_wav = preem_wav[start: end]
 		out = out[start: end]
@@ -112,7 +131,7 @@ def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
 	mel_frames = mel_spectrogram.shape[1]
 
 	if mel_frames > hparams.max_mel_frames and hparams.clip_mels_length:
-		return None
+		return None, trimmed_samples
 
 	if hparams.use_lws:
 		#Ensure time resolution adjustement between audio and mel-spectrogram
@@ -140,8 +159,10 @@ def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
 	# Write the spectrogram and audio to disk
 	audio_filename = os.path.join(wav_dir, 'audio-{}.npy'.format(index))
 	mel_filename = os.path.join(mel_dir, 'mel-{}.npy'.format(index))
-	np.save(audio_filename, out.astype(out_dtype), allow_pickle=False)
-	np.save(mel_filename, mel_spectrogram.T, allow_pickle=False)
+	artifacts, encodings = audio.encode_artifacts(
+		[('audio', audio_filename, out.astype(out_dtype)), ('mel', mel_filename, mel_spectrogram.T)], hparams)
+	for kind, filename, data in artifacts:
+		np.save(filename, data, allow_pickle=False)
 
 	#global condition features
 	if hparams.gin_channels > 0:
@@ -150,5 +171,9 @@ def _process_utterance(mel_dir, wav_dir, index, wav_path, hparams):
 	else:
 		speaker_id = '<no_g>'
 
-	# Return a tuple describing this training example
-	return (audio_filename, mel_filename, mel_filename, speaker_id, time_steps, mel_frames)
+	# Return a tuple describing this training example, the mel file also is the local condition file of the third column
+	encoding_column = ArtifactEncoding.format_column(encodings + [('gta', spec) for kind, spec in encodings if kind == 'mel'])
+	row = (audio_filename, mel_filename, mel_filename, speaker_id, time_steps, mel_frames)
+	if encoding_column is not None:
+		row += (encoding_column, )
+	return row, trimmed_samples
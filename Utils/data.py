@@ -2,6 +2,8 @@ import torch
 from torch.utils.data import Dataset
 import numpy as np
 import os
+from Utils import DatasetShards, ArtifactEncoding
+from Utils.MetadataIndex import MetadataIndex, FLOWAVENET_LAYOUT
 
 max_time_steps = 16000
 upsample_conditional_features = True
@@ -9,19 +11,25 @@ hop_length = 256
 
 
 class LJspeechDataset(Dataset):
-    def __init__(self, data_root, train=True, test_size=0.05):
+    def __init__(self, data_root, train=True, test_size=0.05, metadata="train.txt"):
         self.data_root = data_root
-        self.lengths = []
         self.train = train
         self.test_size = test_size
-        self.paths = [self.collect_files(0), self.collect_files(1)]
+        # binary index of the metadata file (train.txt of Flowavenet/preprocessing.py, or flowavenet.txt written
+        # next to the Tacotron artifacts), lines are read from the memory mapped file when their utterance is loaded
+        self.metadata = MetadataIndex(os.path.join(self.data_root, metadata), FLOWAVENET_LAYOUT)
+        self.indices = np.asarray(self.interest_indices(np.arange(len(self.metadata))), dtype=np.int64)
+        self.lengths = self.metadata.records['time_steps'][self.indices].astype(np.int64)
 
     def __len__(self):
-        return len(self.paths[0])
+        return len(self.indices)
 
     def __getitem__(self, idx):
-        wav = np.load(self.paths[0][idx])
-        mel = np.load(self.paths[1][idx])
+        meta = self.metadata.row(self.indices[idx])
+        assert len(meta) in (4, 5)  # optional encoding column
+        encodings = ArtifactEncoding.parse(meta)
+        wav = ArtifactEncoding.decode(DatasetShards.load(os.path.join(self.data_root, meta[0]), 'audio'), encodings.get('audio'))
+        mel = ArtifactEncoding.decode(DatasetShards.load(os.path.join(self.data_root, meta[1]), 'mel'), encodings.get('mel'))
         return wav, mel
 
     def interest_indices(self, paths):
@@ -30,26 +38,6 @@ class LJspeechDataset(Dataset):
                                       range(len(paths) - test_num_samples, len(paths))
         return train_indices if self.train else test_indices
 
-    def collect_files(self, col):
-        #### todo: reformat file and paths to point to current melspectrogram path
-        meta = os.path.join(self.data_root, "train.txt")
-        with open(meta, "rb") as f:
-            lines = f.readlines()
-        l = lines[0].decode("utf-8").split("|")
-        assert len(l) == 4
-        self.lengths = list(
-            map(lambda l: int(l.decode("utf-8").split("|")[2]), lines))
-
-        paths = list(map(lambda l: l.decode("utf-8").split("|")[col], lines))
-        paths = list(map(lambda f: os.path.join(self.data_root, f), paths))
-
-        # Filter by train/test
-        indices = self.interest_indices(paths)
-        paths = list(np.array(paths)[indices])
-        self.lengths = list(np.array(self.lengths)[indices])
-        self.lengths = list(map(int, self.lengths))
-        return paths
-
 
 def _pad(seq, max_len, constant_values=0):
     return np.pad(seq, (0, max_len - len(seq)),
@@ -62,11 +50,18 @@ def _pad_2d(x, max_len, b_pad=0):
     return x
 
 
-def collate_fn(batch):
+def frame_multiple(hop_length, n_block):
+    """Number of mel frames the utterances are cut to a multiple of, so that their time steps divide by 2 ** n_block"""
+    return 2 ** n_block // np.gcd(hop_length, 2 ** n_block)
+
+
+def collate_fn(batch, hop_length=hop_length, max_time_steps=max_time_steps, frame_multiple=1):
     """
     Create batch
 
     Args : batch(tuple) : List of tuples / (x, c)  x : list of (T,) c : list of (T, D)
+           hop_length, max_time_steps : Optional, for mels of other frame parameters (see functools.partial)
+           frame_multiple : Optional, utterances are cut to a multiple of frame_multiple mel frames
 
     Returns : Tuple of batch / Network inputs x (B, C, T), Network targets (B, T, 1)
     """
@@ -80,7 +75,8 @@ def collate_fn(batch):
             if upsample_conditional_features:
                 assert len(x) % len(c) == 0 and len(x) // len(c) == hop_length
 
-                max_steps = max_time_steps - max_time_steps % hop_length  # To ensure Divisibility
+                max_steps = max_time_steps - max_time_steps % (hop_length * frame_multiple)  # To ensure Divisibility
+                max_steps = max(max_steps, hop_length * frame_multiple)
 
                 if len(x) > max_steps:
                     max_time_frames = max_steps // hop_length
@@ -89,6 +85,9 @@ def collate_fn(batch):
                     x = x[ts:ts + hop_length * max_time_frames]
                     c = c[s:s + max_time_frames]
                     assert len(x) % len(c) == 0 and len(x) // len(c) == hop_length
+                elif len(c) % frame_multiple:
+                    c = c[:len(c) - len(c) % frame_multiple]
+                    x = x[:len(c) * hop_length]
             else:
                 pass
             new_batch.append((x, c))
@@ -117,11 +116,12 @@ def collate_fn(batch):
     return x_batch, c_batch
 
 
-def collate_fn_synthesize(batch):
+def collate_fn_synthesize(batch, hop_length=hop_length):
     """
     Create batch
 
     Args : batch(tuple) : List of tuples / (x, c)  x : list of (T,) c : list of (T, D)
+           hop_length : Optional, for mels of other frame parameters (see functools.partial)
 
     Returns : Tuple of batch / Network inputs x (B, C, T), Network targets (B, T, 1)
     """